@@ -1,10 +1,19 @@
 
 import adsk.core, adsk.fusion, traceback
+import os
+import sys
+
+# Fusion doesn't put the script folder on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from point_ingest import load_points
 
 SPLINE = True
 DOWNSAMPLE = 20  # Integer >= 1
 CONSTRAIN = False
 SCALE_FACTOR = 1.024  # a percent. e.g. 1.01 means scale up by 1% in all directions
+# take the points of the image last used in a running trace_service.py instead of picking a file, e.g.
+# "http://127.0.0.1:8765" or "unix:/tmp/cadlasso.sock". None to pick a file
+TRACE_SERVICE = None
 
 
 def fprint(ui, message):
@@ -27,40 +36,24 @@ def run(context):
             ui.messageBox('No active Fusion design', title)
             return
 
-        dlg = ui.createFileDialog()
-        dlg.title = 'Open CSV File'
-        dlg.filter = 'Comma Separated Values (*.csv);;All Files (*.*)'
-        if dlg.showOpen() != adsk.core.DialogResults.DialogOK:
-            return
+        if TRACE_SERVICE is not None:
+            # only needed (and only has to be next to the script) when taking points from the service
+            from trace_client import fetch_points
+            points = fetch_points(TRACE_SERVICE, "latest", DOWNSAMPLE, SCALE_FACTOR)
+        else:
+            dlg = ui.createFileDialog()
+            dlg.title = 'Open CSV File'
+            dlg.filter = 'Point Files (*.csv *.csv.gz *.npy *.f32);;Comma Separated Values (*.csv);;All Files (*.*)'
+            if dlg.showOpen() != adsk.core.DialogResults.DialogOK:
+                return
+            points = load_points(dlg.filename, DOWNSAMPLE, SCALE_FACTOR)
 
         point_objects = adsk.core.ObjectCollection.create()
 
-        filename = dlg.filename
-        f = open(filename, 'r')
-        line = f.readline()
-        data = []
-        sample_count = 0
-        while line:
-            pntStrArr = line.split(',')
-            for pntStr in pntStrArr:
-                data.append(float(pntStr))
-
-            if len(data) == 2:
-
-                sample_count += 1
-                if sample_count % DOWNSAMPLE == 0:
-                    point_x = data[0]
-                    point_y = data[1]
-
-                    point_x *= SCALE_FACTOR
-                    point_y *= SCALE_FACTOR
-
-                    point = adsk.core.Point3D.create(point_x, point_y, 0)  # all our points are 2D
-                    point_objects.add(point)
+        for point_x, point_y in points:
+            point = adsk.core.Point3D.create(point_x, point_y, 0)  # all our points are 2D
+            point_objects.add(point)
 
-            line = f.readline()
-            data.clear()
-        f.close()
         root = design.rootComponent
 
         if root.sketches.count > 0:
@@ -0,0 +1,81 @@
+# Reading, decimating and scaling of point files for FUSION_Import_Points. Only uses the standard library (numpy isn't
+# available inside Fusion 360) and doesn't need adsk, so it can be used and benchmarked outside of Fusion.
+
+import array
+import ast
+import gzip
+import itertools
+import sys
+
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def read_text_points(f, downsample):
+    # only lines with an x and a y count as points, like the original reader. Lines that are skipped by the
+    # downsampling are split but never converted to floats
+    rows = (line.split(",") for line in f)
+    rows = (row for row in rows if len(row) == 2)
+    return [(float(x), float(y)) for x, y in itertools.islice(rows, downsample - 1, None, downsample)]
+
+
+def pair_points(values, downsample):
+    # values is a flat x, y, x, y, ... array
+    xs = values[2 * (downsample - 1)::2 * downsample]
+    ys = values[2 * (downsample - 1) + 1::2 * downsample]
+    return list(zip(xs, ys))
+
+
+def read_float32_values(f):
+    # flat values of a raw little endian float32 file
+    values = array.array("f")
+    data = f.read()
+    values.frombytes(data[:len(data) - len(data) % 4])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def read_npy_values(f):
+    # flat values of a float32 or float64 .npy file written by the exporters (C order, little endian)
+    if f.read(6) != NPY_MAGIC:
+        raise ValueError("Not a .npy file")
+    major_version = f.read(2)[0]
+    header_length_size = 2 if major_version == 1 else 4
+    header_length = int.from_bytes(f.read(header_length_size), "little")
+    header = ast.literal_eval(f.read(header_length).decode("latin1"))
+    if header["fortran_order"]:
+        raise ValueError("Fortran ordered .npy files are not supported")
+
+    typecodes = {"<f4": "f", "<f8": "d"}
+    if header["descr"] not in typecodes:
+        raise ValueError("Unsupported .npy data type: %s" % header["descr"])
+    values = array.array(typecodes[header["descr"]])
+    values.frombytes(f.read())
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def read_points(filename, downsample=1):
+    # every downsample-th point (the last of each group of downsample points) as a list of (x, y)
+    lower = filename.lower()
+    if lower.endswith(".npy"):
+        with open(filename, "rb") as f:
+            return pair_points(read_npy_values(f), downsample)
+    elif lower.endswith(".f32"):
+        with open(filename, "rb") as f:
+            return pair_points(read_float32_values(f), downsample)
+    elif lower.endswith(".gz"):
+        with gzip.open(filename, "rt") as f:
+            return read_text_points(f, downsample)
+    else:
+        with open(filename, "r", buffering=1024 * 1024) as f:
+            return read_text_points(f, downsample)
+
+
+def scale_points(points, scale_factor):
+    return [(x * scale_factor, y * scale_factor) for x, y in points]
+
+
+def load_points(filename, downsample=1, scale_factor=1.0):
+    return scale_points(read_points(filename, downsample), scale_factor)
@@ -0,0 +1,71 @@
+# Client for CADLasso's trace_service.py, so FUSION_Import_Points can take points straight from a running service
+# instead of a saved file. Only uses the standard library, like point_ingest.
+#
+# A service is "http://host:port" or "unix:/path/to/socket".
+
+import http.client
+import io
+import json
+import socket
+
+from point_ingest import pair_points
+from point_ingest import read_float32_values
+from point_ingest import scale_points
+
+SERVICE_TIMEOUT = 60  # seconds. Loading a big image for the first time can take a while
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_location, timeout=SERVICE_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_location = socket_location
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_location)
+
+
+def connect(service, timeout=SERVICE_TIMEOUT):
+    if service.startswith("unix:"):
+        return UnixHTTPConnection(service[len("unix:"):], timeout)
+    if service.startswith("http://"):
+        service = service[len("http://"):]
+    return http.client.HTTPConnection(service.rstrip("/"), timeout=timeout)
+
+
+def request(service, method, path, values=None):
+    # (response headers, body bytes). Raises RuntimeError with the service's message if the request failed
+    connection = connect(service)
+    try:
+        body = json.dumps(values) if values is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            try:
+                message = json.loads(data)["error"]
+            except (ValueError, KeyError):
+                message = data.decode(errors="replace")
+            raise RuntimeError("Tracing service: %s (%d)" % (message, response.status))
+        return response.headers, data
+    finally:
+        connection.close()
+
+
+def request_json(service, method, path, values=None):
+    return json.loads(request(service, method, path, values)[1])
+
+
+def load_image(service, image_location, downsample=1):
+    # image info, including its id
+    return request_json(service, "POST", "/images", {"path": image_location, "downsample": downsample})
+
+
+def fetch_points(service, image_id="latest", downsample=1, scale_factor=1.0):
+    # every downsample-th point of the image's lasso in cm, scaled like load_points does for files
+    _, data = request(service, "GET", "/images/%s/points?format=float32" % image_id)
+    points = pair_points(read_float32_values(io.BytesIO(data)), downsample)
+    return scale_points(points, scale_factor)
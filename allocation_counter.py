@@ -0,0 +1,46 @@
+import tracemalloc
+
+LARGE_ALLOCATION_SIZE = 256 * 1024  # bytes. About a tenth of a window sized frame
+
+
+class AllocationCounter:
+    # Counts the frames that allocate a lot of memory while they are rendered, to check that frames are drawn into the
+    # viewer's frame buffers instead of new arrays. A frame's allocation is how far the traced memory rose above where
+    # it started (numpy and OpenCV arrays are traced too), so short lived temporary arrays count as well. Uses
+    # tracemalloc, which slows everything down, so it is only for debugging and does nothing until it is enabled
+
+    def __init__(self, enabled=False, large_size=LARGE_ALLOCATION_SIZE):
+        self.enabled = enabled
+        self.large_size = large_size
+        self.frames = 0
+        self.large_frames = 0  # frames that allocated at least large_size bytes
+        self.largest = 0  # bytes allocated by the frame that allocated the most
+        self.last = 0  # bytes allocated by the last frame
+
+    def start_frame(self):
+        # returns the traced memory at the start of the frame to pass to end_frame, or None while counting is off
+        if not self.enabled:
+            return None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self, frame_start):
+        if frame_start is None:
+            return
+        self.last = max(tracemalloc.get_traced_memory()[1] - frame_start, 0)
+        self.frames += 1
+        self.largest = max(self.largest, self.last)
+        if self.last >= self.large_size:
+            self.large_frames += 1
+
+    def reset(self):
+        self.frames = 0
+        self.large_frames = 0
+        self.largest = 0
+        self.last = 0
+
+    def get_summary(self):
+        return "%d frames, %d allocated %d KB or more (largest %d KB)" % (
+            self.frames, self.large_frames, self.large_size // 1024, self.largest // 1024)
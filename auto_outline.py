@@ -0,0 +1,258 @@
+import hashlib
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ways of separating the object from the background
+OTSU_METHOD = "otsu"  # one global brightness threshold
+ADAPTIVE_METHOD = "adaptive"  # regions enclosed by local brightness changes (uneven lighting)
+GRABCUT_METHOD = "grabcut"  # color models of the object and background (busy backgrounds, works best with a box)
+AUTO_OUTLINE_METHODS = (OTSU_METHOD, ADAPTIVE_METHOD, GRABCUT_METHOD)
+
+AUTO_OUTLINE_MAX_PIXELS = 1000 * 1000  # the object is found on a copy of the image downscaled to at most this size
+ADAPTIVE_BLOCK_FRACTION = 0.05  # neighbourhood of the adaptive threshold as a fraction of the image size
+ADAPTIVE_OFFSET = 2  # gray levels a pixel has to be darker than its neighbourhood to count as an edge
+GRABCUT_ITERATIONS = 5
+GRABCUT_UPDATE_ITERATIONS = 1  # iterations when the last GrabCut is only updated with a new seed
+GRABCUT_BORDER_FRACTION = 0.02  # edge of the image that is taken to be background when there is no box
+GRABCUT_SEED_RADIUS = 3  # pixels of the downscaled copy around a seed that are taken to be the object
+REFINE_MARGIN = 4  # pixels on top of the downscaling factor that the outline may move when it is refined
+REFINE_TILE_SIZE = 1024  # pixels. The outline is refined one tile at a time and tiles are cached
+MAX_CACHED_TILES = 64
+
+
+def fill_object(mask, seed=None):
+    # the object as a filled mask (holes included) from the connected mask of its pixels, plus its outer contour. The
+    # outer contour that contains the seed (or the biggest one) is the object
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if len(contours) == 0:
+        return None, None
+    contour = None
+    if seed is not None:
+        inside = [contour for contour in contours if cv2.pointPolygonTest(contour, seed, False) >= 0]
+        contour = inside[0] if len(inside) > 0 else None
+    if contour is None:
+        contour = max(contours, key=cv2.contourArea)
+    filled = np.zeros_like(mask)
+    cv2.drawContours(filled, [contour], -1, 255, cv2.FILLED)
+    return filled, contour
+
+
+def get_block_size(image):
+    # neighbourhood (odd, in pixels) of the adaptive threshold
+    return int(min(image.shape[:2]) * ADAPTIVE_BLOCK_FRACTION) // 2 * 2 + 3
+
+
+def find_segments(image, method):
+    # connected regions of a thresholded image. Both sides of the threshold get labels, so clicking on a dark object on
+    # a light background works as well as the other way around
+    gray = cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    if method == OTSU_METHOD:
+        _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    else:
+        binary = cv2.adaptiveThreshold(gray, 1, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                       get_block_size(image), ADAPTIVE_OFFSET)
+    count_1, labels_1, stats_1, _ = cv2.connectedComponentsWithStats(binary)
+    count_0, labels_0, stats_0, _ = cv2.connectedComponentsWithStats(1 - binary)
+    # label 0 of each is the other side of the threshold
+    labels = np.where(binary > 0, labels_1, labels_0 + count_1)
+    stats = np.concatenate((stats_1, stats_0))
+    stats[[0, count_1]] = 0
+    return labels, stats
+
+
+class AutoOutline:
+    # Outlines a whole object from one click on it (or a box around it). The object is found on a downscaled copy of
+    # the image, so it takes about the same time however big the image is, and its outline is then refined at full
+    # resolution in a band around the downscaled outline. The segmentation of the copy and the refined tiles are cached,
+    # so clicking again somewhere else on the same object is almost free and moving the seed of a GrabCut only refines
+    # the tiles where the outline changed
+
+    def __init__(self, pyramid, max_pixels=AUTO_OUTLINE_MAX_PIXELS):
+        self.pyramid = pyramid
+        self.max_pixels = max_pixels
+
+        # downscaled copy of the image, made when first needed
+        self.image = None
+        self.scale = None  # image pixels per pixel of the copy
+        self.segments = {}  # method -> (labels, stats) of the thresholded copy
+        self.grabcut = None  # (box, mask, background model, foreground model) of the last GrabCut
+        self.refined_tiles = OrderedDict()  # (x, y, hash of the downscaled mask around the tile) -> refined tile
+
+    def get_image(self):
+        if self.image is None:
+            # the biggest pyramid level that is small enough, downscaled further if none of them are
+            level = 0
+            while level < len(self.pyramid) - 1 and self.pyramid[level].shape[0] * self.pyramid[level].shape[1] > \
+                    self.max_pixels:
+                level += 1
+            image = np.asarray(self.pyramid[level])
+            while image.shape[0] * image.shape[1] > self.max_pixels:
+                image = cv2.pyrDown(image)
+                level += 1
+            self.image = image
+            self.scale = 1 << level
+        return self.image
+
+    def find_outline(self, seed=None, box=None, method=OTSU_METHOD):
+        # outer contour (N, 1, 2) of the object under the seed or inside the box (x0, y0, x1, y1), both in image
+        # pixels, or None if nothing was found
+        image = self.get_image()
+        height, width = image.shape[:2]
+        small_seed = None
+        if seed is not None:
+            small_seed = (min(int(seed[0] / self.scale), width - 1), min(int(seed[1] / self.scale), height - 1))
+        small_box = None
+        if box is not None:
+            x0, y0, x1, y1 = [int(round(value / self.scale)) for value in box]
+            small_box = (max(x0, 0), max(y0, 0), min(x1, width), min(y1, height))
+            if small_box[2] - small_box[0] < 2 or small_box[3] - small_box[1] < 2:
+                return None
+
+        if method == GRABCUT_METHOD:
+            mask = self.find_grabcut_mask(small_seed, small_box)
+        elif method in (OTSU_METHOD, ADAPTIVE_METHOD):
+            mask = self.find_segment_mask(method, small_seed, small_box)
+        else:
+            raise ValueError("Unknown auto outline method: %s" % method)
+        if mask is None:
+            return None
+
+        small_mask, _ = fill_object(mask, small_seed)
+        if small_mask is None:
+            return None
+        # the adaptive threshold leaves a rim of up to half its neighbourhood on the dark side of an edge, so the
+        # outline it finds can be that far off
+        uncertainty = get_block_size(image) // 2 + 1 if method == ADAPTIVE_METHOD else 1
+        return self.refine(small_mask, seed, uncertainty)
+
+    def find_segment_mask(self, method, seed, box):
+        if method not in self.segments:
+            self.segments[method] = find_segments(self.image, method)
+        labels, stats = self.segments[method]
+        if box is not None:
+            # the biggest region that is completely inside the box, or the one in the middle of it
+            x0, y0, x1, y1 = box
+            inside = (stats[:, cv2.CC_STAT_LEFT] >= x0) & (stats[:, cv2.CC_STAT_TOP] >= y0) & \
+                (stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] <= x1) & \
+                (stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] <= y1) & (stats[:, cv2.CC_STAT_AREA] > 0)
+            if np.any(inside):
+                label = np.flatnonzero(inside)[np.argmax(stats[inside, cv2.CC_STAT_AREA])]
+            else:
+                label = labels[(y0 + y1) // 2, (x0 + x1) // 2]
+        else:
+            label = labels[seed[1], seed[0]]
+        return (labels == label).astype(np.uint8)
+
+    def find_grabcut_mask(self, seed, box):
+        height, width = self.image.shape[:2]
+        if self.grabcut is not None and self.grabcut[0] == box:
+            # same box (or no box) as last time, so only the seed is new: start from the last result
+            _, mask, background_model, foreground_model = self.grabcut
+            mask = mask.copy()
+            iterations = GRABCUT_UPDATE_ITERATIONS
+        else:
+            background_model = np.zeros((1, 65), np.float64)
+            foreground_model = np.zeros((1, 65), np.float64)
+            if box is not None:
+                x0, y0, x1, y1 = box
+                mask = np.full((height, width), cv2.GC_BGD, np.uint8)
+                mask[y0:y1, x0:x1] = cv2.GC_PR_FGD
+            else:
+                border = max(int(min(height, width) * GRABCUT_BORDER_FRACTION), 1)
+                mask = np.full((height, width), cv2.GC_BGD, np.uint8)
+                mask[border:-border, border:-border] = cv2.GC_PR_FGD
+            iterations = GRABCUT_ITERATIONS
+        if seed is not None:
+            cv2.circle(mask, seed, GRABCUT_SEED_RADIUS, cv2.GC_FGD, cv2.FILLED)
+        if not np.any(mask == cv2.GC_BGD) or not np.any((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)):
+            return None
+
+        cv2.grabCut(self.image, mask, None, background_model, foreground_model, iterations, cv2.GC_INIT_WITH_MASK)
+        self.grabcut = (box, mask, background_model, foreground_model)
+        return ((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD)).astype(np.uint8)
+
+    def refine(self, small_mask, seed, uncertainty=1):
+        # outline of the object at full resolution. Pixels within the band (uncertainty pixels of the downscaled copy
+        # plus a margin) around the downscaled outline are given to the object or the background by which of the two
+        # average colors (of the pixels of each near the tile) they are closer to. Everything else keeps the downscaled
+        # result
+        image = self.pyramid[0]
+        image_height, image_width = image.shape[:2]
+        band = uncertainty * self.scale + REFINE_MARGIN
+        halo = band + 2  # pixels around a tile that the band and the colors depend on
+        small_halo = -(-halo // self.scale) + 1
+
+        x, y, width, height = cv2.boundingRect(small_mask)
+        roi_x0, roi_y0 = max(x * self.scale - halo, 0), max(y * self.scale - halo, 0)
+        roi_x1 = min((x + width) * self.scale + halo, image_width)
+        roi_y1 = min((y + height) * self.scale + halo, image_height)
+        refined = np.zeros((roi_y1 - roi_y0, roi_x1 - roi_x0), np.uint8)
+
+        for tile_y in range(roi_y0, roi_y1, REFINE_TILE_SIZE):
+            for tile_x in range(roi_x0, roi_x1, REFINE_TILE_SIZE):
+                tile_x1 = min(tile_x + REFINE_TILE_SIZE, roi_x1)
+                tile_y1 = min(tile_y + REFINE_TILE_SIZE, roi_y1)
+                # the part of the downscaled mask the tile depends on
+                small_x0 = max(tile_x // self.scale - small_halo, 0)
+                small_y0 = max(tile_y // self.scale - small_halo, 0)
+                small_x1 = min(-(-tile_x1 // self.scale) + small_halo, small_mask.shape[1])
+                small_y1 = min(-(-tile_y1 // self.scale) + small_halo, small_mask.shape[0])
+                small_tile = small_mask[small_y0:small_y1, small_x0:small_x1]
+                tile = refined[tile_y - roi_y0:tile_y1 - roi_y0, tile_x - roi_x0:tile_x1 - roi_x0]
+                if not np.any(small_tile):
+                    continue
+                elif np.all(small_tile):
+                    tile[:] = 255
+                    continue
+
+                key = (tile_x, tile_y, small_tile.shape, hashlib.blake2b(small_tile.tobytes(), digest_size=16).digest())
+                if key not in self.refined_tiles:
+                    self.refined_tiles[key] = self.refine_tile(small_tile, small_x0, small_y0, tile_x, tile_y,
+                                                               tile_x1, tile_y1, band)
+                    if len(self.refined_tiles) > MAX_CACHED_TILES:
+                        self.refined_tiles.popitem(last=False)
+                self.refined_tiles.move_to_end(key)
+                tile[:] = self.refined_tiles[key]
+
+        local_seed = (seed[0] - roi_x0, seed[1] - roi_y0) if seed is not None else None
+        _, contour = fill_object(refined, local_seed)
+        if contour is None:
+            return None
+        return contour + np.array([roi_x0, roi_y0], np.int32)
+
+    def refine_tile(self, small_tile, small_x0, small_y0, tile_x0, tile_y0, tile_x1, tile_y1, band):
+        # the downscaled mask around the tile scaled up to full resolution, covering the tile plus a halo
+        scale = self.scale
+        full_x0, full_y0 = small_x0 * scale, small_y0 * scale
+        mask = cv2.resize(small_tile, (small_tile.shape[1] * scale, small_tile.shape[0] * scale),
+                          interpolation=cv2.INTER_LINEAR)
+        image = self.pyramid[0]
+        full_x1 = min(full_x0 + mask.shape[1], image.shape[1])
+        full_y1 = min(full_y0 + mask.shape[0], image.shape[0])
+        mask = (mask[:full_y1 - full_y0, :full_x1 - full_x0] > 127).astype(np.uint8)
+        colors = np.asarray(image[full_y0:full_y1, full_x0:full_x1]).astype(np.float32)
+
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * band + 1, 2 * band + 1))
+        inside = cv2.erode(mask, kernel, borderType=cv2.BORDER_REPLICATE) > 0
+        outside = cv2.dilate(mask, kernel, borderType=cv2.BORDER_REPLICATE) == 0
+        uncertain = ~inside & ~outside
+        # colors of the object and the background near the tile (or across the band if one of them isn't near)
+        object_colors = colors[inside] if np.any(inside) else colors[uncertain & (mask > 0)]
+        background_colors = colors[outside] if np.any(outside) else colors[uncertain & (mask == 0)]
+        if len(object_colors) == 0 or len(background_colors) == 0:
+            # nothing to compare the band's colors to, so the tile keeps the downscaled result
+            return mask[tile_y0 - full_y0:tile_y1 - full_y0, tile_x0 - full_x0:tile_x1 - full_x0] * 255
+        object_color = object_colors.mean(axis=0)
+        background_color = background_colors.mean(axis=0)
+
+        uncertain_colors = colors[uncertain]
+        closer_to_object = np.sum((uncertain_colors - object_color) ** 2, axis=1) < \
+            np.sum((uncertain_colors - background_color) ** 2, axis=1)
+        refined = inside.astype(np.uint8) * 255
+        refined[uncertain] = closer_to_object * 255
+        # remove specks of single pixels
+        refined = cv2.morphologyEx(refined, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+        refined = cv2.morphologyEx(refined, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+        return refined[tile_y0 - full_y0:tile_y1 - full_y0, tile_x0 - full_x0:tile_x1 - full_x0]
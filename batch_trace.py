@@ -0,0 +1,160 @@
+# Trace every image in a directory without opening any windows and save the points the same way the "Save" button does.
+#
+# usage: python batch_trace.py IMAGE_DIR --scale MM_PER_PIXEL (--seed X Y | --auto {largest,center})
+#                              [--tolerance MM] [--simplify MM] [--downsample N] [--output-dir DIR] [--workers N]
+#
+# The lasso is a single contour found by the magnet's edge detection: the one closest to the seed point (given in pixels
+# of the original image, so it should be on or near the outline) or one picked by an automatic rule. A manifest with the
+# status and timings of every image is written next to the point files.
+
+import argparse
+import csv
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import cv2
+import numpy as np
+
+from contour_tracer import ContourTracer
+from image_loader import is_image
+from image_store import ImageStore
+from image_viewer import DOWNSAMPLE
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+OUTPUT_DIRECTORY = "output"
+MANIFEST_FILENAME = "manifest.csv"
+AUTO_RULES = ("largest", "center")
+MANIFEST_FIELDS = ["image", "output", "status", "error", "points", "saved_points", "max_deviation_mm", "load_seconds",
+                   "trace_seconds", "save_seconds", "total_seconds"]
+
+
+def find_seed_contour(contour_index, seed):
+    # the contour closest to the seed point, like clicking on it with the magnet
+    seed_x, seed_y = seed
+    radius = np.hypot(contour_index.grid_width, contour_index.grid_height) * contour_index.cell_size
+    closest = contour_index.find_closest_point(seed_x, seed_y, radius)
+    if closest is None:
+        return None
+    contour_id, _, _ = closest
+    return contour_index.contours[contour_id]
+
+
+def find_auto_contour(contours, rule, image_width, image_height):
+    if rule == "center":
+        # only contours around the center of the image
+        center = (image_width / 2, image_height / 2)
+        contours = [contour for contour in contours if cv2.pointPolygonTest(contour, center, False) > 0]
+    elif rule != "largest":
+        raise ValueError("Unknown auto selection rule: %s" % rule)
+
+    if len(contours) == 0:
+        return None
+    # the contour that encloses the largest area
+    return max(contours, key=cv2.contourArea)
+
+
+def trace_image(image_location, save_location, mm_per_pixel, tolerance, downsample=DOWNSAMPLE, seed=None,
+                auto_rule=None, simplify_tolerance=0.0):
+    result = {"image": image_location, "output": save_location, "status": "ok", "error": "", "points": 0}
+    start = time.perf_counter()
+    try:
+        tracer = ContourTracer(SCREEN_WIDTH, SCREEN_HEIGHT)
+        # every image is only traced once, so there's no point keeping it in memory afterwards
+        tracer.IMAGE_STORE = ImageStore(max_unused_images=0)
+        tracer.load_image(image_location, downsample)
+        tracer.wait_for_edges()
+        loaded = time.perf_counter()
+        result["load_seconds"] = round(loaded - start, 4)
+
+        if seed is not None:
+            contour = find_seed_contour(tracer.contour_index, (seed[0] / downsample, seed[1] / downsample))
+        else:
+            contour = find_auto_contour(tracer.contour_index.contours, auto_rule, tracer.image_width,
+                                        tracer.image_height)
+        traced = time.perf_counter()
+        result["trace_seconds"] = round(traced - loaded, 4)
+
+        if contour is None:
+            result["status"] = "no_contour"
+            result["output"] = ""
+        else:
+            tracer.select_contour(contour)
+            # same units as the gui: cm per (downsampled) pixel and cm of tolerance
+            scale_factor = mm_per_pixel / 10.0 * downsample
+            saved_points, max_deviation = tracer.scale_and_save_points(save_location, scale_factor, tolerance / 10.0,
+                                                                       simplify_tolerance=simplify_tolerance / 10.0)
+            result["points"] = len(contour)
+            result["saved_points"] = saved_points
+            result["max_deviation_mm"] = round(max_deviation * 10.0, 6)
+            result["save_seconds"] = round(time.perf_counter() - traced, 4)
+    except Exception:
+        result["status"] = "error"
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+        result["output"] = ""
+    result["total_seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def find_images(image_directory):
+    image_locations = []
+    for filename in sorted(os.listdir(image_directory)):
+        location = os.path.join(image_directory, filename)
+        if os.path.isfile(location) and is_image(location):  # make sure it's a picture
+            image_locations.append(location)
+    return image_locations
+
+
+def write_manifest(manifest_location, results):
+    with open(manifest_location, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({field: result.get(field, "") for field in MANIFEST_FIELDS})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Trace a directory of images without the gui")
+    parser.add_argument("image_directory")
+    parser.add_argument("--scale", type=float, required=True, help="millimeters per pixel of the original images")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="tolerance in millimeters")
+    parser.add_argument("--simplify", type=float, default=0.0,
+                        help="remove points while the outline stays within this many millimeters")
+    parser.add_argument("--downsample", type=float, default=DOWNSAMPLE)
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--seed", type=float, nargs=2, metavar=("X", "Y"),
+                           help="point on the outline, in pixels of the original images")
+    selection.add_argument("--auto", choices=AUTO_RULES, help="pick the contour automatically")
+    parser.add_argument("--output-dir", default=OUTPUT_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.downsample < 1:
+        raise SystemExit("Not a valid downsample. Choose a number >= 1")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for image_location in find_images(args.image_directory):
+            name = os.path.splitext(os.path.basename(image_location))[0]
+            save_location = os.path.join(args.output_dir, name + ".csv")
+            futures.append(executor.submit(trace_image, image_location, save_location, args.scale, args.tolerance,
+                                           args.downsample, args.seed, args.auto, args.simplify))
+        for future in as_completed(futures):
+            result = future.result()
+            print("%s: %s (%.2f s)" % (result["image"], result["status"], result["total_seconds"]))
+            results.append(result)
+
+    results.sort(key=lambda result: result["image"])
+    write_manifest(os.path.join(args.output_dir, MANIFEST_FILENAME), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Compares the vectorized add_tolerance against the original point by point implementation on synthetic lassos of
+# increasing size and checks that both give identical points.
+#
+# usage: python benchmarks/bench_add_tolerance.py [--sizes 1000 10000 100000] [--max-reference-points 20000]
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from contour_tracer import add_tolerance  # noqa: E402
+
+
+def add_tolerance_reference(points, tolerance):
+    # add_tolerance as it was before it was vectorized. O(N^2) because of the pointPolygonTest calls
+    points_len, _, _ = points.shape
+    point_slopes = np.empty(points_len)
+    for i in range(0, points_len):
+        prev_index = i-3
+        prev_point = points[prev_index, 0, :]
+        next_index = i+3
+        if next_index >= points_len:
+            next_index -= points_len
+        next_point = points[next_index, 0, :]
+
+        dx = float(next_point[0] - prev_point[0])
+        dy = float(next_point[1] - prev_point[1])
+        if dx == 0:
+            dx = 0.00000001
+        point_slopes[i] = dy/dx
+
+    x_tolerance = -np.sin(np.arctan(point_slopes)) * tolerance
+    y_tolerance = np.cos(np.arctan(point_slopes)) * tolerance
+
+    adjusted_points = points.copy()
+    for i in range(0, points_len):
+        point = points[i, 0, :]
+        adjusted_point_1 = point + np.array([x_tolerance[i], y_tolerance[i]])
+        x1, y1 = adjusted_point_1[0], adjusted_point_1[1]
+        adjusted_point_2 = point - np.array([x_tolerance[i], y_tolerance[i]])
+        x2, y2 = adjusted_point_2[0], adjusted_point_2[1]
+        if tolerance < 0:
+            if cv2.pointPolygonTest(points, (x1, y1), False) > 0:
+                adjusted_points[i, 0, :] = adjusted_point_1
+            elif cv2.pointPolygonTest(points, (x2, y2), False) > 0:
+                adjusted_points[i, 0, :] = adjusted_point_2
+        elif tolerance > 0:
+            if cv2.pointPolygonTest(points, (x1, y1), False) < 0:
+                adjusted_points[i, 0, :] = adjusted_point_1
+            elif cv2.pointPolygonTest(points, (x2, y2), False) < 0:
+                adjusted_points[i, 0, :] = adjusted_point_2
+
+    return adjusted_points
+
+
+def make_lasso(num_points, seed=0):
+    # a wobbly closed outline traced with CHAIN_APPROX_NONE, the same kind of points the lasso is made of.
+    # y is flipped like scale_and_save_points does before adding the tolerance
+    rng = np.random.default_rng(seed)
+    radius = num_points / (2 * np.pi) / 1.2
+    angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    radii = radius * (1 + 0.25 * rng.random(len(angles)))
+    size = int(2.6 * radius) + 10
+    polygon = np.stack((size / 2 + radii * np.cos(angles), size / 2 + radii * np.sin(angles)), axis=1)
+    mask = np.zeros((size, size), np.uint8)
+    cv2.fillPoly(mask, [np.round(polygon).astype(np.int32)], 255)
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    points = max(contours, key=len).copy()
+    points[:, 0, 1] = -1 * points[:, 0, 1]
+    return points
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark add_tolerance")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[-2.5, 0.7, 3.0])
+    parser.add_argument("--max-reference-points", type=int, default=20000,
+                        help="skip the original implementation for lassos bigger than this")
+    args = parser.parse_args()
+
+    print("%10s %10s %14s %14s %9s %s" % ("points", "tolerance", "vectorized s", "original s", "speedup", "same"))
+    for size in args.sizes:
+        points = make_lasso(size)
+        for tolerance in args.tolerances:
+            result, elapsed = time_call(add_tolerance, points, tolerance)
+            if len(points) <= args.max_reference_points:
+                expected, reference_elapsed = time_call(add_tolerance_reference, points, tolerance)
+                print("%10d %10.2f %14.4f %14.4f %8.1fx %s" % (len(points), tolerance, elapsed, reference_elapsed,
+                                                               reference_elapsed / elapsed,
+                                                               np.array_equal(result, expected)))
+            else:
+                print("%10d %10.2f %14.4f %14s %9s %s" % (len(points), tolerance, elapsed, "-", "-", "-"))
+
+
+if __name__ == "__main__":
+    main()
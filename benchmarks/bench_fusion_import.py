@@ -0,0 +1,114 @@
+# Times point ingestion for FUSION_Import_Points: the original readline/split reader against point_ingest for every
+# file format the exporters write, checks that they give the same points, then runs the whole Fusion script against
+# the mock adsk package to time the import path end to end.
+#
+# usage: python benchmarks/bench_fusion_import.py [--sizes 10000 100000 1000000] [--downsample 20]
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "FUSION_Import_Points"))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "mock_adsk"))
+from exporters import FILE_FORMATS  # noqa: E402
+from exporters import export_points  # noqa: E402
+from point_ingest import load_points  # noqa: E402
+
+SCALE_FACTOR = 1.024
+INGEST_FORMATS = ("csv", "csv.gz", "npy", "float32")
+
+
+def load_points_reference(filename, downsample, scale_factor):
+    # the csv reader FUSION_Import_Points used before point_ingest
+    points = []
+    f = open(filename, 'r')
+    line = f.readline()
+    data = []
+    sample_count = 0
+    while line:
+        pntStrArr = line.split(',')
+        for pntStr in pntStrArr:
+            data.append(float(pntStr))
+
+        if len(data) == 2:
+            sample_count += 1
+            if sample_count % downsample == 0:
+                points.append((data[0] * scale_factor, data[1] * scale_factor))
+
+        line = f.readline()
+        data.clear()
+    f.close()
+    return points
+
+
+def make_points(size):
+    # a wobbly closed outline in centimeters
+    angles = np.linspace(0, 2 * np.pi, size, endpoint=False)
+    radius = 10 + np.sin(angles * 7)
+    return np.stack((radius * np.cos(angles), radius * np.sin(angles)), axis=1)
+
+
+def time_function(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def run_script(filename):
+    # runs FUSION_Import_Points.run with the mock adsk. Returns the fit points of the spline it made
+    from adsk import core
+    from adsk import fusion
+    core.MOCK_FILENAME = filename
+    core.MESSAGES.clear()
+    fusion.ROOT_COMPONENT.sketches[:] = [fusion.Sketch()]
+    script = importlib.import_module("FUSION_Import_Points")
+    script.run(None)
+    failures = [message for message in core.MESSAGES if message.startswith("Failed")]
+    if len(failures) > 0:
+        raise RuntimeError("\n".join(failures))
+    return fusion.ROOT_COMPONENT.sketches[0].sketchCurves.sketchFittedSplines[0].fitPoints
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--downsample", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            points = make_points(size)
+            csv_location = os.path.join(directory, "points.csv")
+            export_points(csv_location, points, "csv")
+            reference_time, reference = time_function(load_points_reference, csv_location, args.downsample,
+                                                      SCALE_FACTOR)
+            print("%d points, original csv reader: %.3fs" % (size, reference_time))
+
+            for file_format in INGEST_FORMATS:
+                location = os.path.join(directory, "points" + FILE_FORMATS[file_format][0])
+                export_points(location, points, file_format)
+                ingest_time, ingested = time_function(load_points, location, args.downsample, SCALE_FACTOR)
+                # binary formats are float32, so they only match the csv to float32 precision
+                if file_format.startswith("csv"):
+                    matches = ingested == reference
+                else:
+                    matches = len(ingested) == len(reference) and np.allclose(ingested, reference, rtol=1e-6, atol=1e-5)
+                print("  point_ingest %-8s %.3fs (%.1fx) %s" % (file_format, ingest_time, reference_time / ingest_time,
+                                                               "identical" if matches else "MISMATCH"))
+
+            script_time, fit_points = time_function(run_script, csv_location)
+            # the script closes the spline by adding the first point again
+            fit_points = [(point.geometry.x, point.geometry.y) for point in fit_points[:-1]]
+            print("  FUSION_Import_Points.run with mock adsk: %.3fs, %d fit points %s" %
+                  (script_time, len(fit_points), "identical" if fit_points == reference else "MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# Benchmarks the contour_tracer hot paths headlessly on synthetic images and lassos of several sizes, and writes the
+# time per call, peak memory and scaling of every function to a JSON file. Two result files can be compared to find
+# regressions.
+#
+# usage: python benchmarks/bench_hot_paths.py [--megapixels 1 10 100] [--points 1000 10000 100000 500000]
+#                                             [--functions NAME ...] [--min-time SECONDS] [--output FILE]
+#        python benchmarks/bench_hot_paths.py --compare OLD.json NEW.json [--threshold 1.2]
+#
+# Time is measured by calling a function repeatedly for at least --min-time seconds (and at least 3 times). Peak memory
+# is measured in a separate call with tracemalloc (numpy and cv2 arrays are included) so tracing doesn't slow down the
+# timed calls. The scaling exponent of a function is the slope of log(time) against log(size): 1 is linear.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from contour_tracer import LIVEWIRE_MODE  # noqa: E402
+from contour_tracer import MAGNET_MODE  # noqa: E402
+from contour_tracer import ContourTracer  # noqa: E402
+from contour_tracer import add_tolerance  # noqa: E402
+from contour_tracer import find_closest_contour_point  # noqa: E402
+from contour_tracer import find_points_along_line  # noqa: E402
+from contour_tracer import find_shortest_route  # noqa: E402
+from image_store import ImageStore  # noqa: E402
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+MIN_CALLS = 3
+ZOOM_LEVELS = (0, 6, 12)  # zoom levels handle_zoom_and_pan is timed at
+LASSO_FUNCTIONS = ("find_closest_contour_point", "find_shortest_route", "add_tolerance")
+IMAGE_FUNCTIONS = ("load_image", "find_points_along_line", "handle_zoom_and_pan")
+VIEW_FUNCTIONS = ("handle_display_points", "handle_display_points_cold", "show_next_point_preview")
+ROUTE_SNAP_MODES = {"update_next_contour_magnet": MAGNET_MODE, "update_next_contour_livewire": LIVEWIRE_MODE}
+ROUTE_FUNCTIONS = tuple(ROUTE_SNAP_MODES)
+FUNCTIONS = LASSO_FUNCTIONS + IMAGE_FUNCTIONS + VIEW_FUNCTIONS + ROUTE_FUNCTIONS
+CURSOR_MOVES = 32  # cursor positions the route is found for after each click
+CURSOR_STEP = 6  # window pixels the cursor moves between them
+
+
+def make_image(megapixels, seed=0):
+    # 4:3 image of random filled shapes on a noisy background, so edge detection finds plenty of contours
+    rng = np.random.default_rng(seed)
+    width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(width * 3 / 4))
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = rng.integers(150, 230, 3, dtype=np.uint8)
+    for _ in range(int(20 * np.sqrt(megapixels)) + 10):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        size = int(rng.integers(width // 50 + 1, width // 8 + 2))
+        if rng.random() < 0.5:
+            cv2.circle(image, center, size, color, -1)
+        else:
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 7))
+            polygon = np.stack((center[0] + size * np.cos(angles), center[1] + size * np.sin(angles)), axis=1)
+            cv2.fillPoly(image, [polygon.astype(np.int32)], color)
+    noise = rng.integers(0, 8, (height, width), dtype=np.uint8)
+    cv2.add(image, cv2.merge((noise, noise, noise)), dst=image)
+    return image
+
+
+def make_lasso(num_points, width, height, seed=0):
+    # a wobbly closed outline traced pixel by pixel (like the magnet's contours) with about num_points points, then
+    # fit inside the image. Neighbouring points are only next to each other on the pixel grid when it fits unscaled
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0, 2 * np.pi, 3)
+    radius = num_points / 9  # the traced outline has about 9 points per pixel of radius
+    # sampled more finely than one pixel so the rounded points are 8-connected once repeats are removed
+    angles = np.linspace(0, 2 * np.pi, 8 * num_points, endpoint=False)
+    radii = radius * (1 + 0.1 * np.sin(5 * angles + phases[0]) + 0.05 * np.sin(11 * angles + phases[1]) +
+                      0.02 * np.sin(29 * angles + phases[2]))
+    points = np.round(np.stack((radii * np.cos(angles), radii * np.sin(angles)), axis=1))
+    points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+    points -= points.min(axis=0)
+
+    scale = min(1.0, 0.9 * min(width, height) / (points.max() + 1))
+    points = np.round(points * scale + 0.05 * np.array([width, height]))
+    return points.astype(np.int32).reshape(-1, 1, 2)
+
+
+def measure(function, args, min_time):
+    # time per call (seconds) of repeated calls and the peak memory (bytes) allocated during one more call
+    times = []
+    start = time.perf_counter()
+    while len(times) < MIN_CALLS or time.perf_counter() - start < min_time:
+        call_start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - call_start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(times),
+        "mean_seconds": float(np.mean(times)),
+        "median_seconds": float(np.median(times)),
+        "min_seconds": float(np.min(times)),
+        "peak_bytes": int(peak_bytes),
+    }
+
+
+def load_tracer(image_location):
+    tracer = ContourTracer(SCREEN_WIDTH, SCREEN_HEIGHT)
+    # an empty image store so every call decodes the image instead of reusing the last one
+    tracer.IMAGE_STORE = ImageStore()
+    tracer.load_image(image_location)
+    tracer.wait_for_edges()
+    return tracer
+
+
+def zoom_and_pan(tracer, zoom_level):
+    tracer.increment_zoom(zoom_level - tracer.current_zoom_level)
+    return tracer.handle_zoom_and_pan()
+
+
+def display_points_cold(tracer, image):
+    # the lasso mask rebuilt from scratch, like after an undo or on a zoom level that isn't cached
+    tracer.lasso_overlay.clear()
+    return tracer.handle_display_points(image)
+
+
+def make_cursor_path(tracer):
+    # a click in the middle of the window and the image positions of the cursor moving away from it, slightly curved
+    # like a hand drawn stroke
+    center_x, center_y = tracer.window_width / 2, tracer.window_height / 2
+    steps = np.arange(1, CURSOR_MOVES + 1) * CURSOR_STEP
+    local_x = center_x + steps
+    local_y = center_y + 0.5 * steps + 0.01 * steps ** 2
+    click = tuple(int(c) for c in tracer.convert_local_to_global(center_x, center_y))
+    cursors = [tuple(int(c) for c in tracer.convert_local_to_global(x, y)) for x, y in zip(local_x, local_y)]
+    return click, cursors
+
+
+def follow_cursor(tracer, snap_mode, click, cursors):
+    # the routes found while the cursor moves after a click, like the preview does when the window isn't busy.
+    # The livewire's shortest path tree is rebuilt for the new click each time, its cost maps are kept
+    tracer.snap_mode = snap_mode
+    tracer.points = [click]
+    if tracer.livewire is not None:
+        tracer.livewire.anchor = None
+    for cursor in cursors:
+        tracer.next_point = cursor
+        tracer.update_next_contour()
+    return tracer.next_contour
+
+
+def run_lasso_benchmarks(functions, lasso_sizes, min_time, results):
+    for num_points in lasso_sizes:
+        lasso = make_lasso(num_points, 4 * num_points, 4 * num_points)
+        middle = len(lasso) // 2
+        cases = {
+            "find_closest_contour_point": (find_closest_contour_point, (lasso, tuple(lasso[middle, 0] + 3))),
+            # the longer way around each time, which needs the flip and concatenate
+            "find_shortest_route": (find_shortest_route, (lasso, len(lasso) // 8, len(lasso) - len(lasso) // 8)),
+            "add_tolerance": (add_tolerance, (lasso, 2.5)),
+        }
+        for name in functions:
+            if name in cases:
+                function, args = cases[name]
+                result = measure(function, args, min_time)
+                results.append(dict(function=name, parameter="points", size=len(lasso), **result))
+                print_result(results[-1])
+
+
+def run_image_benchmarks(functions, megapixels, lasso_sizes, min_time, results):
+    with tempfile.TemporaryDirectory() as directory:
+        for size in megapixels:
+            image_location = os.path.join(directory, "synthetic_%gMP.jpg" % size)
+            cv2.imwrite(image_location, make_image(size))
+            tracer = load_tracer(image_location)
+            width, height = tracer.image_width, tracer.image_height
+
+            if "load_image" in functions:
+                result = measure(load_tracer, (image_location,), min_time)
+                results.append(dict(function="load_image", parameter="megapixels", size=size, **result))
+                print_result(results[-1])
+            if "find_points_along_line" in functions:
+                result = measure(find_points_along_line, (0, 0, width - 1, height - 1), min_time)
+                results.append(dict(function="find_points_along_line", parameter="megapixels", size=size, **result))
+                print_result(results[-1])
+            if "handle_zoom_and_pan" in functions:
+                for zoom_level in ZOOM_LEVELS:
+                    result = measure(zoom_and_pan, (tracer, zoom_level), min_time)
+                    results.append(dict(function="handle_zoom_and_pan", parameter="megapixels", size=size,
+                                        zoom_level=zoom_level, **result))
+                    print_result(results[-1])
+            for name in ROUTE_FUNCTIONS:
+                if name not in functions:
+                    continue
+                for zoom_level in ZOOM_LEVELS:
+                    zoom_and_pan(tracer, zoom_level)
+                    click, cursors = make_cursor_path(tracer)
+                    result = measure(follow_cursor, (tracer, ROUTE_SNAP_MODES[name], click, cursors), min_time)
+                    results.append(dict(function=name, parameter="megapixels", size=size, zoom_level=zoom_level,
+                                        **result))
+                    print_result(results[-1])
+            tracer.points = []
+            tracer.next_contour = None
+            zoom_and_pan(tracer, 0)
+
+            view_image = tracer.handle_zoom_and_pan()
+            for num_points in lasso_sizes:
+                if not any(name in functions for name in VIEW_FUNCTIONS):
+                    break
+                lasso = make_lasso(num_points, width, height)
+                tracer.select_contour(lasso)
+                tracer.next_contour = lasso
+                cases = {
+                    "handle_display_points": (tracer.handle_display_points, (view_image,)),
+                    "handle_display_points_cold": (display_points_cold, (tracer, view_image)),
+                    "show_next_point_preview": (tracer.show_next_point_preview, (view_image.copy(),)),
+                }
+                for name in VIEW_FUNCTIONS:
+                    if name in functions:
+                        function, args = cases[name]
+                        result = measure(function, args, min_time)
+                        results.append(dict(function=name, parameter="points", size=len(lasso), megapixels=size,
+                                            **result))
+                        print_result(results[-1])
+
+
+def get_series_key(result):
+    # results of one function that only differ in size form a scaling curve
+    return (result["function"], result.get("zoom_level"), result.get("megapixels"))
+
+
+def find_scaling(results):
+    series = {}
+    for result in results:
+        series.setdefault(get_series_key(result), []).append(result)
+
+    scaling = []
+    for (function, zoom_level, megapixels), curve in series.items():
+        curve = sorted(curve, key=lambda result: result["size"])
+        sizes = np.array([result["size"] for result in curve], np.float64)
+        times = np.array([result["median_seconds"] for result in curve])
+        exponent = None
+        if len(curve) > 1 and np.all(times > 0):
+            exponent = float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+        scaling.append({"function": function, "parameter": curve[0]["parameter"], "zoom_level": zoom_level,
+                        "megapixels": megapixels, "sizes": sizes.tolist(), "median_seconds": times.tolist(),
+                        "exponent": exponent})
+    return scaling
+
+
+def print_result(result):
+    extra = "".join(", %s %s" % (key, result[key]) for key in ("zoom_level", "megapixels") if key in result)
+    print("%-28s %s %g%s: %.6f s/call (%d calls), peak %.1f MB" % (
+        result["function"], result["parameter"], result["size"], extra, result["median_seconds"], result["calls"],
+        result["peak_bytes"] / 1e6))
+
+
+def compare(old_location, new_location, threshold):
+    # prints the change in median time of every result in both files. Returns the number of regressions
+    with open(old_location) as f:
+        old_results = json.load(f)["results"]
+    with open(new_location) as f:
+        new_results = json.load(f)["results"]
+
+    old_times = {get_series_key(result) + (result["size"],): result["median_seconds"] for result in old_results}
+    regressions = 0
+    for result in new_results:
+        key = get_series_key(result) + (result["size"],)
+        if key not in old_times:
+            continue
+        ratio = result["median_seconds"] / max(old_times[key], 1e-12)
+        regressed = ratio > threshold
+        regressions += regressed
+        print("%-28s %-8g %10.6f -> %10.6f s/call (%.2fx)%s" % (result["function"], result["size"], old_times[key],
+                                                                  result["median_seconds"], ratio,
+                                                                  "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the contour_tracer hot paths")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000, 100000, 500000])
+    parser.add_argument("--functions", nargs="+", choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to keep calling each function")
+    parser.add_argument("--output", default="bench_hot_paths.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown (new / old time) that counts as a regression when comparing")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare is not None:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        print("%d regressions" % regressions)
+        return 1 if regressions > 0 else 0
+
+    results = []
+    run_lasso_benchmarks(args.functions, args.points, args.min_time, results)
+    run_image_benchmarks(args.functions, args.megapixels, args.points, args.min_time, results)
+
+    report = {
+        "metadata": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "megapixels": args.megapixels,
+            "points": args.points,
+            "min_time": args.min_time,
+        },
+        "results": results,
+        "scaling": find_scaling(results),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for curve in report["scaling"]:
+        if curve["exponent"] is not None:
+            extra = "".join(", %s %s" % (key, curve[key]) for key in ("zoom_level", "megapixels")
+                            if curve[key] is not None)
+            print("scaling of %s with %s%s: time ~ size^%.2f" % (curve["function"], curve["parameter"], extra,
+                                                                   curve["exponent"]))
+    print("Saved", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# Times simplify_points on synthetic lassos of increasing size against a recursive (one segment at a time)
+# Douglas-Peucker, and checks that both keep the same points and report the same maximum deviation.
+#
+# usage: python benchmarks/bench_simplify.py [--sizes 1000 10000 100000 500000] [--tolerance 0.005]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simplify import simplify_points  # noqa: E402
+
+
+def simplify_points_reference(points, tolerance):
+    # Douglas-Peucker on the closed lasso, splitting one segment at a time
+    closed = np.vstack((points, points[:1]))
+    keep = np.zeros(len(closed), bool)
+    keep[0] = keep[-1] = True
+    max_deviation = 0.0
+    segments = [(0, len(closed) - 1)]
+    while len(segments) > 0:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        direction_x, direction_y = closed[end] - closed[start]
+        relative_x = closed[start + 1:end, 0] - closed[start, 0]
+        relative_y = closed[start + 1:end, 1] - closed[start, 1]
+        length_squared = max(direction_x * direction_x + direction_y * direction_y, 1e-300)
+        t = np.clip((relative_x * direction_x + relative_y * direction_y) / length_squared, 0, 1)
+        distances = np.hypot(relative_x - t * direction_x, relative_y - t * direction_y)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            keep[start + 1 + farthest] = True
+            segments += [(start, start + 1 + farthest), (start + 1 + farthest, end)]
+        else:
+            max_deviation = max(max_deviation, distances[farthest])
+    return points[keep[:-1]], max_deviation
+
+
+def make_lasso(size, rng):
+    # a wobbly outline in cm traced on a pixel grid, like a lasso from the magnet
+    angles = np.linspace(0, 2 * np.pi, size, endpoint=False)
+    radius = 5 + 0.5 * np.sin(angles * 7) + 0.1 * np.sin(angles * 53)
+    pixel_size = 10 * 2 * np.pi / size
+    points = np.stack((radius * np.cos(angles), radius * np.sin(angles)), axis=1)
+    return np.round(points / pixel_size + rng.normal(0, 0.3, points.shape)) * pixel_size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 500000])
+    parser.add_argument("--tolerance", type=float, default=0.005, help="cm")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        points = make_lasso(size, rng)
+
+        start = time.perf_counter()
+        simplified, max_deviation = simplify_points(points, args.tolerance)
+        vectorized_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference, reference_deviation = simplify_points_reference(points, args.tolerance)
+        reference_time = time.perf_counter() - start
+
+        identical = np.array_equal(simplified, reference) and np.isclose(max_deviation, reference_deviation)
+        print("%7d points -> %5d, max deviation %.5f cm: vectorized %.3fs, recursive %.3fs (%.1fx) %s" %
+              (size, len(simplified), max_deviation, vectorized_time, reference_time, reference_time / vectorized_time,
+               "identical" if identical else "MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()
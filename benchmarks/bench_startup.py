@@ -0,0 +1,153 @@
+# Times how long gui.py takes from a cold interpreter start to its first drawn window, and which heavy modules are
+# loaded by then, so startup regressions (like an import that pulls opencv back in at startup) are noticed. Also times
+# the imports that are deferred to the first Load, so the cost moved there is tracked too. Every measurement runs in a
+# new python process. Needs a display (gui.py opens a real window, which is closed as soon as it is drawn), except for
+# the check that numpy isn't imported by gui.py, which runs it against stand-ins for appJar and Tk images first and fails
+# the benchmark (exit status 1) if it is.
+#
+# usage: python benchmarks/bench_startup.py [--runs 5] [--output bench_startup.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY_MODULES = ["numpy", "cv2", "skimage", "scipy", "contour_tracer", "scale_selector", "image_cache"]
+DEFERRED_MODULES = ["contour_tracer", "scale_selector", "image_cache", "skimage.graph"]
+
+# runs gui.py with appJar's main loop replaced by one that draws the window once, reports and exits
+WINDOW_SCRIPT = """
+import json, os, runpy, sys, time
+start = time.perf_counter()
+import appJar
+
+def go(self, *args, **kwargs):
+    self.topLevel.update()
+    print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+    sys.stdout.flush()
+    os._exit(0)
+
+appJar.gui.go = go
+sys.argv = ["gui.py"]
+runpy.run_path("gui.py", run_name="__main__")
+"""
+
+# runs gui.py with appJar's gui and Tk images replaced by stand-ins that accept any call, so it runs without a display
+IMPORT_GUI_SCRIPT = """
+import json, runpy, sys
+import appJar
+import PIL.ImageTk
+
+class StandIn:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def getOptionBox(self, name):
+        return "csv"
+
+appJar.gui = StandIn
+PIL.ImageTk.PhotoImage = StandIn
+sys.argv = ["gui.py"]
+runpy.run_path("gui.py", run_name="__main__")
+print(json.dumps({"modules": sorted(sys.modules)}))
+"""
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+
+def run_script(script):
+    # (seconds from starting the process to the end of the script, the JSON the script printed)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], cwd=REPOSITORY_DIRECTORY, stdout=subprocess.PIPE,
+                            check=True, universal_newlines=True).stdout
+    total_seconds = time.perf_counter() - start
+    return total_seconds, json.loads(output.strip().splitlines()[-1])
+
+
+def get_summary(values):
+    values = sorted(values)
+    return {"min": values[0], "median": values[len(values) // 2], "max": values[-1]}
+
+
+def time_window(runs):
+    total_seconds = []
+    script_seconds = []
+    heavy_modules = []
+    for _ in range(runs):
+        total, result = run_script(WINDOW_SCRIPT)
+        total_seconds.append(total)
+        script_seconds.append(result["seconds"])
+        heavy_modules = [name for name in HEAVY_MODULES if name in result["modules"]]
+    return {
+        "process_start_to_window_seconds": get_summary(total_seconds),
+        "gui_script_to_window_seconds": get_summary(script_seconds),
+        "heavy_modules_at_startup": heavy_modules,
+    }
+
+
+def time_imports(modules, runs):
+    # seconds to import each module in a new interpreter
+    return {name: get_summary([run_script(IMPORT_SCRIPT % name)[1]["seconds"] for _ in range(runs)])
+            for name in modules}
+
+
+def check_gui_imports():
+    # heavy modules loaded by running gui.py up to its main loop. numpy must not be one of them
+    _, result = run_script(IMPORT_GUI_SCRIPT)
+    return [name for name in HEAVY_MODULES if name in result["modules"]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the gui startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default="bench_startup.json")
+    args = parser.parse_args(argv)
+
+    gui_modules = check_gui_imports()
+    if "numpy" in gui_modules:
+        print("FAILED: gui.py imports numpy before its window opens (heavy modules: %s)" % ", ".join(gui_modules))
+        return 1
+    print("gui.py loads no heavy modules before its window opens" if len(gui_modules) == 0 else
+          "heavy modules loaded by gui.py: " + ", ".join(gui_modules))
+
+    window = time_window(args.runs)
+    print("process start to window: %.3f s (median of %d), gui.py to window: %.3f s" % (
+        window["process_start_to_window_seconds"]["median"], args.runs,
+        window["gui_script_to_window_seconds"]["median"]))
+    print("heavy modules loaded at startup:", ", ".join(window["heavy_modules_at_startup"]) or "none")
+
+    deferred_imports = time_imports(DEFERRED_MODULES, args.runs)
+    for name, seconds in deferred_imports.items():
+        print("import %-16s %.3f s (deferred to the first Load)" % (name, seconds["median"]))
+
+    report = {
+        "metadata": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runs": args.runs,
+        },
+        "window": window,
+        "deferred_imports": deferred_imports,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Saved", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
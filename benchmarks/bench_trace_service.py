@@ -0,0 +1,163 @@
+# Runs trace_service.py on localhost (a free TCP port and a Unix socket) and drives it with the Fusion side client:
+# times loading an image cold and warm, an auto outline, replaying clicks and fetching the points, and checks that the
+# fetched points are identical to the ones the "Save" button would write to a .f32 file and FUSION_Import_Points would
+# read from it. Also times that file round trip for comparison.
+#
+# usage: python benchmarks/bench_trace_service.py [--megapixels 1 10] [--repeats 5] [--output bench_trace_service.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "FUSION_Import_Points"))
+from image_cache import ImageCache  # noqa: E402
+from point_ingest import load_points  # noqa: E402
+from trace_client import fetch_points  # noqa: E402
+from trace_client import load_image  # noqa: E402
+from trace_client import request_json  # noqa: E402
+from trace_service import TraceService  # noqa: E402
+from trace_service import make_server  # noqa: E402
+
+MM_PER_PIXEL = 0.05
+TOLERANCE_MM = 0.3
+SIMPLIFY_MM = 0.02
+
+
+def make_image(location, megapixels):
+    # 4:3 image with one dark ellipse (the object to outline) on a light background
+    width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(width * 3 / 4))
+    image = np.full((height, width, 3), 225, np.uint8)
+    cv2.ellipse(image, (width // 2, height // 2), (width // 4, height // 4), 15, 0, 360, (50, 60, 70), -1)
+    cv2.imwrite(location, image)
+    return width, height
+
+
+def start_server(service, socket_location=None):
+    server = make_server(service, port=0, socket_location=socket_location)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if socket_location is not None:
+        return server, "unix:" + socket_location
+    return server, "http://%s:%d" % server.server_address[:2]
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def get_median_time(repeats, function, *args):
+    times = []
+    result = None
+    for _ in range(repeats):
+        seconds, result = time_call(function, *args)
+        times.append(seconds)
+    return sorted(times)[len(times) // 2], result
+
+
+def get_file_points(service, image_id, save_location):
+    # what the "Save" button writes and FUSION_Import_Points reads, with the service's tracer and settings
+    image = service.get(image_id)
+    with image.lock:
+        image.tracer.scale_and_save_points(save_location, image.get_scale_factor(), TOLERANCE_MM / 10.0, "float32",
+                                           SIMPLIFY_MM / 10.0)
+    return load_points(save_location)
+
+
+def bench_image(service, endpoints, directory, megapixels, repeats):
+    image_location = os.path.join(directory, "object_%gmp.png" % megapixels)
+    width, height = make_image(image_location, megapixels)
+    tcp = endpoints["tcp"]
+    result = {"megapixels": megapixels}
+
+    result["cold_load_seconds"], info = time_call(load_image, tcp, image_location)
+    image_id = info["id"]
+    result["warm_load_seconds"], _ = get_median_time(repeats, load_image, tcp, image_location)
+    result["auto_outline_seconds"], _ = get_median_time(
+        repeats, request_json, tcp, "POST", "/images/%s/auto_outline" % image_id, {"seed": [width // 2, height // 2]})
+
+    # clicks around the ellipse's edge, replayed with the magnet
+    angles = np.linspace(0, 2 * np.pi, 9)[:-1]
+    clicks = [[width / 2 + width / 4 * np.cos(angle), height / 2 + height / 4 * np.sin(angle)] for angle in angles]
+    result["clicks_seconds"], _ = get_median_time(repeats, request_json, tcp, "POST", "/images/%s/clicks" % image_id,
+                                                  {"clicks": clicks, "snap_mode": "magnet"})
+    request_json(tcp, "POST", "/images/%s/scale" % image_id, {"mm_per_pixel": MM_PER_PIXEL, "tolerance_mm": TOLERANCE_MM,
+                                                               "simplify_mm": SIMPLIFY_MM})
+
+    file_seconds, file_points = get_median_time(repeats, get_file_points, service, image_id,
+                                                os.path.join(directory, "points.f32"))
+    result["save_and_read_file_seconds"] = file_seconds
+    result["points"] = len(file_points)
+    result["identical"] = True
+    for name, endpoint in endpoints.items():
+        fetch_seconds, points = get_median_time(repeats, fetch_points, endpoint, image_id)
+        result["fetch_points_%s_seconds" % name] = fetch_seconds
+        result["identical"] = result["identical"] and points == file_points
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracing service on localhost")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="bench_trace_service.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        service = TraceService(ImageCache(os.path.join(directory, "cache")))
+        endpoints = {}
+        servers = []
+        server, endpoints["tcp"] = start_server(service)
+        servers.append(server)
+        if hasattr(socket, "AF_UNIX"):
+            server, endpoints["unix"] = start_server(service, os.path.join(directory, "service.sock"))
+            servers.append(server)
+
+        for megapixels in args.megapixels:
+            result = bench_image(service, endpoints, directory, megapixels, args.repeats)
+            results.append(result)
+            print("%g MP: load %.3f s cold, %.4f s warm, auto outline %.3f s, clicks %.3f s" % (
+                megapixels, result["cold_load_seconds"], result["warm_load_seconds"], result["auto_outline_seconds"],
+                result["clicks_seconds"]))
+            print("  %d points: fetch %s, save and read a file %.4f s, %s" % (
+                result["points"], ", ".join("%s %.4f s" % (name, result["fetch_points_%s_seconds" % name])
+                                            for name in endpoints),
+                result["save_and_read_file_seconds"], "identical" if result["identical"] else "MISMATCH"))
+
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        for image_id in [info["id"] for info in service.get_infos()]:
+            service.remove(image_id)
+
+    report = {
+        "metadata": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Saved", args.output)
+    return 0 if all(result["identical"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
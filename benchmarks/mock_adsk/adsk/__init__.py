@@ -0,0 +1,2 @@
+# Minimal stand-in for the parts of the Fusion 360 api used by FUSION_Import_Points, so the script can be run and
+# benchmarked outside of Fusion. Put benchmarks/mock_adsk on sys.path before importing the script
@@ -0,0 +1,80 @@
+# adsk.core stand-in. The file dialog returns MOCK_FILENAME and selectEntity returns the first sketch
+
+MOCK_FILENAME = None
+MESSAGES = []  # every ui.messageBox message
+
+
+class DialogResults:
+    DialogOK = 0
+    DialogCancel = 1
+
+
+class Point3D:
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @staticmethod
+    def create(x=0.0, y=0.0, z=0.0):
+        return Point3D(x, y, z)
+
+
+class ObjectCollection(list):
+    @staticmethod
+    def create():
+        return ObjectCollection()
+
+    def add(self, item):
+        self.append(item)
+        return True
+
+    @property
+    def count(self):
+        return len(self)
+
+
+class FileDialog:
+    def __init__(self):
+        self.title = ""
+        self.filter = ""
+        self.filename = None
+
+    def showOpen(self):
+        if MOCK_FILENAME is None:
+            return DialogResults.DialogCancel
+        self.filename = MOCK_FILENAME
+        return DialogResults.DialogOK
+
+
+class Selection:
+    def __init__(self, entity):
+        self.entity = entity
+
+
+class UserInterface:
+    def createFileDialog(self):
+        return FileDialog()
+
+    def messageBox(self, message, title=""):
+        MESSAGES.append(message)
+
+    def selectEntity(self, prompt, filter):
+        from adsk import fusion
+        sketches = fusion.ROOT_COMPONENT.sketches
+        return Selection(sketches[0]) if len(sketches) > 0 else None
+
+
+class Application:
+    instance = None
+
+    def __init__(self):
+        from adsk import fusion
+        self.userInterface = UserInterface()
+        self.activeProduct = fusion.Design()
+
+    @staticmethod
+    def get():
+        if Application.instance is None:
+            Application.instance = Application()
+        return Application.instance
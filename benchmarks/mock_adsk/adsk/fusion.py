@@ -0,0 +1,76 @@
+# adsk.fusion stand-in. Sketch geometry is only recorded, nothing is solved
+
+from adsk import core
+
+
+class SketchPoint:
+    def __init__(self, point):
+        self.geometry = point
+
+
+class SketchPoints(list):
+    def add(self, point):
+        sketch_point = SketchPoint(point)
+        self.append(sketch_point)
+        return sketch_point
+
+
+class SketchFittedSpline:
+    def __init__(self, points):
+        self.fitPoints = core.ObjectCollection(SketchPoint(point) for point in points)
+
+
+class SketchFittedSplines(list):
+    def add(self, points):
+        spline = SketchFittedSpline(points)
+        self.append(spline)
+        return spline
+
+
+class SketchCurves:
+    def __init__(self):
+        self.sketchFittedSplines = SketchFittedSplines()
+
+
+class SketchDimensions(list):
+    @staticmethod
+    def cast(dimensions):
+        return dimensions
+
+    def addDistanceDimension(self, point_one, point_two, orientation, text_point):
+        self.append((point_one, point_two, orientation))
+
+
+class Sketch:
+    def __init__(self):
+        self.isComputeDeferred = False
+        self.sketchPoints = SketchPoints()
+        self.sketchCurves = SketchCurves()
+        self.sketchDimensions = SketchDimensions()
+
+    @staticmethod
+    def cast(entity):
+        return entity
+
+
+class Sketches(list):
+    @property
+    def count(self):
+        return len(self)
+
+
+class Component:
+    def __init__(self):
+        self.sketches = Sketches([Sketch()])
+
+
+ROOT_COMPONENT = Component()
+
+
+class Design:
+    def __init__(self):
+        self.rootComponent = ROOT_COMPONENT
+
+    @staticmethod
+    def cast(product):
+        return product
@@ -1,11 +1,33 @@
 import cv2
 import numpy as np
+from auto_outline import AutoOutline
+from auto_outline import AUTO_OUTLINE_METHODS
+from auto_outline import OTSU_METHOD
 from image_viewer import ImageViewer
 from image_viewer import DOWNSAMPLE
-import skimage.draw
-
-
-CONTOUR_PREVIEW_SAVE_LOCATION = 'previews/contour_preview.jpeg'
+from edge_index import ContourIndex
+from edge_index import GRID_CELL_SIZE
+from edge_index import find_edge_pyramid
+from edge_tiles import EdgeTileScheduler
+from exporters import export_points
+from lasso_buffer import LassoBuffer
+from lasso_overlay import LassoOverlay
+from livewire import LiveWire
+from route_worker import RouteWorker
+from simplify import simplify_points
+
+
+# ways of connecting the last point to the cursor, switched between with the "c" key
+MAGNET_MODE = "magnet"  # along the closest contour
+LIVEWIRE_MODE = "livewire"  # along the cheapest path through the image gradient
+LINE_MODE = "line"  # straight line
+AUTO_OUTLINE_MODE = "auto"  # click on an object (or drag a box around it) to outline all of it at once
+SNAP_MODES = (MAGNET_MODE, LIVEWIRE_MODE, LINE_MODE, AUTO_OUTLINE_MODE)
+PREVIEW_LINE_THICKNESS = 2  # pixels of the lasso on the gui's thumbnail
+MAGNET_RADIUS = 20  # how close (in window pixels) the cursor has to be to a contour for the magnet to latch onto it
+ROUTE_POLL_TIME = 10  # ms to wait for key presses while a route is being found in the background
+ROUTE_IDLE_POLL_TIME = 100  # ms to wait otherwise (the route worker can't wake up cv2.waitKey when a route is found)
+AUTO_OUTLINE_CLICK_DISTANCE = 5  # window pixels the mouse can move while pressed for it to be a click instead of a box
 
 
 def find_shortest_route(contour, ind1, ind2):
@@ -41,58 +63,168 @@ def find_closest_contour_point(contour, point):
     return ind, (closest_point_x, closest_point_y)
 
 
+def find_magnet_route(contour_index, start_point, end_point, radius):
+    start_point_x, start_point_y = start_point
+    end_point_x, end_point_y = end_point
+
+    end_ids, end_inds, end_dist = contour_index.query(end_point_x, end_point_y, radius)
+    if len(end_dist) == 0:
+        return None
+    start_ids, start_inds, start_dist = contour_index.query(start_point_x, start_point_y, radius)
+
+    # prefer contours that pass close to both the start and the end point
+    shared = np.isin(end_ids, start_ids)
+    if np.any(shared):
+        end_ids, end_inds, end_dist = end_ids[shared], end_inds[shared], end_dist[shared]
+
+    closest = np.argmin(end_dist)
+    contour_id = end_ids[closest]
+    end_ind = end_inds[closest]
+    contour = contour_index.contours[contour_id]
+
+    on_contour = start_ids == contour_id
+    if np.any(on_contour):
+        start_ind = start_inds[on_contour][np.argmin(start_dist[on_contour])]
+    else:
+        start_ind, _ = find_closest_contour_point(contour, (start_point_x, start_point_y))
+    route_start_x, route_start_y = contour[start_ind, 0, :]
+
+    # find shortest route (since a contour is a loop)
+    route = find_shortest_route(contour, start_ind, end_ind)
+
+    # connect the start point to the contour route
+    line = find_points_along_line(start_point_x, start_point_y, route_start_x, route_start_y)
+    return np.concatenate((line, route), 0)
+
+
+def find_next_contour(contour_index, livewire, last_point, next_point, snap_mode, radius):
+    # route from the last point to the cursor depending on the snap mode
+    last_point_x, last_point_y = last_point
+    next_point_x, next_point_y = next_point
+
+    if snap_mode == MAGNET_MODE and contour_index is not None:
+        route = find_magnet_route(contour_index, (last_point_x, last_point_y), (next_point_x, next_point_y), radius)
+        if route is not None:
+            return route
+    elif snap_mode == LIVEWIRE_MODE and livewire is not None:
+        route = livewire.find_route((last_point_x, last_point_y), (next_point_x, next_point_y))
+        route_end_x, route_end_y = route[-1, 0, :]
+        if route_end_x != next_point_x or route_end_y != next_point_y:
+            # cursor is further away than the livewire reaches
+            line = find_points_along_line(route_end_x, route_end_y, next_point_x, next_point_y)
+            route = np.concatenate((route, line[1:]), 0)
+        return route
+
+    # if no contours found, we just connect to the current cursor location
+    return find_points_along_line(last_point_x, last_point_y, next_point_x, next_point_y)
+
+
 def find_points_along_line(x1, y1, x2, y2):
-    discrete_line = skimage.draw.line(y1, x1, y2, x2)
-    y, x = discrete_line
-    points = np.empty((len(y), 1, 2), np.int32)
-    points[:, 0, 0] = x
-    points[:, 0, 1] = y
+    # pixels of the line from (x1, y1) to (x2, y2) as an (N, 1, 2) contour. Bresenham's line (the same pixels as
+    # skimage.draw.line) in closed form: step i along the longer axis moves round(i * slope) along the shorter one,
+    # with halves rounded away from the start
+    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+    dx = abs(x2 - x1)
+    dy = abs(y2 - y1)
+    step_x = 1 if x2 > x1 else -1
+    step_y = 1 if y2 > y1 else -1
+    steps = np.arange(max(dx, dy) + 1)
+
+    points = np.empty((len(steps), 1, 2), np.int32)
+    if dy > dx:
+        points[:, 0, 0] = x1 + step_x * ((2 * dx * steps + dy) // (2 * dy))
+        points[:, 0, 1] = y1 + step_y * steps
+    else:
+        points[:, 0, 0] = x1 + step_x * steps
+        points[:, 0, 1] = y1 + step_y * ((2 * dy * steps + dx) // max(2 * dx, 1))
 
     return points
 
 
+def points_polygon_test(contour, points):
+    # vectorized cv2.pointPolygonTest(contour, point, False) for many points at once. Returns 1 for points inside the
+    # contour, -1 for points outside and 0 for points on an edge. Follows OpenCV's ray casting exactly (points are
+    # compared as float32) so the results match point by point
+    vertices = contour[:, 0, :].astype(np.float32)
+    points = np.asarray(points, np.float32).reshape(-1, 2)
+    results = np.full(len(points), -1, np.int8)
+    if len(vertices) == 0 or len(points) == 0:
+        return results
+
+    # edge i goes from vertex i-1 to vertex i
+    v0 = np.roll(vertices, 1, axis=0)
+    v1 = vertices
+
+    # an edge can only affect points whose row (floor of y) lies within the rows the edge spans
+    edge_min_row = np.floor(np.minimum(v0[:, 1], v1[:, 1])).astype(np.int64)
+    edge_num_rows = np.floor(np.maximum(v0[:, 1], v1[:, 1])).astype(np.int64) - edge_min_row + 1
+    edge_ids = np.repeat(np.arange(len(v1)), edge_num_rows)
+    edge_rows = np.repeat(edge_min_row, edge_num_rows) + \
+        np.arange(len(edge_ids)) - np.repeat(np.cumsum(edge_num_rows) - edge_num_rows, edge_num_rows)
+    order = np.argsort(edge_rows, kind="stable")
+    edge_ids = edge_ids[order]
+    edge_rows = edge_rows[order]
+
+    # pair every point with the edges in its row
+    point_rows = np.floor(points[:, 1]).astype(np.int64)
+    starts = np.searchsorted(edge_rows, point_rows, side="left")
+    counts = np.searchsorted(edge_rows, point_rows, side="right") - starts
+    point_ids = np.repeat(np.arange(len(points)), counts)
+    pair_edges = edge_ids[np.repeat(starts, counts) + np.arange(len(point_ids)) -
+                          np.repeat(np.cumsum(counts) - counts, counts)]
+
+    px, py = points[point_ids, 0], points[point_ids, 1]
+    x0, y0 = v0[pair_edges, 0], v0[pair_edges, 1]
+    x1, y1 = v1[pair_edges, 0], v1[pair_edges, 1]
+
+    skip = ((y0 <= py) & (y1 <= py)) | ((y0 > py) & (y1 > py)) | ((x0 < px) & (x1 < px))
+    # point is a vertex or lies on a horizontal edge
+    on_edge = skip & (py == y1) & ((px == x1) | ((py == y0) & (((x0 <= px) & (px <= x1)) | ((x1 <= px) & (px <= x0)))))
+
+    dist = (py - y0).astype(np.float64) * (x1 - x0) - (px - x0).astype(np.float64) * (y1 - y0)
+    on_edge |= ~skip & (dist == 0)
+    dist[y1 < y0] *= -1
+    crossings = np.bincount(point_ids, weights=~skip & (dist > 0), minlength=len(points))
+
+    results[crossings % 2 == 1] = 1
+    results[np.bincount(point_ids, weights=on_edge, minlength=len(points)) > 0] = 0
+    return results
+
+
 def add_tolerance(points, tolerance):
     points_len, _, _ = points.shape
-    point_slopes = np.empty(points_len)
     # find point slopes
-    for i in range(0, points_len):
-        prev_index = i-3
-        prev_point = points[prev_index, 0, :]
-        next_index = i+3
-        if next_index >= points_len:
-            next_index -= points_len
-        next_point = points[next_index, 0, :]
-
-        dx = float(next_point[0] - prev_point[0])
-        dy = float(next_point[1] - prev_point[1])
-        if dx == 0:  # avoid divide by 0
-            dx = 0.00000001
-        point_slopes[i] = dy/dx
+    indices = np.arange(points_len)
+    prev_points = points[(indices - 3) % points_len, 0, :]
+    next_points = points[(indices + 3) % points_len, 0, :]
+    dx = (next_points[:, 0] - prev_points[:, 0]).astype(np.float64)
+    dy = (next_points[:, 1] - prev_points[:, 1]).astype(np.float64)
+    dx[dx == 0] = 0.00000001  # avoid divide by 0
+    point_slopes = dy / dx
 
     # find tolerances as normals to slopes at each point
     x_tolerance = -np.sin(np.arctan(point_slopes)) * tolerance
     y_tolerance = np.cos(np.arctan(point_slopes)) * tolerance
+    offsets = np.stack((x_tolerance, y_tolerance), axis=1)
 
     adjusted_points = points.copy()
-    # now find adjusted points
-    for i in range(0, points_len):
-        point = points[i, 0, :]
-        # there are two options for each point. One is inside and one is outside the contour
-        adjusted_point_1 = point + np.array([x_tolerance[i], y_tolerance[i]])
-        x1, y1 = adjusted_point_1[0], adjusted_point_1[1]
-        adjusted_point_2 = point - np.array([x_tolerance[i], y_tolerance[i]])
-        x2, y2 = adjusted_point_2[0], adjusted_point_2[1]
-        # check which one it is
-        if tolerance < 0:  # means we want to make the shape smaller
-            if cv2.pointPolygonTest(points, (x1, y1), False) > 0:  # check if point 1 is inside contour
-                adjusted_points[i, 0, :] = adjusted_point_1
-            elif cv2.pointPolygonTest(points, (x2, y2), False) > 0:  # check if point 2 is inside contour
-                adjusted_points[i, 0, :] = adjusted_point_2
-        elif tolerance > 0:  # means we want to make the shape bigger
-            if cv2.pointPolygonTest(points, (x1, y1), False) < 0:  # check if point 1 is outside contour
-                adjusted_points[i, 0, :] = adjusted_point_1
-            elif cv2.pointPolygonTest(points, (x2, y2), False) < 0:  # check if point 2 is outside contour
-                adjusted_points[i, 0, :] = adjusted_point_2
+    if tolerance == 0:
+        return adjusted_points
+
+    # there are two options for each point. One is inside and one is outside the contour
+    adjusted_points_1 = points[:, 0, :] + offsets
+    adjusted_points_2 = points[:, 0, :] - offsets
+    inside_1 = points_polygon_test(points, adjusted_points_1)
+    inside_2 = points_polygon_test(points, adjusted_points_2)
+    if tolerance < 0:  # means we want to make the shape smaller, so pick the option inside the contour
+        use_1 = inside_1 > 0
+        use_2 = ~use_1 & (inside_2 > 0)
+    else:  # means we want to make the shape bigger, so pick the option outside the contour
+        use_1 = inside_1 < 0
+        use_2 = ~use_1 & (inside_2 < 0)
+
+    adjusted_points[use_1, 0, :] = adjusted_points_1[use_1]
+    adjusted_points[use_2, 0, :] = adjusted_points_2[use_2]
 
     return adjusted_points
 
@@ -102,33 +234,209 @@ class ContourTracer(ImageViewer):
     WINDOW_NAME = "CAD Lasso"
     MAX_ZOOM_LEVEL = 20
 
-    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE):
-        super().__init__(screen_width, screen_height, image_location, downsample)
+    # the magnet route has finished in the background and only needs to be drawn
+    LAYER_ROUTE = 8
+
+    # pyramid levels with more pixels than this have their edges detected in the background tile by tile, starting
+    # around the cursor, so a big image can be traced right after loading it
+    BACKGROUND_EDGE_PIXELS = 16 * 1000 * 1000
+
+    SESSION_ARRAYS = ("lasso_points", "lasso_segment_ends", "lasso_clicks")
+    # the view with the lasso blended into it, the frame with the preview drawn on top of that, and the float images the
+    # lasso is blended with
+    FRAME_BUFFERS = dict(ImageViewer.FRAME_BUFFERS, lasso=(3, np.uint8), frame=(3, np.uint8), alpha=(1, np.float32),
+                         inverse_alpha=(1, np.float32), blend=(3, np.float32), blend_color=(3, np.float32))
+
+    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE, image_cache=None):
+        # routes are found on a background thread once a window is opened. Without a window they are found right away.
+        # Set before loading so load_image can discard routes
+        self.route_worker = None
+        self.route_sequence_floor = 0  # routes from requests older than this are for a lasso that has changed since
+        self.route_sequence_shown = 0
+        # detects the edges of big pyramid levels in the background. Set before loading so load_image can stop it
+        self.edge_scheduler = None
 
-        self.magnet = True
+        super().__init__(screen_width, screen_height, image_location, downsample, image_cache)
+
+        self.snap_mode = MAGNET_MODE
+        self.auto_outline_method = OTSU_METHOD
 
         if image_location is None:
             # points in lasso
             self.points = []
-            self.contours = []
+            self.contours = LassoBuffer()
+            self.replaced_lassos = []
             self.next_point = (0, 0)
             self.next_contour = None
 
+            # edges and contours of the whole image for the magnet, for each level of the image pyramid so the magnet
+            # follows the edges that can be seen at the current zoom. contour_index is the one of the full resolution
+            self.edges = None
+            self.contour_indexes = None
+            self.contour_index = None
+            self.livewire = None
+            self.auto_outline = None
+            self.box_start = None  # where the left button was pressed in auto outline mode (image coordinates)
+
+            # window sized view without and with the committed lasso drawn on it. Only rebuilt when their layers are
+            # invalidated
+            self.view_image = None
+            self.lasso_image = None
+            self.lasso_overlay = LassoOverlay()
+
+            # thumbnail of the image with the lasso on it for the gui. Updated when the lasso is accepted with enter
+            self.preview = None
+
     def load_image(self, image_location, downsample=DOWNSAMPLE):
         super().load_image(image_location, downsample)
 
         # reset points in lasso
         self.points = []
-        self.contours = []
+        self.contours = LassoBuffer()
+        # lassos replaced by auto outlines (as arrays from get_session_state), so a right click can bring them back
+        self.replaced_lassos = []
         self.next_point = (0, 0)
         self.next_contour = None
-
-        cv2.imwrite(CONTOUR_PREVIEW_SAVE_LOCATION, self.im)
+        self.view_image = None
+        self.lasso_image = None
+        self.lasso_overlay = LassoOverlay()
+        self.box_start = None
+        self.discard_pending_routes()
+
+        # edge detection is done once for every pyramid level so moving the cursor only needs an index lookup
+        with self.frame_timer.stage("edges"):
+            edge_pyramid = {}
+            if self.image_cache is not None:
+                for level in range(len(self.pyramid)):
+                    cached = self.image_cache.load_edges(self.cache_key, level)
+                    if cached is not None:
+                        edge_pyramid[level] = cached
+            missing = [level for level in range(len(self.pyramid)) if level not in edge_pyramid]
+            background = [level for level in missing
+                          if self.pyramid[level].shape[0] * self.pyramid[level].shape[1] > self.BACKGROUND_EDGE_PIXELS]
+            found = find_edge_pyramid(self.pyramid, [level for level in missing if level not in background])
+            if self.image_cache is not None:
+                for level, (edges, contours) in found.items():
+                    self.image_cache.save_edges(self.cache_key, edges, contours, level)
+            edge_pyramid.update(found)
+
+            if self.edge_scheduler is not None:
+                self.edge_scheduler.stop()
+            self.edge_scheduler = EdgeTileScheduler(self.pyramid, background) if len(background) > 0 else None
+
+            # contours of every level are in full resolution coordinates, so the grid cells grow with the level. Levels
+            # detected in the background are queried tile by tile until they are done (see update_edge_levels)
+            self.edges = []
+            self.contour_indexes = []
+            for level in range(len(self.pyramid)):
+                if level in edge_pyramid:
+                    self.edges.append(edge_pyramid[level][0])
+                    self.contour_indexes.append(ContourIndex(edge_pyramid[level][1], GRID_CELL_SIZE << level))
+                else:
+                    self.edges.append(self.edge_scheduler.edges[level])
+                    self.contour_indexes.append(self.edge_scheduler.get_index(level))
+            self.contour_index = self.contour_indexes[0]
+        # the livewire's cost maps are only found once it is used
+        self.livewire = LiveWire(self.pyramid)
+        # the segmentation for auto outlines is only done once an object is clicked
+        self.auto_outline = AutoOutline(self.pyramid)
+
+        self.load_session()
+        self.preview = self.get_contour_preview(self.THUMBNAIL_HEIGHT)
+
+    def get_settings(self):
+        settings = super().get_settings()
+        settings.update(snap_mode=self.snap_mode, auto_outline_method=self.auto_outline_method)
+        return settings
+
+    def set_settings(self, settings):
+        super().set_settings(settings)
+        self.snap_mode = settings["snap_mode"]
+        self.auto_outline_method = settings["auto_outline_method"]
+        self.box_start = None
+
+    def init_window(self):
+        super().init_window()
+        if self.EVENT_RECORD_LOCATION is not None:
+            # while recording, routes are found right away and all edges are there before the first event, so a click
+            # always takes the route for where the cursor is and the recording replays exactly. Replays start without
+            # any replaced lassos to undo to, so neither does the recording
+            self.wait_for_edges()
+            self.replaced_lassos = []
+        elif self.route_worker is None:
+            self.route_worker = RouteWorker()
+
+    def get_wait_time(self):
+        if self.route_worker is None:
+            return super().get_wait_time()
+        elif self.route_worker.has_pending():
+            return ROUTE_POLL_TIME
+        return ROUTE_IDLE_POLL_TIME
+
+    def update_background_work(self):
+        self.update_edge_levels()
+        if self.route_worker is None:
+            return
+        result = self.route_worker.get_result()
+        if result is not None:
+            sequence_number, route = result
+            # keep showing the last route until a fresher one for the current lasso arrives
+            if sequence_number >= self.route_sequence_floor and sequence_number > self.route_sequence_shown:
+                if route is None and len(self.points) > 0 and self.next_point is not None:
+                    # the route search failed (the worker logged why), so connect to the cursor with a line instead
+                    last_point_x, last_point_y = self.points[-1]
+                    next_point_x, next_point_y = self.next_point
+                    route = find_points_along_line(last_point_x, last_point_y, next_point_x, next_point_y)
+                self.next_contour = route
+                self.route_sequence_shown = sequence_number
+                self.invalidate(self.LAYER_ROUTE)
+
+    def update_edge_levels(self):
+        # levels whose edges were detected in the background replace their tile by tile index once they are done
+        if self.edge_scheduler is None:
+            return
+        for level, (edges, contour_index) in self.edge_scheduler.take_finished_levels().items():
+            self.edges[level] = edges
+            self.contour_indexes[level] = contour_index
+            if self.image_cache is not None:
+                self.image_cache.save_edges(self.cache_key, edges, contour_index.contours, level)
+        self.contour_index = self.contour_indexes[0]
+
+    def wait_for_edges(self):
+        # wait until the edges of every level are detected (for scripts, which don't run the event loop)
+        if self.edge_scheduler is not None:
+            self.edge_scheduler.wait()
+            self.update_edge_levels()
+
+    def update_edge_focus(self):
+        # background edge detection starts with the tiles around the cursor, the last lasso point and the view
+        if self.edge_scheduler is not None:
+            anchor = self.points[-1] if len(self.points) > 0 else None
+            self.edge_scheduler.set_focus([self.next_point, anchor], self.get_zoom_region_position(),
+                                          self.get_view_level())
+
+    def discard_pending_routes(self):
+        # routes requested before now are for a different lasso or mode
+        if self.route_worker is not None:
+            self.route_sequence_floor = self.route_worker.sequence_number + 1
 
     def get_processed_image(self):
-        image_to_show = self.show_next_point_preview(self.im.copy())
-        image_to_show = self.handle_display_points(image_to_show)
-        image_to_show = self.handle_zoom_and_pan(image_to_show)
+        frame_timer = self.frame_timer
+        self.update_edge_focus()
+        if self.dirty & self.LAYER_VIEW or self.view_image is None:
+            with frame_timer.stage("zoom_and_pan"):
+                self.view_image = self.handle_zoom_and_pan()
+        # the lasso is drawn in window coordinates so it moves with the view
+        if self.dirty & (self.LAYER_VIEW | self.LAYER_LASSO) or self.lasso_image is None:
+            with frame_timer.stage("lasso"):
+                self.lasso_image = self.handle_display_points(self.view_image)
+        if self.dirty & self.LAYER_PREVIEW:
+            with frame_timer.stage("route"):
+                self.update_next_contour()
+        with frame_timer.stage("preview"):
+            frame = self.frame_buffers["frame"]
+            np.copyto(frame, self.lasso_image)
+            image_to_show = self.show_next_point_preview(frame)
         return image_to_show
 
     def handle_mouse_event(self, event, x, y, flags, param):
@@ -137,137 +445,221 @@ class ContourTracer(ImageViewer):
             x, y = self.convert_local_to_global(x, y)
             print(x, y)
             print(self.convert_global_to_local(x, y))
+            if self.snap_mode == AUTO_OUTLINE_MODE:
+                self.box_start = (x, y)
         # check to see if the left mouse button was released
         elif event == cv2.EVENT_LBUTTONUP:
 
-            if self.next_contour is not None:
-                self.points.append((self.next_contour[-1, 0, 0], self.next_contour[-1, 0, 1]))
-                self.contours.append(self.next_contour.copy())
+            if self.snap_mode == AUTO_OUTLINE_MODE:
+                self.outline_object(self.convert_local_to_global(x, y))
             else:
-                x, y = self.convert_local_to_global(x, y)
-                self.points.append((int(x), int(y)))
-                self.contours.append(np.array([[[int(x), int(y)]]]))
+                self.add_next_contour(self.convert_local_to_global(x, y))
+            self.next_contour = None
+            self.discard_pending_routes()
+            self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
         elif event == cv2.EVENT_MOUSEMOVE:
             self.next_point = self.convert_local_to_global(x, y)
+            self.update_edge_focus()
+            # the preview only follows the cursor once there is a point to connect it to (or a box being dragged)
+            if len(self.points) > 0 or self.box_start is not None:
+                self.invalidate(self.LAYER_PREVIEW)
         elif event == cv2.EVENT_RBUTTONUP:
             # undo previous click if right mouse button clicked
+            if len(self.contours) == 1 and len(self.replaced_lassos) > 0:
+                # the outline that replaced the lasso, so the lasso comes back
+                self.restore_lasso(self.replaced_lassos.pop())
+                return
             if len(self.contours) > 0:
-                del self.contours[-1]
+                self.contours.pop()
+                self.lasso_overlay.clear()
                 self.next_contour = None
             if len(self.points) > 0:
                 del self.points[-1]
                 self.next_point = None
+            self.discard_pending_routes()
+            self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
 
     def handle_key_press(self, key):
         if super().handle_key_press(key):
             return True
         elif key == 13:  # enter key
-            preview = self.handle_display_points(self.im.copy(), thickness_scale_factor=2)
-            cv2.imwrite(CONTOUR_PREVIEW_SAVE_LOCATION, preview)
+            self.preview = self.get_contour_preview(self.THUMBNAIL_HEIGHT)
             return True
-        elif key == ord("c"):  # "c" toggle contour magnet or line
-            self.magnet = not self.magnet
+        elif key == ord("c"):  # "c" switch between contour magnet, livewire and line
+            self.snap_mode = SNAP_MODES[(SNAP_MODES.index(self.snap_mode) + 1) % len(SNAP_MODES)]
+            print("Snap mode:", self.snap_mode)
+            self.box_start = None
+            self.discard_pending_routes()
+            self.invalidate(self.LAYER_PREVIEW)
+        elif key == ord("m"):  # "m" switch between the ways auto outline mode finds objects
+            self.auto_outline_method = AUTO_OUTLINE_METHODS[(AUTO_OUTLINE_METHODS.index(self.auto_outline_method) + 1) %
+                                                            len(AUTO_OUTLINE_METHODS)]
+            print("Auto outline method:", self.auto_outline_method)
         return False
 
-    def handle_display_points(self, image, thickness_scale_factor=1):
-        image_copy = image.copy()
+    def get_session_state(self):
+        # the lasso, so it is still there the next time this image is loaded
+        return {
+            "lasso_points": self.get_lasso_points(),
+            "lasso_segment_ends": np.array(self.contours.segment_ends, np.int64),
+            "lasso_clicks": np.array(self.points, np.int32).reshape(-1, 2),
+        }
+
+    def set_session_state(self, arrays):
+        self.replaced_lassos = []
+        self.restore_lasso(arrays)
+
+    def restore_lasso(self, arrays):
+        self.contours.clear()
+        self.lasso_overlay.clear()
+        self.next_contour = None
+        self.discard_pending_routes()
+        start = 0
+        for end in arrays["lasso_segment_ends"]:
+            self.contours.append(arrays["lasso_points"][start:end])
+            start = end
+        self.points = [(int(x), int(y)) for x, y in arrays["lasso_clicks"]]
+        self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
+
+    def add_next_contour(self, point):
+        # add the route shown to the cursor to the lasso, or just the point (image coordinates) if there is none
+        if self.next_contour is not None:
+            self.points.append((self.next_contour[-1, 0, 0], self.next_contour[-1, 0, 1]))
+            self.contours.append(self.next_contour)
+        else:
+            x, y = point
+            self.points.append((int(x), int(y)))
+            self.contours.append([int(x), int(y)])
+
+    def click(self, point):
+        # a left click at point (image coordinates) without a window: the route to it is found first, like moving the
+        # cursor there would
+        self.next_point = point
+        self.update_next_contour()
+        self.add_next_contour(point)
+        self.next_contour = None
+        self.discard_pending_routes()
+        self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
+
+    def get_lasso_points(self):
+        # all the contours as one giant line (a view of the lasso buffer, not a copy)
+        return self.contours.get_points()
+
+    def select_contour(self, contour):
+        # replace the lasso with a whole contour (e.g. one picked automatically instead of clicked). The lasso is kept
+        # (copied, since the lasso buffer is reused) so undoing the contour brings it back
+        self.replaced_lassos.append({name: np.array(array) for name, array in self.get_session_state().items()})
+        self.points = [(contour[-1, 0, 0], contour[-1, 0, 1])]
+        self.contours.clear()
+        self.contours.append(contour)
+        self.lasso_overlay.clear()
+        self.next_contour = None
+        self.discard_pending_routes()
+        self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
+
+    def outline_object(self, end):
+        # replace the lasso with the outline of the object under the cursor, or inside the box dragged from box_start
+        # to end (image coordinates)
+        start, self.box_start = self.box_start, None
+        if start is None:
+            return
+        drag_distance = np.hypot(end[0] - start[0], end[1] - start[1]) * self.get_view_scale_factor()
+        with self.frame_timer.stage("auto_outline"):
+            if drag_distance <= AUTO_OUTLINE_CLICK_DISTANCE:
+                contour = self.auto_outline.find_outline(seed=end, method=self.auto_outline_method)
+            else:
+                box = (min(start[0], end[0]), min(start[1], end[1]), max(start[0], end[0]), max(start[1], end[1]))
+                contour = self.auto_outline.find_outline(box=box, method=self.auto_outline_method)
+        if contour is None:
+            print("No object found")
+            self.invalidate(self.LAYER_PREVIEW)
+        else:
+            self.select_contour(contour)
+
+    def handle_display_points(self, image):
+        # the view with the lasso blended into it, drawn into the lasso frame buffer
+        lasso_image = self.frame_buffers["lasso"]
+        if len(self.contours) == 0:
+            np.copyto(lasso_image, image)
+            return lasso_image
+
+        # the lasso is rasterized once per zoom level for the whole image and we only need the part in the window
+        scale = self.get_view_scale_factor()
+        origin_x, origin_y = self.get_view_origin()
+        zoom = self.get_zoom_scale_factor()
+        mask_width = int(np.ceil(max(self.image_width * scale, zoom * self.window_width))) + 2
+        mask_height = int(np.ceil(max(self.image_height * scale, zoom * self.window_height))) + 2
+        mask = self.lasso_overlay.get_mask(self.current_zoom_level, mask_width, mask_height, scale,
+                                           self.get_lasso_points(), self.LINE_THICKNESS, self.VIEW_SHIFT)
+        mask_x = int(round(origin_x * scale))
+        mask_y = int(round(origin_y * scale))
+        alpha = mask[mask_y:mask_y + self.window_height, mask_x:mask_x + self.window_width]
+
+        # blend the lasso color into the view using the mask as alpha: image * (1 - alpha) + color * alpha, in place
+        buffers = self.frame_buffers
+        color = np.array((255, 0, 0), np.float32)  # blue
+        np.divide(alpha[:, :, np.newaxis], 255, out=buffers["alpha"], dtype=np.float32)
+        np.subtract(np.float32(1), buffers["alpha"], out=buffers["inverse_alpha"])
+        np.multiply(image, buffers["inverse_alpha"], out=buffers["blend"])
+        np.multiply(color, buffers["alpha"], out=buffers["blend_color"])
+        np.add(buffers["blend"], buffers["blend_color"], out=buffers["blend"])
+        np.copyto(lasso_image, buffers["blend"], casting="unsafe")
+
+        return lasso_image
+
+    def get_contour_preview(self, height):
+        # thumbnail of the image with the lasso drawn on it
+        preview = self.get_thumbnail(height)
         if len(self.contours) > 0:
             color = (255, 0, 0)  # blue
-            # choose line thickness (in pixels) based on window size and zoom
-            thickness = thickness_scale_factor * \
-                        int(np.ceil(3 * (self.image_width / self.window_width) / self.get_zoom_scale_factor()))
-
-            # append all the contours into one giant line
-            points = self.contours[0]
-            for cont in self.contours[1:]:
-                points = np.concatenate((points, cont))
+            points = self.convert_global_to_thumbnail_points(self.get_lasso_points(), height)
+            cv2.polylines(preview, [points], False, color, thickness=PREVIEW_LINE_THICKNESS, lineType=cv2.LINE_AA,
+                          shift=self.VIEW_SHIFT)
 
-            cv2.polylines(image_copy, [points], False, color, thickness=thickness, lineType=cv2.LINE_AA)
+        return preview
 
-        return image_copy
+    def update_next_contour(self):
+        # find the route from the last point to the cursor. This is the expensive part of the preview so it is only
+        # recomputed when the preview layer has been invalidated
+        if len(self.points) == 0 or self.next_point is None or self.snap_mode == AUTO_OUTLINE_MODE:
+            self.next_contour = None
+            return
+
+        last_point_x, last_point_y = self.points[-1]
+        next_point_x, next_point_y = self.next_point
+        last_point = (int(last_point_x), int(last_point_y))
+        next_point = (int(next_point_x), int(next_point_y))
+        # image pixels per window pixel
+        scale_factor = 1 / self.get_view_scale_factor()
+        # the magnet uses the edges of the pyramid level that is on screen
+        contour_index = self.contour_indexes[self.get_view_level()]
+
+        if self.route_worker is None:
+            self.next_contour = find_next_contour(contour_index, self.livewire, last_point, next_point,
+                                                  self.snap_mode, MAGNET_RADIUS * scale_factor)
+        else:
+            # the result is picked up by update_background_work. Until then the last route stays on screen
+            self.route_worker.submit(self.frame_timer.time_function("route_worker", find_next_contour),
+                                     contour_index, self.livewire, last_point, next_point, self.snap_mode,
+                                     MAGNET_RADIUS * scale_factor)
 
     def show_next_point_preview(self, image):
-        thickness = int(np.ceil(3 * (self.image_width / self.window_width) / self.get_zoom_scale_factor()))
-
-        if len(self.points) > 0 and self.next_point is not None:
-            last_point_x, last_point_y = self.points[-1]
-            next_point_x, next_point_y = self.next_point
-
-            last_point_x = int(last_point_x)
-            last_point_y = int(last_point_y)
-            next_point_x = int(next_point_x)
-            next_point_y = int(next_point_y)
-
-            top_left_x = min(last_point_x, next_point_x)
-            top_left_y = min(last_point_y, next_point_y)
-            bottom_right_x = max(last_point_x, next_point_x)
-            bottom_right_y = max(last_point_y, next_point_y)
-
-            scale_factor = self.image_width / self.window_width / self.get_zoom_scale_factor()
-
-            if (bottom_right_x - top_left_x) / scale_factor > 1 and (bottom_right_y - top_left_y) / scale_factor > 1:
-
-                im_copy = image.copy()
-                roi = im_copy[top_left_y:bottom_right_y, top_left_x:bottom_right_x]
-                roi = cv2.resize(roi, None, fx=(1/scale_factor), fy=(1/scale_factor))
-                gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-                canny = cv2.Canny(gray, 30, 200)
-
-                contours, hierarchy = cv2.findContours(canny, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-
-                min_dist = self.image_width
-                closest_contour = -1
-                for i, contour in enumerate(contours):
-                    contour[:, :, :] = np.round(contour[:, :, :] * scale_factor)
-                    contour[:, :, 0] += top_left_x
-                    contour[:, :, 1] += top_left_y
-
-                    dist = cv2.pointPolygonTest(contour, (next_point_x, next_point_y), True)
-                    if abs(dist) < min_dist:
-                        min_dist = abs(dist)
-                        closest_contour = i
-
-                if closest_contour >= 0 and self.magnet:
-                    # find closest contour points for next contour
-                    start_ind, (start_point_x, start_point_y) = \
-                        find_closest_contour_point(contours[closest_contour], (last_point_x, last_point_y))
-                    end_ind, (end_point_x, end_point_y) = \
-                        find_closest_contour_point(contours[closest_contour], (next_point_x, next_point_y))
-
-                    # find shortest route (since a contour is a loop)
-                    route = find_shortest_route(contours[closest_contour], start_ind, end_ind)
-
-                    # connect end of last contour route to next contour route
-                    line = find_points_along_line(last_point_x, last_point_y, start_point_x, start_point_y)
-                    route = np.concatenate((line, route), 0)
-
-                    self.next_contour = route
-
-                    # draw closest/shortest contour route
-                    cv2.polylines(image, [route], False, (0, 255, 0), thickness=thickness, lineType=cv2.LINE_AA)
-
-                else:
-                    line = find_points_along_line(last_point_x, last_point_y, next_point_x, next_point_y)
-                    self.next_contour = line
-
-                    # if no contours found, we just draw to the current cursor location
-                    cv2.line(image, (last_point_x, last_point_y), (next_point_x, next_point_y), (0, 255, 0),
-                             thickness)
-            else:
-                line = find_points_along_line(last_point_x, last_point_y, next_point_x, next_point_y)
-                self.next_contour = line
-
-                # if no contours found, we just draw to the current cursor location
-                cv2.line(image, (last_point_x, last_point_y), (next_point_x, next_point_y), (0, 255, 0),
-                         thickness)
+        if self.box_start is not None and self.next_point is not None:
+            # box being dragged in auto outline mode
+            corners = self.convert_global_to_local_points(np.array([self.box_start, self.next_point]))
+            cv2.rectangle(image, tuple(corners[0]), tuple(corners[1]), (0, 255, 0), thickness=self.LINE_THICKNESS,
+                          lineType=cv2.LINE_AA, shift=self.VIEW_SHIFT)
+        if self.next_contour is not None:
+            # draw closest/shortest contour route
+            route = self.convert_global_to_local_points(self.next_contour)
+            cv2.polylines(image, [route], False, (0, 255, 0), thickness=self.LINE_THICKNESS, lineType=cv2.LINE_AA,
+                          shift=self.VIEW_SHIFT)
 
         return image
 
-    def scale_and_save_points(self, save_location, scale_factor, tolerance):
-        # append all the contours into one giant line
-        points = self.contours[0]
-        for cont in self.contours[1:]:
-            points = np.concatenate((points, cont))
+    def get_scaled_points(self, scale_factor, tolerance):
+        # lasso points as an (N, 2) array in cm, centered on zero with y pointing up
+        points = self.get_lasso_points().copy()
 
         points[:, 0, 1] = -1 * points[:, 0, 1]  # flip y because image zero is top left
 
@@ -282,7 +674,18 @@ class ContourTracer(ImageViewer):
         points_to_save[:, 0] -= zero_x
         points_to_save[:, 1] -= zero_y
 
-        np.savetxt(save_location, points_to_save, delimiter=",")  # save to csv file
+        return points_to_save
+
+    def scale_and_save_points(self, save_location, scale_factor, tolerance, file_format=None, simplify_tolerance=0):
+        # file_format is one of exporters.FILE_FORMATS. By default it is picked from the file extension (csv otherwise).
+        # With a simplify_tolerance (cm) points are removed wherever the outline stays within that distance without
+        # them. Returns the number of points saved and the largest distance (cm) the simplification moved the outline.
+        # Raises ValueError (without writing anything) if the lasso is empty
+        if len(self.get_lasso_points()) == 0:
+            raise ValueError("Nothing to save: the lasso is empty")
+        points, max_deviation = simplify_points(self.get_scaled_points(scale_factor, tolerance), simplify_tolerance)
+        export_points(save_location, points, file_format)
+        return len(points), max_deviation
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# the lowest Canny thresholds. On clean images these are used as they are and on noisy ones they are raised above the
+# noise (see find_canny_thresholds)
+CANNY_THRESHOLD_1 = 30
+CANNY_THRESHOLD_2 = 200
+NOISE_FACTOR = 4  # times the median gradient that a gradient needs to be to start an edge
+THRESHOLD_SAMPLE_PIXELS = 1000 * 1000  # at most this many pixels are used to find the thresholds
+THRESHOLD_SAMPLE_BLOCK = 64  # pixels. Big images are sampled in blocks this size spread over the whole image
+GRID_CELL_SIZE = 32  # in pixels
+
+
+def get_gradient_sample(image):
+    # blocks of the image spread evenly over it, at most THRESHOLD_SAMPLE_PIXELS in total
+    step = int(np.ceil(np.sqrt(image.shape[0] * image.shape[1] / THRESHOLD_SAMPLE_PIXELS)))
+    if step <= 1:
+        return [np.asarray(image)]
+    block = THRESHOLD_SAMPLE_BLOCK
+    return [image[y:y + block, x:x + block] for y in range(0, image.shape[0], block * step)
+            for x in range(0, image.shape[1], block * step)]
+
+
+def find_canny_thresholds(image):
+    # Canny thresholds for a gray or BGR image (or tiled raster) from the statistics of its gradient. Most pixels are
+    # not on an edge, so the median gradient is a measure of the noise (and texture) and a gradient has to be well
+    # above it to start an edge. Uses the same gradient as cv2.Canny (3x3 Sobel, L1 norm) so the thresholds are on the
+    # same scale
+    magnitudes = []
+    for block in get_gradient_sample(image):
+        if block.ndim == 3:
+            block = cv2.cvtColor(block, cv2.COLOR_BGR2GRAY)
+        gradient_x = cv2.Sobel(block, cv2.CV_16S, 1, 0)
+        gradient_y = cv2.Sobel(block, cv2.CV_16S, 0, 1)
+        magnitudes.append((np.abs(gradient_x.astype(np.int32)) + np.abs(gradient_y)).ravel())
+    median = np.median(np.concatenate(magnitudes))
+    threshold2 = max(NOISE_FACTOR * median, CANNY_THRESHOLD_2)
+    return threshold2 * CANNY_THRESHOLD_1 / CANNY_THRESHOLD_2, threshold2
+
+
+def find_edge_contours(image, threshold1=None, threshold2=None):
+    # thresholds that aren't given are found from the image
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if threshold1 is None or threshold2 is None:
+        auto_threshold1, auto_threshold2 = find_canny_thresholds(gray)
+        threshold1 = auto_threshold1 if threshold1 is None else threshold1
+        threshold2 = auto_threshold2 if threshold2 is None else threshold2
+    edges = cv2.Canny(gray, threshold1, threshold2)
+    contours, hierarchy = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    return edges, list(contours)
+
+
+def find_level_edge_contours(image, level):
+    # edges of a pyramid level, with the contours scaled to the coordinates of the full image (level 0)
+    edges, contours = find_edge_contours(np.asarray(image))
+    if level > 0:
+        contours = [contour * (1 << level) for contour in contours]
+    return edges, contours
+
+
+def find_edge_pyramid(pyramid, levels=None, workers=None):
+    # (edges, contours) of each of the given levels of an image pyramid (all of them by default), built in parallel.
+    # OpenCV releases the GIL, so threads use all the cores without copying the images to other processes
+    if levels is None:
+        levels = range(len(pyramid))
+    levels = list(levels)
+    if len(levels) == 0:
+        return {}
+    workers = workers or min(len(levels), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {level: executor.submit(find_level_edge_contours, pyramid[level], level) for level in levels}
+        return {level: future.result() for level, future in futures.items()}
+
+
+class ContourIndex:
+    # Grid bucket index over every point of a set of contours. Points are sorted by the grid cell they fall in so the
+    # points of any row of cells can be found with two binary searches
+
+    def __init__(self, contours, cell_size=GRID_CELL_SIZE):
+        self.contours = contours
+        self.cell_size = cell_size
+
+        lengths = np.array([len(contour) for contour in contours], np.int64)
+        if len(contours) > 0:
+            points = np.concatenate([contour[:, 0, :] for contour in contours]).astype(np.int64)
+        else:
+            points = np.empty((0, 2), np.int64)
+
+        # which contour each point belongs to and where it is in that contour
+        contour_ids = np.repeat(np.arange(len(contours)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        point_indices = np.arange(len(points)) - np.repeat(starts, lengths)
+
+        cells_x = points[:, 0] // cell_size
+        cells_y = points[:, 1] // cell_size
+        self.grid_width = int(cells_x.max()) + 1 if len(points) > 0 else 1
+        self.grid_height = int(cells_y.max()) + 1 if len(points) > 0 else 1
+        keys = cells_y * self.grid_width + cells_x
+
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.points = points[order]
+        self.contour_ids = contour_ids[order]
+        self.point_indices = point_indices[order]
+
+    def query(self, x, y, radius):
+        # returns (contour ids, point indices, distances) of all points within radius of (x, y)
+        cell_x0 = max(int((x - radius) // self.cell_size), 0)
+        cell_x1 = min(int((x + radius) // self.cell_size), self.grid_width - 1)
+        cell_y0 = max(int((y - radius) // self.cell_size), 0)
+        cell_y1 = min(int((y + radius) // self.cell_size), self.grid_height - 1)
+
+        if cell_x0 > cell_x1 or cell_y0 > cell_y1:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+
+        # each row of cells is one contiguous run of the sorted points
+        row_keys = np.arange(cell_y0, cell_y1 + 1) * self.grid_width
+        row_starts = np.searchsorted(self.keys, row_keys + cell_x0, side="left")
+        row_ends = np.searchsorted(self.keys, row_keys + cell_x1, side="right")
+        if len(row_starts) == 1:
+            candidates = np.arange(row_starts[0], row_ends[0])
+        else:
+            candidates = np.concatenate([np.arange(start, end) for start, end in zip(row_starts, row_ends)])
+
+        points = self.points[candidates]
+        dist = np.sqrt(np.power(points[:, 0] - x, 2) + np.power(points[:, 1] - y, 2))
+        in_range = dist <= radius
+        candidates = candidates[in_range]
+        return self.contour_ids[candidates], self.point_indices[candidates], dist[in_range]
+
+    def find_closest_point(self, x, y, radius):
+        # returns (contour id, point index, distance) of the closest contour point within radius, or None
+        contour_ids, point_indices, dist = self.query(x, y, radius)
+        if len(dist) == 0:
+            return None
+        ind = np.argmin(dist)
+        return contour_ids[ind], point_indices[ind], dist[ind]
@@ -0,0 +1,252 @@
+import atexit
+import os
+import threading
+import weakref
+
+import cv2
+import numpy as np
+
+from edge_index import ContourIndex
+from edge_index import GRID_CELL_SIZE
+from edge_index import find_canny_thresholds
+
+EDGE_TILE_SIZE = 1024  # pixels of a pyramid level per tile
+EDGE_TILE_HALO = 16  # pixels around a tile that are included in its edge detection so edges continue across tiles
+
+running_schedulers = weakref.WeakSet()
+
+
+@atexit.register
+def stop_running_schedulers():
+    # OpenCV aborts the process if it is still detecting edges on a background thread while python shuts down
+    for scheduler in list(running_schedulers):
+        scheduler.stop()
+        for thread in scheduler.threads:
+            thread.join()
+
+
+def get_tile_regions(width, height, tile_size):
+    # (x0, y0, x1, y1) of every tile of an image, row by row
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+
+def find_tile_edges(image, region, threshold1, threshold2, halo=EDGE_TILE_HALO):
+    # edges of one tile of an image (or tiled raster), and its contours in the image's coordinates. The tile is
+    # detected with a halo around it so Canny's smoothing and hysteresis see the edges that cross into it
+    x0, y0, x1, y1 = region
+    height, width = image.shape[:2]
+    halo_x0, halo_y0 = max(x0 - halo, 0), max(y0 - halo, 0)
+    halo_x1, halo_y1 = min(x1 + halo, width), min(y1 + halo, height)
+    gray = cv2.cvtColor(np.asarray(image[halo_y0:halo_y1, halo_x0:halo_x1]), cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, threshold1, threshold2)[y0 - halo_y0:y1 - halo_y0, x0 - halo_x0:x1 - halo_x0]
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE, offset=(x0, y0))
+    return edges, list(contours)
+
+
+class TiledContourIndex:
+    # Same queries as ContourIndex over the contours of one pyramid level that is still being detected tile by tile.
+    # Tiles that are done are looked up in their own ContourIndex and tiles that are not are detected right away (only
+    # the ones the query touches). Contours only ever get added, so contour ids stay valid
+
+    def __init__(self, scheduler, level):
+        self.scheduler = scheduler
+        self.level = level
+        self.contours = []
+        self.tile_indexes = {}  # tile number -> (ContourIndex of the tile, id of its first contour)
+
+    def add_tile(self, tile, contours):
+        # called by the scheduler with its lock held. Contours are in full resolution coordinates
+        self.tile_indexes[tile] = (ContourIndex(contours, GRID_CELL_SIZE << self.level), len(self.contours))
+        self.contours.extend(contours)
+
+    def query(self, x, y, radius):
+        # returns (contour ids, point indices, distances) of all points within radius of (x, y)
+        results = []
+        for tile in self.scheduler.get_tiles_in_region(self.level, (x - radius, y - radius, x + radius, y + radius)):
+            tile_index, first_id = self.scheduler.get_tile_index(self.level, tile)
+            contour_ids, point_indices, dist = tile_index.query(x, y, radius)
+            results.append((contour_ids + first_id, point_indices, dist))
+        if len(results) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return tuple(np.concatenate(values) for values in zip(*results))
+
+    def find_closest_point(self, x, y, radius):
+        # returns (contour id, point index, distance) of the closest contour point within radius, or None
+        contour_ids, point_indices, dist = self.query(x, y, radius)
+        if len(dist) == 0:
+            return None
+        ind = np.argmin(dist)
+        return contour_ids[ind], point_indices[ind], dist[ind]
+
+
+class EdgeTileScheduler:
+    # Detects the edges and contours of big pyramid levels tile by tile on a pool of background threads, so the first
+    # interaction with a big image doesn't wait for all of it. The tiles closest to where the user is working (the
+    # cursor, the last lasso point and the part of the image on screen, on the level on screen) are always done next.
+    # Each level can be queried through its TiledContourIndex while it is being detected. Once all tiles of a level are
+    # done its contours are found again over the whole level (so contours aren't cut at tile borders) and the level is
+    # handed over as (edges, ContourIndex) by take_finished_levels
+
+    def __init__(self, pyramid, levels, workers=None, tile_size=EDGE_TILE_SIZE):
+        self.pyramid = pyramid
+        self.tile_size = tile_size
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        # per level: edges of the whole level (filled in tile by tile), Canny thresholds, tile regions, tile states
+        # (None = waiting, False = being detected, True = done) and the index of the tiles that are done
+        self.edges = {}
+        self.thresholds = {}
+        self.tile_regions = {}
+        self.tile_states = {}
+        self.indexes = {}
+        self.levels_to_finish = []  # levels with all tiles done whose contours still need to be found in one piece
+        self.finished = {}  # level -> (edges, ContourIndex) of levels that are done and not taken yet
+        self.remaining_levels = set(levels)
+        for level in levels:
+            image = pyramid[level]
+            height, width = image.shape[:2]
+            self.edges[level] = np.zeros((height, width), np.uint8)
+            self.thresholds[level] = find_canny_thresholds(image)
+            self.tile_regions[level] = get_tile_regions(width, height, tile_size)
+            self.tile_states[level] = [None] * len(self.tile_regions[level])
+            self.indexes[level] = TiledContourIndex(self, level)
+
+        # where the user is working, in full resolution coordinates
+        self.focus_points = []
+        self.focus_region = None
+        self.focus_level = 0
+
+        workers = workers or os.cpu_count() or 1
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        running_schedulers.add(self)
+
+    def get_index(self, level):
+        return self.indexes[level]
+
+    def set_focus(self, points, region, level):
+        # points (x, y) and region (x, y, width, height) in full resolution coordinates, and the level on screen
+        with self.condition:
+            self.focus_points = [point for point in points if point is not None]
+            self.focus_region = region
+            self.focus_level = level
+
+    def stop(self):
+        # tiles that haven't started are dropped. Tiles being detected finish on their own
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        # wait until every level is done. Returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.remaining_levels) == 0 or self.stopped, timeout)
+
+    def take_finished_levels(self):
+        # level -> (edges, ContourIndex) of the levels that were finished since the last call
+        with self.condition:
+            finished, self.finished = self.finished, {}
+        return finished
+
+    def get_tiles_in_region(self, level, region):
+        # tile numbers of a level that overlap a region (x0, y0, x1, y1) in full resolution coordinates
+        height, width = self.edges[level].shape
+        tiles_x = -(-width // self.tile_size)
+        size = self.tile_size << level
+        x0 = max(int(region[0] // size), 0)
+        y0 = max(int(region[1] // size), 0)
+        x1 = min(int(region[2] // size), tiles_x - 1)
+        y1 = min(int(region[3] // size), -(-height // self.tile_size) - 1)
+        return [y * tiles_x + x for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+    def get_priority(self, level, tile):
+        # lower is sooner: tiles of the level on screen first, then tiles on screen, each by the distance to the closest
+        # focus point
+        x0, y0, x1, y1 = [value << level for value in self.tile_regions[level][tile]]
+        on_screen = True
+        if self.focus_region is not None:
+            region_x, region_y, region_width, region_height = self.focus_region
+            on_screen = x0 < region_x + region_width and region_x < x1 and y0 < region_y + region_height and \
+                region_y < y1
+        distance = 0
+        if len(self.focus_points) > 0:
+            distance = min(np.hypot(max(x0 - x, 0, x - x1), max(y0 - y, 0, y - y1)) for x, y in self.focus_points)
+        return level != self.focus_level, not on_screen, distance
+
+    def get_tile_index(self, level, tile):
+        # (ContourIndex, id of its first contour) of a tile. A tile that isn't done yet is detected on this thread (or
+        # waited for if a worker has started it already)
+        with self.condition:
+            state = self.tile_states[level][tile]
+            if state is None:
+                self.tile_states[level][tile] = False
+        if state is None:
+            self.detect_tile(level, tile)
+        with self.condition:
+            self.condition.wait_for(lambda: self.tile_states[level][tile] is True)
+            return self.indexes[level].tile_indexes[tile]
+
+    def take_next_tile(self):
+        # (level, tile) that should be detected next, marked as started, or None if there is nothing left
+        best = None
+        best_priority = None
+        for level, states in self.tile_states.items():
+            for tile, state in enumerate(states):
+                if state is None:
+                    priority = self.get_priority(level, tile)
+                    if best is None or priority < best_priority:
+                        best, best_priority = (level, tile), priority
+        if best is not None:
+            self.tile_states[best[0]][best[1]] = False
+        return best
+
+    def detect_tile(self, level, tile):
+        region = self.tile_regions[level][tile]
+        threshold1, threshold2 = self.thresholds[level]
+        edges, contours = find_tile_edges(self.pyramid[level], region, threshold1, threshold2)
+        if level > 0:
+            contours = [contour * (1 << level) for contour in contours]
+        x0, y0, x1, y1 = region
+        self.edges[level][y0:y1, x0:x1] = edges
+        with self.condition:
+            self.indexes[level].add_tile(tile, contours)
+            self.tile_states[level][tile] = True
+            if all(state is True for state in self.tile_states[level]):
+                self.levels_to_finish.append(level)
+            self.condition.notify_all()
+
+    def finish_level(self, level):
+        # contours of the whole level, so the ones crossing tile borders are in one piece
+        contours, _ = cv2.findContours(self.edges[level], cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+        contours = [contour * (1 << level) for contour in contours] if level > 0 else list(contours)
+        index = ContourIndex(contours, GRID_CELL_SIZE << level)
+        with self.condition:
+            self.finished[level] = (self.edges[level], index)
+            self.remaining_levels.discard(level)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            level_to_finish = None
+            with self.condition:
+                # tiles first, then levels that are ready to be finished, otherwise wait for tiles being detected
+                # elsewhere until everything is done
+                while True:
+                    if self.stopped:
+                        return
+                    next_tile = self.take_next_tile()
+                    if next_tile is not None:
+                        break
+                    if len(self.levels_to_finish) > 0:
+                        level_to_finish = self.levels_to_finish.pop(0)
+                        break
+                    if len(self.remaining_levels) == 0:
+                        return
+                    self.condition.wait()
+            if level_to_finish is not None:
+                self.finish_level(level_to_finish)
+            else:
+                self.detect_tile(*next_tile)
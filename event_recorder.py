@@ -0,0 +1,57 @@
+import json
+import os
+import time
+
+import numpy as np
+from image_cache import hash_file
+
+
+def encode_arrays(arrays):
+    # name -> array as something json can hold, keeping the dtype and shape (empty arrays included)
+    return {name: {"dtype": str(np.asarray(array).dtype), "shape": list(np.shape(array)),
+                   "values": np.asarray(array).ravel().tolist()} for name, array in arrays.items()}
+
+
+def decode_arrays(encoded):
+    return {name: np.array(array["values"], array["dtype"]).reshape(array["shape"])
+            for name, array in encoded.items()}
+
+
+def read_recording(location):
+    # the recorded sessions of a file, in the order their windows were closed
+    with open(location) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class EventRecorder:
+    # The mouse and key events of one window session, each with the time it happened (seconds since the window was
+    # shown), along with everything needed to replay them: the image (location and a hash of its content), the
+    # downsample, the screen size, the viewer's settings and the work done in the window before and after. Sessions are
+    # appended to the recording as one JSON line each when the window closes. replay_events.py plays them back
+
+    def __init__(self, viewer):
+        self.session = {
+            "viewer": type(viewer).__name__,
+            "image": os.path.abspath(viewer.image_location),
+            "image_hash": hash_file(viewer.image_location),
+            "downsample": viewer.downsample,
+            "screen": [viewer.screen_width, viewer.screen_height],
+            "settings": viewer.get_settings(),
+            "initial_state": encode_arrays(viewer.get_session_state()),
+            "events": [],
+        }
+        self.start = time.perf_counter()
+
+    def get_time(self):
+        return round(time.perf_counter() - self.start, 6)
+
+    def record_mouse(self, event, x, y, flags):
+        self.session["events"].append([self.get_time(), "mouse", int(event), int(x), int(y), int(flags)])
+
+    def record_key(self, key):
+        self.session["events"].append([self.get_time(), "key", int(key)])
+
+    def write(self, viewer, save_location):
+        self.session["final_state"] = encode_arrays(viewer.get_session_state())
+        with open(save_location, "a") as f:
+            f.write(json.dumps(self.session) + "\n")
@@ -0,0 +1,89 @@
+import gzip
+
+import numpy as np
+from file_formats import DEFAULT_FILE_FORMAT
+from file_formats import FILE_EXTENSIONS
+from file_formats import get_file_format
+
+CHUNK_SIZE = 65536  # points formatted/written at a time
+CSV_FORMAT = "%.18e,%.18e\n"  # same as np.savetxt(..., delimiter=",")
+
+
+def iterate_chunks(points, chunk_size=CHUNK_SIZE):
+    for start in range(0, len(points), chunk_size):
+        yield points[start:start + chunk_size]
+
+
+def write_csv_lines(f, points):
+    for chunk in iterate_chunks(points):
+        f.write(CSV_FORMAT * len(chunk) % tuple(chunk.ravel()))
+
+
+def write_csv(save_location, points):
+    with open(save_location, "w") as f:
+        write_csv_lines(f, points)
+
+
+def write_csv_gz(save_location, points):
+    with gzip.open(save_location, "wt") as f:
+        write_csv_lines(f, points)
+
+
+def write_npy(save_location, points):
+    np.save(save_location, points.astype("<f4"))
+
+
+def write_float32(save_location, points):
+    # raw little endian float32 x, y pairs without a header
+    with open(save_location, "wb") as f:
+        for chunk in iterate_chunks(points):
+            f.write(chunk.astype("<f4").tobytes())
+
+
+def write_dxf(save_location, points):
+    # R12 polyline in centimeters
+    with open(save_location, "w") as f:
+        f.write("0\nSECTION\n2\nHEADER\n9\n$INSUNITS\n70\n5\n0\nENDSEC\n")
+        f.write("0\nSECTION\n2\nENTITIES\n0\nPOLYLINE\n8\n0\n66\n1\n70\n0\n10\n0.0\n20\n0.0\n30\n0.0\n")
+        for chunk in iterate_chunks(points):
+            f.write("0\nVERTEX\n8\n0\n10\n%.9f\n20\n%.9f\n" * len(chunk) % tuple(chunk.ravel()))
+        f.write("0\nSEQEND\n8\n0\n0\nENDSEC\n0\nEOF\n")
+
+
+def write_svg(save_location, points):
+    # path in centimeters. svg y points down so it is flipped back
+    min_x, max_x = (points[:, 0].min(), points[:, 0].max()) if len(points) > 0 else (0, 0)
+    min_y, max_y = (-points[:, 1].max(), -points[:, 1].min()) if len(points) > 0 else (0, 0)
+    width = max(max_x - min_x, 1e-6)
+    height = max(max_y - min_y, 1e-6)
+    with open(save_location, "w") as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%.6fcm" height="%.6fcm" viewBox="%.6f %.6f %.6f %.6f">\n'
+                % (width, height, min_x, min_y, width, height))
+        f.write('<path fill="none" stroke="black" stroke-width="%.6f" d="' % (max(width, height) / 1000))
+        command = "M"
+        for chunk in iterate_chunks(points):
+            flipped = np.stack((chunk[:, 0], -chunk[:, 1]), axis=1)
+            f.write(command + "%.6f,%.6f " * len(chunk) % tuple(flipped.ravel()))
+            command = "L"
+        f.write('"/>\n</svg>\n')
+
+
+# file format name -> (file extension, writer)
+FILE_FORMATS = {
+    "csv": (FILE_EXTENSIONS["csv"], write_csv),
+    "csv.gz": (FILE_EXTENSIONS["csv.gz"], write_csv_gz),
+    "npy": (FILE_EXTENSIONS["npy"], write_npy),
+    "float32": (FILE_EXTENSIONS["float32"], write_float32),
+    "dxf": (FILE_EXTENSIONS["dxf"], write_dxf),
+    "svg": (FILE_EXTENSIONS["svg"], write_svg),
+}
+
+
+def export_points(save_location, points, file_format=None):
+    # points is an (N, 2) array of x, y. Without a file format it is picked from the file extension
+    if file_format is None:
+        file_format = get_file_format(save_location) or DEFAULT_FILE_FORMAT
+    if file_format not in FILE_FORMATS:
+        raise ValueError("Unknown file format: %s" % file_format)
+    _, writer = FILE_FORMATS[file_format]
+    writer(save_location, np.asarray(points, np.float64))
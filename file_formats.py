@@ -0,0 +1,21 @@
+# names and extensions of the point file formats, without the writers (in exporters), so the gui can list them without
+# loading numpy
+
+# file format name -> file extension
+FILE_EXTENSIONS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "npy": ".npy",
+    "float32": ".f32",
+    "dxf": ".dxf",
+    "svg": ".svg",
+}
+DEFAULT_FILE_FORMAT = "csv"
+
+
+def get_file_format(save_location):
+    # file format from the file extension (longest matching extension, so .csv.gz is not csv)
+    matches = [name for name, extension in FILE_EXTENSIONS.items() if save_location.lower().endswith(extension)]
+    if len(matches) == 0:
+        return None
+    return max(matches, key=lambda name: len(FILE_EXTENSIONS[name]))
@@ -0,0 +1,141 @@
+import csv
+import json
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+ROLLING_SAMPLES = 300  # samples per stage the percentiles are taken over
+PERCENTILES = (50, 95, 99)
+HUD_FONT_SCALE = 1.0
+HUD_LINE_HEIGHT = 18  # pixels
+HUD_NAME_WIDTH = 130  # pixels of the stage name column
+HUD_COLUMN_WIDTH = 70  # pixels of each percentile column
+
+
+class NullStage:
+    # what FrameTimer.stage returns while timing is off, so a timed block costs one method call and nothing else
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+
+    def __init__(self, frame_timer, name):
+        self.frame_timer = frame_timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.frame_timer.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class FrameTimer:
+    # Times the stages of every frame (with frame_timer.stage("name"): ...) and keeps rolling percentiles of each stage
+    # for the on screen HUD, plus (if tracing) a trace of every sample that can be written to a JSON or CSV file. Does
+    # nothing until it is enabled
+
+    def __init__(self, enabled=False, tracing=False):
+        self.enabled = enabled
+        self.tracing = tracing  # the trace grows with every sample, so it is only kept when it will be written
+        self.hud_visible = False
+        self.lock = threading.Lock()  # stages can also be timed on the route worker thread
+        self.frame_number = 0
+        self.start_time = time.perf_counter()
+        self.samples = {}  # stage -> deque of the latest durations in seconds
+        self.trace = []  # (frame number, stage, start seconds, duration seconds) of every sample
+
+    def toggle_hud(self):
+        # the HUD needs timings, so showing it turns timing on
+        self.hud_visible = not self.hud_visible
+        self.enabled = self.enabled or self.hud_visible
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def time_function(self, name, function):
+        # function wrapped so every call is timed as a stage (for functions run on other threads)
+        if not self.enabled:
+            return function
+
+        def timed_function(*args):
+            with self.stage(name):
+                return function(*args)
+        return timed_function
+
+    def start_frame(self):
+        # returns the start time of the frame to pass to end_frame, or None while timing is off
+        if not self.enabled:
+            return None
+        self.frame_number += 1
+        return time.perf_counter()
+
+    def end_frame(self, frame_start):
+        if frame_start is not None:
+            self.record("frame", frame_start, time.perf_counter() - frame_start)
+
+    def record(self, name, start, duration):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=ROLLING_SAMPLES)
+            self.samples[name].append(duration)
+            if self.tracing:
+                self.trace.append((self.frame_number, name, start - self.start_time, duration))
+
+    def get_percentiles(self):
+        # stage -> p50, p95 and p99 of the latest samples in milliseconds
+        with self.lock:
+            samples = {name: np.array(durations) for name, durations in self.samples.items()}
+        return {name: np.percentile(durations, PERCENTILES) * 1000 for name, durations in samples.items()}
+
+    def draw_hud(self, image):
+        # percentiles of every stage in a table in the top left corner of the image
+        rows = [["stage (ms)"] + ["p%d" % p for p in PERCENTILES]]
+        for name, percentiles in sorted(self.get_percentiles().items()):
+            rows.append([name] + ["%.2f" % value for value in percentiles])
+
+        width = min(HUD_NAME_WIDTH + HUD_COLUMN_WIDTH * len(PERCENTILES) + 8, image.shape[1])
+        height = min(HUD_LINE_HEIGHT * len(rows) + 8, image.shape[0])
+        image[:height, :width] //= 3  # darken the background so the text is readable
+        for i, row in enumerate(rows):
+            y = HUD_LINE_HEIGHT * (i + 1)
+            cv2.putText(image, row[0], (8, y), cv2.FONT_HERSHEY_PLAIN, HUD_FONT_SCALE, (255, 255, 255), 1, cv2.LINE_AA)
+            for j, text in enumerate(row[1:]):
+                # numbers are right aligned in their column
+                (text_width, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_PLAIN, HUD_FONT_SCALE, 1)
+                x = HUD_NAME_WIDTH + HUD_COLUMN_WIDTH * (j + 1) - text_width
+                cv2.putText(image, text, (x, y), cv2.FONT_HERSHEY_PLAIN, HUD_FONT_SCALE, (255, 255, 255), 1,
+                            cv2.LINE_AA)
+        return image
+
+    def write_trace(self, save_location):
+        # every sample as a CSV file (if the location ends with .csv) or a JSON file with the percentiles too
+        with self.lock:
+            trace = list(self.trace)
+        fields = ["frame", "stage", "start_seconds", "duration_seconds"]
+        if save_location.lower().endswith(".csv"):
+            with open(save_location, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                writer.writerows(trace)
+        else:
+            percentiles = {name: dict(zip(("p%d_ms" % p for p in PERCENTILES), values.tolist()))
+                           for name, values in self.get_percentiles().items()}
+            with open(save_location, "w") as f:
+                json.dump({"percentiles": percentiles, "samples": [dict(zip(fields, sample)) for sample in trace]}, f)
@@ -1,35 +1,46 @@
 from appJar import gui
 from PIL import Image, ImageTk
-import imghdr
 import os
-from contour_tracer import ContourTracer
-from contour_tracer import CONTOUR_PREVIEW_SAVE_LOCATION
-from scale_selector import ScaleSelector
-from scale_selector import SCALE_PREVIEW_SAVE_LOCATION
-
-
-contour_tracer = ContourTracer(1920, 1080)  # TODO: get screen dims
-scale_selector = ScaleSelector(1920, 1080)
+from file_formats import DEFAULT_FILE_FORMAT
+from file_formats import FILE_EXTENSIONS
+
+# entries of the gui that are saved with the image in the cache
+SETTINGS_ENTRIES = {"scale_mm": "scale_entry", "tolerance_mm": "tolerance_entry", "simplify_mm": "simplify_entry"}
+PREVIEW_HEIGHT = 200  # pixels
+
+# the viewers (and numpy and opencv with them) are only loaded when the first image is, so the window opens without
+# waiting for them. scikit-image is only loaded once livewire mode is used
+image_cache = None
+contour_tracer = None
+scale_selector = None
 image_file_location = None
 
 
-def delete_files_in_directory(dir_name):
-    file_list = [f for f in os.listdir(dir_name)]
-    for f in file_list:
-        os.remove(os.path.join(dir_name, f))
+def create_viewers():
+    global image_cache, contour_tracer, scale_selector
+    from contour_tracer import ContourTracer
+    from scale_selector import ScaleSelector
+    from image_cache import ImageCache
+
+    image_cache = ImageCache()
+    contour_tracer = ContourTracer(1920, 1080, image_cache=image_cache)  # TODO: get screen dims
+    scale_selector = ScaleSelector(1920, 1080, image_cache=image_cache)
+    contour_tracer.THUMBNAIL_HEIGHT = PREVIEW_HEIGHT
+    scale_selector.THUMBNAIL_HEIGHT = PREVIEW_HEIGHT
 
 
 def press_load_button():
     global contour_tracer, image_file_location
     file = app.entry("file_entry")
     print("File:", file)
-    if imghdr.what(file) is not None:  # make sure it's a picture
+    from image_loader import get_image_size
+    from image_loader import is_image
+    if os.path.isfile(file) and is_image(file):  # make sure it's a picture
         image_file_location = file
-        photo = ImageTk.PhotoImage(load_image(200, file))
-        app.setImageData("contour_preview", photo, fmt="PhotoImage")
-        app.setImageData("scale_preview", photo, fmt="PhotoImage")
 
-        w, h = Image.open(file).size
+        w, h = get_image_size(file)  # only reads the file header
+        if contour_tracer is None:
+            create_viewers()
 
         app.setLabel("raw_size_preview_label", "  Raw w, h = %d, %d" % (w,h))
 
@@ -40,6 +51,8 @@ def press_load_button():
                 if downsample >= 1:
                     contour_tracer.load_image(image_file_location, downsample)
                     scale_selector.load_image(image_file_location, downsample)
+                    load_settings()
+                    update_previews()
                     return
                 else:
                     app.popUp("Error", "Not a valid downsample. Choose a number >= 1")
@@ -48,20 +61,56 @@ def press_load_button():
 
         contour_tracer.load_image(image_file_location)
         scale_selector.load_image(image_file_location)
+        load_settings()
+        update_previews()
+
+
+def update_previews():
+    # thumbnails are drawn by the viewers in memory
+    app.setImageData("contour_preview", get_photo(contour_tracer.preview), fmt="PhotoImage")
+    app.setImageData("scale_preview", get_photo(scale_selector.preview), fmt="PhotoImage")
+
+
+def get_photo(image):
+    # the viewers draw in BGR
+    return ImageTk.PhotoImage(Image.fromarray(image[:, :, ::-1]))
+
+
+def load_settings():
+    # scale and tolerances last used with this image, and the measurement from its cached session
+    settings = image_cache.load_settings(contour_tracer.cache_key)
+    for name, entry in SETTINGS_ENTRIES.items():
+        if name in settings:
+            app.setEntry(entry, settings[name])
+    update_pixel_distance()
+
+
+def save_settings():
+    image_cache.save_settings(contour_tracer.cache_key, {name: app.getEntry(entry)
+                                                         for name, entry in SETTINGS_ENTRIES.items()})
 
 
 def press_save_button():
     print("Save")
     scale_factor = get_scale_factor()
+    file_format = app.getOptionBox("format_option")
+    extension = FILE_EXTENSIONS[file_format]
     save_location = "output/" + app.getEntry("save_entry")
-    if not save_location.endswith(".csv"):
-        save_location = save_location + ".csv"
+    if not save_location.endswith(extension):
+        save_location = save_location + extension
     print(save_location)
 
-    if scale_factor is not None:
+    if contour_tracer is None or len(contour_tracer.get_lasso_points()) == 0:
+        app.popUp("Error", "Nothing to save: trace a lasso first")
+    elif scale_factor is not None:
         try:
             tolerance = float(app.getEntry("tolerance_entry")) / 10.0  # convert to cm
-            contour_tracer.scale_and_save_points(save_location, scale_factor, tolerance)
+            simplify_tolerance = float(app.getEntry("simplify_entry")) / 10.0  # convert to cm
+            point_count, max_deviation = contour_tracer.scale_and_save_points(save_location, scale_factor, tolerance,
+                                                                              file_format, simplify_tolerance)
+            app.setLabel("simplify_result_label", "  %d points, max deviation = %.3f mm" %
+                         (point_count, max_deviation * 10.0))
+            save_settings()
         except:
             app.popUp("Error", "Please ensure all information has been entered correctly")
     else:
@@ -77,8 +126,7 @@ def press_contour_preview():
     if image_file_location is not None:
         contour_tracer.init_window()
         contour_tracer.show()
-        photo = ImageTk.PhotoImage(load_image(200, CONTOUR_PREVIEW_SAVE_LOCATION))
-        app.setImageData("contour_preview", photo, fmt="PhotoImage")
+        app.setImageData("contour_preview", get_photo(contour_tracer.preview), fmt="PhotoImage")
 
 
 def press_scale_preview():
@@ -86,19 +134,21 @@ def press_scale_preview():
     if image_file_location is not None:
         scale_selector.init_window()
         scale_selector.show()
-        photo = ImageTk.PhotoImage(load_image(200, SCALE_PREVIEW_SAVE_LOCATION))
-        app.setImageData("scale_preview", photo, fmt="PhotoImage")
+        app.setImageData("scale_preview", get_photo(scale_selector.preview), fmt="PhotoImage")
+        update_pixel_distance()
 
-        pixel_distance = scale_selector.get_pixel_distance()
-        if pixel_distance is not None:
-            app.setLabel("scale_text1", ("%.2f pixels = " % pixel_distance))
-        else:
-            app.setLabel("scale_text1", "______ pixels = ")
+
+def update_pixel_distance():
+    pixel_distance = scale_selector.get_pixel_distance() if scale_selector is not None else None
+    if pixel_distance is not None:
+        app.setLabel("scale_text1", ("%.2f pixels = " % pixel_distance))
+    else:
+        app.setLabel("scale_text1", "______ pixels = ")
 
 
 def get_scale_factor():
     entry_string = app.getEntry("scale_entry")
-    pixel_distance = scale_selector.get_pixel_distance()
+    pixel_distance = scale_selector.get_pixel_distance() if scale_selector is not None else None
     if len(entry_string) > 0 and pixel_distance is not None:
         try:
             dist_mm = float(entry_string)
@@ -110,11 +160,8 @@ def get_scale_factor():
     return None
 
 
-def load_image(height, location=None):
-    if location is None or not os.path.exists(location):
-        im = Image.open("cropped-placeholder.jpg")
-    else:
-        im = Image.open(location)
+def load_placeholder(height):
+    im = Image.open("cropped-placeholder.jpg")
 
     w, h = im.size
     ratio = w / h
@@ -125,22 +172,24 @@ def load_image(height, location=None):
 
 
 def populate_save_entry():
+    extension = FILE_EXTENSIONS[app.getOptionBox("format_option")]
     save_file_index = 0
-    while os.path.exists("output/point_data_%d.csv" % save_file_index):
+    while os.path.exists("output/point_data_%d%s" % (save_file_index, extension)):
         save_file_index += 1
-    app.setEntry("save_entry", "point_data_%d.csv" % save_file_index)
+    app.setEntry("save_entry", "point_data_%d%s" % (save_file_index, extension))
+
+
+def change_file_format():
+    populate_save_entry()
 
 
 app = gui()
 app.setFont(14)
 
-# delete previous previews
-delete_files_in_directory("previews")
-
 app.startLabelFrame("Select Image File")
 app.addFileEntry("file_entry", 0, 0)
 app.addLabel("raw_size_preview_label", "  Raw w, h = 0, 0", 0, 1)
-#photo = ImageTk.PhotoImage(load_image(100))
+#photo = ImageTk.PhotoImage(load_placeholder(100))
 #app.addImageData("image_preview", photo, fmt="PhotoImage")
 app.addLabel("downsample_text1", "Downsample Factor = ", 1, 0)
 app.addEntry("downsample_entry", 1, 1)
@@ -149,13 +198,13 @@ app.addButton("Load", press_load_button, 2, 0)
 app.stopLabelFrame()
 
 app.startLabelFrame("Select Contours")
-photo = ImageTk.PhotoImage(load_image(200))
+photo = ImageTk.PhotoImage(load_placeholder(PREVIEW_HEIGHT))
 app.addImageData("contour_preview", photo, fmt="PhotoImage")
 app.setImageSubmitFunction("contour_preview", press_contour_preview)
 app.stopLabelFrame()
 
 app.startLabelFrame("Set Scale and Tolerances")
-photo = ImageTk.PhotoImage(load_image(200))
+photo = ImageTk.PhotoImage(load_placeholder(PREVIEW_HEIGHT))
 app.addImageData("scale_preview", photo, fmt="PhotoImage")
 app.setImageSubmitFunction("scale_preview", press_scale_preview)
 app.addLabel("scale_text1", "______ pixels = ", 1, 0)
@@ -165,15 +214,24 @@ app.addLabel("tolerance_text1", "Tolerance = ", 2, 0)
 app.addEntry("tolerance_entry", 2, 1)
 app.setEntry("tolerance_entry", "0.0")
 app.addLabel("tolerance_text2", "mm", 2, 2)
+app.addLabel("simplify_text1", "Simplify = ", 3, 0)
+app.addEntry("simplify_entry", 3, 1)
+app.setEntry("simplify_entry", "0.0")
+app.addLabel("simplify_text2", "mm", 3, 2)
 app.stopLabelFrame()
 
 app.startLabelFrame("")
 app.setSticky("ew")
-app.addLabel("save_text", "Save Filename (.csv): ", 0, 0)
-app.addEntry("save_entry", 0, 1)
+app.addLabel("format_text", "Format: ", 0, 0)
+app.addOptionBox("format_option", list(FILE_EXTENSIONS), 0, 1)
+app.setOptionBox("format_option", DEFAULT_FILE_FORMAT)
+app.setOptionBoxChangeFunction("format_option", change_file_format)
+app.addLabel("save_text", "Save Filename: ", 1, 0)
+app.addEntry("save_entry", 1, 1)
 populate_save_entry()
-app.addButton("Save", press_save_button, 1, 0)
-app.addButton("Close", press_close_button, 1, 1)
+app.addButton("Save", press_save_button, 2, 0)
+app.addButton("Close", press_close_button, 2, 1)
+app.addLabel("simplify_result_label", "", 3, 0, 2)
 app.stopLabelFrame()
 
 app.go()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+CACHE_DIRECTORY = "cache"
+CACHE_SIZE_LIMIT = 4 * 1024 * 1024 * 1024  # bytes. Least recently used entries are deleted above this
+HASH_CHUNK_SIZE = 1024 * 1024
+META_FILENAME = "meta.json"
+SETTINGS_FILENAME = "settings.json"
+
+
+def hash_file(location):
+    # hash of the file content, so a renamed or copied image is still found and an edited one is not
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(location, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_image_key(image_location, downsample, file_hashes):
+    # the same for every copy of an image. file_hashes is (path, size, modification time) -> content hash, so files are
+    # only hashed once
+    stat = os.stat(image_location)
+    file_id = (os.path.abspath(image_location), stat.st_size, stat.st_mtime_ns)
+    if file_id not in file_hashes:
+        file_hashes[file_id] = hash_file(image_location)
+    return "%s_%g" % (file_hashes[file_id], downsample)
+
+
+def get_directory_size(directory):
+    size = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(root, filename))
+    return size
+
+
+class ImageCache:
+    # Decoded images, edge contours and lasso sessions on disk, one entry per image content and downsample factor.
+    # Arrays are stored as .npy files and loaded memory mapped, so reopening even a very big image only reads the parts
+    # that are used. Entries that haven't been used for the longest are deleted once the cache is bigger than size_limit
+
+    def __init__(self, directory=CACHE_DIRECTORY, size_limit=CACHE_SIZE_LIMIT):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.file_hashes = {}  # (path, size, modification time) -> content hash, so files are only hashed once
+
+    def get_key(self, image_location, downsample):
+        return get_image_key(image_location, downsample, self.file_hashes)
+
+    def get_entry_directory(self, key):
+        return os.path.join(self.directory, key)
+
+    def touch(self, key):
+        # mark the entry as used for the eviction order
+        entry_directory = self.get_entry_directory(key)
+        if os.path.isdir(entry_directory):
+            os.utime(entry_directory)
+
+    def save_arrays(self, key, arrays):
+        # arrays is name -> array. Each is written to a temporary file first so a crash never leaves half an array
+        entry_directory = self.get_entry_directory(key)
+        os.makedirs(entry_directory, exist_ok=True)
+        for name, array in arrays.items():
+            location = os.path.join(entry_directory, name + ".npy")
+            with open(location + ".tmp", "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(location + ".tmp", location)
+
+    def load_arrays(self, key, names, mmap_mode="r"):
+        # name -> read only memory mapped array, or None if any of them are missing
+        entry_directory = self.get_entry_directory(key)
+        locations = [os.path.join(entry_directory, name + ".npy") for name in names]
+        if not all(os.path.exists(location) for location in locations):
+            return None
+        self.touch(key)
+        return {name: np.load(location, mmap_mode=mmap_mode) for name, location in zip(names, locations)}
+
+    def save_json(self, key, filename, values):
+        entry_directory = self.get_entry_directory(key)
+        os.makedirs(entry_directory, exist_ok=True)
+        location = os.path.join(entry_directory, filename)
+        with open(location + ".tmp", "w") as f:
+            json.dump(values, f)
+        os.replace(location + ".tmp", location)
+
+    def load_json(self, key, filename):
+        location = os.path.join(self.get_entry_directory(key), filename)
+        if not os.path.exists(location):
+            return None
+        with open(location) as f:
+            return json.load(f)
+
+    def save_image(self, key, pyramid, raw_width, raw_height):
+        # the downsampled image and its pyramid levels. The meta file is written last so an entry only counts once
+        # all of its levels are there
+        self.save_arrays(key, {"level_%d" % level: np.asarray(image) for level, image in enumerate(pyramid)})
+        self.save_json(key, META_FILENAME, {"raw_width": raw_width, "raw_height": raw_height, "levels": len(pyramid)})
+        self.evict(keep=key)
+
+    def load_image(self, key):
+        # (pyramid, raw width, raw height) or None
+        meta = self.load_json(key, META_FILENAME)
+        if meta is None:
+            return None
+        arrays = self.load_arrays(key, ["level_%d" % level for level in range(meta["levels"])])
+        if arrays is None:
+            return None
+        return [arrays["level_%d" % level] for level in range(meta["levels"])], meta["raw_width"], meta["raw_height"]
+
+    def save_edges(self, key, edges, contours, level=0):
+        # edges of one level of the image pyramid. Contours are stored as all their points in one array plus the length
+        # of each
+        lengths = np.array([len(contour) for contour in contours], np.int64)
+        points = np.concatenate(contours) if len(contours) > 0 else np.empty((0, 1, 2), np.int32)
+        self.save_arrays(key, {"edges_%d" % level: edges, "contour_points_%d" % level: points,
+                               "contour_lengths_%d" % level: lengths})
+        self.evict(keep=key)
+
+    def load_edges(self, key, level=0):
+        # (edges, contours) of one level or None. The contours are views of one memory mapped array
+        names = ["edges_%d" % level, "contour_points_%d" % level, "contour_lengths_%d" % level]
+        arrays = self.load_arrays(key, names)
+        if arrays is None:
+            return None
+        edges, points, lengths = [arrays[name] for name in names]
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        return edges, [points[start:end] for start, end in zip(starts, ends)]
+
+    def save_settings(self, key, settings):
+        # small values like the tolerance, merged with the ones already saved
+        saved = self.load_json(key, SETTINGS_FILENAME) or {}
+        saved.update(settings)
+        self.save_json(key, SETTINGS_FILENAME, saved)
+
+    def load_settings(self, key):
+        return self.load_json(key, SETTINGS_FILENAME) or {}
+
+    def evict(self, keep=None):
+        # delete the least recently used entries (other than keep) until the cache fits in the size limit
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for key in os.listdir(self.directory):
+            entry_directory = self.get_entry_directory(key)
+            if os.path.isdir(entry_directory):
+                entries.append((os.path.getmtime(entry_directory), key, get_directory_size(entry_directory)))
+
+        total_size = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            if key != keep:
+                shutil.rmtree(self.get_entry_directory(key), ignore_errors=True)
+                total_size -= size
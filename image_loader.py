@@ -0,0 +1,153 @@
+import mmap
+import tempfile
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 512  # pixels. 512 * 512 * 3 bytes is a whole number of memory pages
+TILE_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of tiles kept in memory by a TiledRaster
+MAX_IN_MEMORY_PIXELS = 64 * 1000 * 1000  # (downsampled) images bigger than this are kept in a TiledRaster
+
+# jpeg can be decoded directly at 1/2, 1/4 or 1/8 of the size
+REDUCED_READ_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+JPEG_SIGNATURE = b"\xff\xd8\xff"  # first bytes of every jpeg file
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # orientations where width and height are swapped
+
+# PIL is only used to read image headers, so its decompression bomb check would only stop big photos from loading
+Image.MAX_IMAGE_PIXELS = None
+
+
+def is_image(image_location):
+    # whether cv2 has a decoder for the file. Only reads the file header
+    return cv2.haveImageReader(image_location)
+
+
+def is_jpeg(image_location):
+    with open(image_location, "rb") as f:
+        return f.read(len(JPEG_SIGNATURE)) == JPEG_SIGNATURE
+
+
+def get_image_size(image_location):
+    # width and height as cv2.imread would decode them (EXIF rotation included). Only reads the file header
+    with Image.open(image_location) as im:
+        width, height = im.size
+        if im.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+    return width, height
+
+
+def read_image(image_location, downsample=1):
+    # returns the image resized by 1/downsample and the size of the raw image. Jpeg files are decoded at the smallest
+    # reduced size that is still at least as big as the result, so with a downsample of 2 or more the full resolution
+    # image is never in memory. Other formats (and a downsample below 2) are decoded whole and then resized
+    raw_width, raw_height = get_image_size(image_location)
+    width = int(round(raw_width / downsample))
+    height = int(round(raw_height / downsample))
+
+    reduction = 1
+    if is_jpeg(image_location):
+        for reduced_read_reduction in sorted(REDUCED_READ_FLAGS, reverse=True):
+            if reduced_read_reduction <= downsample:
+                reduction = reduced_read_reduction
+                break
+
+    if reduction > 1:
+        image = cv2.imread(image_location, REDUCED_READ_FLAGS[reduction])
+    else:
+        image = cv2.imread(image_location)
+
+    if image.shape[0] != height or image.shape[1] != width:
+        interpolation = cv2.INTER_AREA if downsample > reduction else cv2.INTER_LINEAR
+        image = cv2.resize(image, (width, height), interpolation=interpolation)
+    return image, raw_width, raw_height
+
+
+class TiledRaster:
+    # An image stored tile by tile in a memory mapped temporary file. Slicing it (raster[y0:y1, x0:x1]) only reads the
+    # tiles in that region, and at most memory_budget bytes of tiles are kept in memory. Anything that needs the whole
+    # image can use np.asarray(raster)
+
+    def __init__(self, image, tile_size=TILE_SIZE, memory_budget=TILE_MEMORY_BUDGET):
+        self.shape = image.shape
+        self.dtype = image.dtype
+        self.tile_size = tile_size
+        self.memory_budget = memory_budget
+
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        self.tiles_y = (height + tile_size - 1) // tile_size
+        self.tiles_x = (width + tile_size - 1) // tile_size
+        self.tile_bytes = tile_size * tile_size * channels * image.dtype.itemsize
+
+        self.file = tempfile.TemporaryFile()
+        self.file.truncate(self.tiles_y * self.tiles_x * self.tile_bytes)
+        self.map = mmap.mmap(self.file.fileno(), self.tiles_y * self.tiles_x * self.tile_bytes)
+        self.tiles = np.frombuffer(self.map, image.dtype).reshape(
+            (self.tiles_y, self.tiles_x, tile_size, tile_size) + image.shape[2:])
+
+        for tile_y in range(self.tiles_y):
+            for tile_x in range(self.tiles_x):
+                region = image[tile_y * tile_size:(tile_y + 1) * tile_size, tile_x * tile_size:(tile_x + 1) * tile_size]
+                self.tiles[tile_y, tile_x, :region.shape[0], :region.shape[1]] = region
+        self.release_pages(0, len(self.map))
+
+        # (tile_y, tile_x) -> tile, least recently used first. Regions can be read from several threads
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def release_pages(self, start, length):
+        # let the os drop pages of the file from our memory. They are read back from the file if needed again
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self.map.madvise(mmap.MADV_DONTNEED, start, length)
+
+    def get_tile(self, tile_y, tile_x):
+        key = (tile_y, tile_x)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            tile = self.tiles[tile_y, tile_x].copy()
+            self.release_pages((tile_y * self.tiles_x + tile_x) * self.tile_bytes, self.tile_bytes)
+            self.cache[key] = tile
+            while len(self.cache) > 1 and len(self.cache) * self.tile_bytes > self.memory_budget:
+                self.cache.popitem(last=False)
+            return tile
+
+    def __getitem__(self, key):
+        rows, columns = key
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = columns.indices(self.shape[1])
+        region = np.empty((max(y1 - y0, 0), max(x1 - x0, 0)) + self.shape[2:], self.dtype)
+
+        for tile_y in range(y0 // self.tile_size, (y1 - 1) // self.tile_size + 1):
+            for tile_x in range(x0 // self.tile_size, (x1 - 1) // self.tile_size + 1):
+                # part of the tile that is inside the region
+                tile_y0 = max(y0 - tile_y * self.tile_size, 0)
+                tile_y1 = min(y1 - tile_y * self.tile_size, self.tile_size)
+                tile_x0 = max(x0 - tile_x * self.tile_size, 0)
+                tile_x1 = min(x1 - tile_x * self.tile_size, self.tile_size)
+                region_y = tile_y * self.tile_size + tile_y0 - y0
+                region_x = tile_x * self.tile_size + tile_x0 - x0
+                region[region_y:region_y + tile_y1 - tile_y0, region_x:region_x + tile_x1 - tile_x0] = \
+                    self.get_tile(tile_y, tile_x)[tile_y0:tile_y1, tile_x0:tile_x1]
+        return region
+
+    def __array__(self, dtype=None, copy=None):
+        # the whole image. Tiles are read straight from the file so this does not flush the cache
+        image = self.tiles.swapaxes(1, 2).reshape((self.tiles_y * self.tile_size, self.tiles_x * self.tile_size) +
+                                                  self.shape[2:])
+        image = image[:self.shape[0], :self.shape[1]].copy()
+        self.release_pages(0, len(self.map))
+        return image if dtype is None else image.astype(dtype)
+
+    def copy(self):
+        return np.asarray(self)
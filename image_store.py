@@ -0,0 +1,79 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_UNUSED_IMAGES = 3  # images no viewer shows anymore that are kept in memory in case they are loaded again
+UNUSED_MEMORY_BUDGET = 1024 * 1024 * 1024  # bytes of unused images kept in memory
+
+
+def make_read_only(image):
+    # the levels are shared between viewers, so none of them may draw on them
+    if isinstance(image, np.ndarray):
+        image.flags.writeable = False
+    return image
+
+
+def get_memory_size(pyramid):
+    # bytes of the levels that are in memory. Memory mapped levels (from the image cache) and tiled rasters are backed
+    # by files, so they don't count
+    return sum(level.nbytes for level in pyramid if isinstance(level, np.ndarray) and not isinstance(level, np.memmap))
+
+
+class StoredImage:
+    # A decoded image and its pyramid, shared by every viewer that shows it. Levels are added by the first viewer that
+    # needs them and are read only
+
+    def __init__(self, pyramid, raw_width, raw_height, in_image_cache):
+        self.pyramid = [make_read_only(level) for level in pyramid]
+        self.raw_width = raw_width
+        self.raw_height = raw_height
+        self.in_image_cache = in_image_cache  # already saved to the image cache on disk
+        self.references = 0
+
+    def add_level(self, image):
+        self.pyramid.append(make_read_only(image))
+
+
+class ImageStore:
+    # Decoded images in memory, one per file and downsample factor, so viewers showing the same image share one copy
+    # and it is only decoded once. Images are reference counted: an image stays in memory while a viewer holds it, and
+    # the last few images no viewer holds are kept too (least recently used first out), so going back to an image that
+    # was just loaded is instant
+
+    def __init__(self, max_unused_images=MAX_UNUSED_IMAGES, unused_memory_budget=UNUSED_MEMORY_BUDGET):
+        self.max_unused_images = max_unused_images
+        self.unused_memory_budget = unused_memory_budget
+        self.images = OrderedDict()  # key -> StoredImage, least recently used first
+        self.lock = threading.Lock()
+
+    def get_key(self, image_location, downsample):
+        # a file that was changed since it was loaded is loaded again
+        stat = os.stat(image_location)
+        return os.path.abspath(image_location), stat.st_size, stat.st_mtime_ns, downsample
+
+    def acquire(self, key, load):
+        # the image for key, loaded with load() (which returns a StoredImage) if it isn't in memory. Every acquire needs
+        # a release once the image isn't used anymore
+        with self.lock:
+            if key not in self.images:
+                self.images[key] = load()
+            self.images.move_to_end(key)
+            image = self.images[key]
+            image.references += 1
+            return image
+
+    def release(self, key):
+        with self.lock:
+            if key in self.images:
+                self.images[key].references -= 1
+                self.evict()
+
+    def evict(self):
+        unused = [key for key, image in self.images.items() if image.references <= 0]
+        memory_size = sum(get_memory_size(self.images[key].pyramid) for key in unused)
+        while len(unused) > self.max_unused_images or (len(unused) > 0 and memory_size > self.unused_memory_budget):
+            key = unused.pop(0)
+            memory_size -= get_memory_size(self.images[key].pyramid)
+            del self.images[key]
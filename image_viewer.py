@@ -1,6 +1,20 @@
+import os
+import weakref
+
 import cv2
+import numpy as np
+from allocation_counter import AllocationCounter
+from event_recorder import EventRecorder
+from frame_timer import FrameTimer
+from image_store import ImageStore
+from image_store import StoredImage
+from image_loader import MAX_IN_MEMORY_PIXELS
+from image_loader import TILE_MEMORY_BUDGET
+from image_loader import TiledRaster
+from image_loader import read_image
 
 DOWNSAMPLE = 1
+THUMBNAIL_HEIGHT = 200  # pixels of the previews shown in the gui
 
 
 class ImageViewer:
@@ -8,15 +22,72 @@ class ImageViewer:
     WINDOW_NAME = "CAD Lasso"
     MAX_ZOOM_LEVEL = 20
 
-    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE):
+    # render layers that can be invalidated independently of each other
+    LAYER_VIEW = 1  # zoom/pan of the image
+    LAYER_LASSO = 2  # committed selections
+    LAYER_PREVIEW = 4  # live preview that follows the cursor
+    LAYER_ALL = LAYER_VIEW | LAYER_LASSO | LAYER_PREVIEW
+    LAYER_HUD = 16  # frame timing overlay (drawn on top of every frame while it is shown)
+
+    # images with more (downsampled) pixels are kept in a tiled raster on disk with at most TILE_MEMORY_BUDGET bytes of
+    # it in memory
+    MAX_IN_MEMORY_PIXELS = MAX_IN_MEMORY_PIXELS
+    TILE_MEMORY_BUDGET = TILE_MEMORY_BUDGET
+
+    LINE_THICKNESS = 3  # overlay line thickness in window pixels
+    THUMBNAIL_HEIGHT = THUMBNAIL_HEIGHT
+    VIEW_SHIFT = 4  # fractional bits of the fixed point coordinates used to draw overlays in window coordinates
+
+    # time every stage of every frame (the "t" key shows the timings and turns this on too). When a trace location is
+    # set the timings are written to it (.csv or .json) whenever the window is closed
+    FRAME_TRACE_LOCATION = os.environ.get("CADLASSO_FRAME_TRACE")
+    FRAME_TIMING = FRAME_TRACE_LOCATION is not None
+
+    # when set, the mouse and key events of every window session are appended to this file so they can be replayed
+    # with replay_events.py
+    EVENT_RECORD_LOCATION = os.environ.get("CADLASSO_EVENT_RECORD")
+
+    # count the frames that allocate big arrays and print how many there were whenever a window is closed. Slows
+    # everything down, so only for checking that frames are drawn into the frame buffers
+    DEBUG_ALLOCATIONS = os.environ.get("CADLASSO_DEBUG_ALLOCATIONS") is not None
+
+    # window sized images every frame is drawn into, as name -> (channels, dtype). They are made when an image is
+    # loaded so drawing a frame doesn't allocate any big arrays
+    FRAME_BUFFERS = {"view": (3, np.uint8)}
+
+    # arrays of the work done in the window that are kept in the image cache (see get_session_state)
+    SESSION_ARRAYS = ()
+
+    # decoded images shared by all viewers, so the contour tracer and the scale selector only load an image once
+    IMAGE_STORE = ImageStore()
+
+    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE, image_cache=None):
+        # before loading so loading can be timed too
+        self.frame_timer = FrameTimer(self.FRAME_TIMING, self.FRAME_TRACE_LOCATION is not None)
+        self.allocation_counter = AllocationCounter(self.DEBUG_ALLOCATIONS)
+        self.frame_buffers = None
+        # an image_cache.ImageCache to keep decoded images and sessions in between runs (None to not cache anything)
+        self.image_cache = image_cache
+        self.cache_key = None
+        # the image this viewer holds in the image store. Released when another image is loaded or the viewer is gone
+        self.store_key = None
+        self.store_release = None
+        # records the events of the window while it is shown, if EVENT_RECORD_LOCATION is set
+        self.event_recorder = None
 
         self.screen_width = screen_width
         self.screen_height = screen_height
 
+        # layers that need to be rebuilt before the next frame is shown
+        self.dirty = self.LAYER_ALL
+
         if image_location is not None:
             self.load_image(image_location, downsample)
         else:
+            self.image_location = None
+            self.downsample = None
             self.im = None
+            self.pyramid = None
             self.raw_image_width = None
             self.raw_image_height = None
             self.image_width = None
@@ -28,9 +99,23 @@ class ImageViewer:
             self.current_zoom_level = None
 
     def load_image(self, image_location, downsample=DOWNSAMPLE):
-        self.im = cv2.imread(image_location)
-        self.raw_image_height, self.raw_image_width, _ = self.im.shape
-        self.im = cv2.resize(self.im, None, fx=1.0/downsample, fy=1.0/downsample)
+        if self.image_cache is not None:
+            self.cache_key = self.image_cache.get_key(image_location, downsample)
+
+        # acquired before the last image is released so loading the same image again doesn't drop it
+        image_store = self.IMAGE_STORE
+        store_key = image_store.get_key(image_location, downsample)
+        stored = image_store.acquire(store_key, lambda: self.read_stored_image(image_location, downsample))
+        if self.store_release is not None:
+            self.store_release()
+        self.store_key = store_key
+        self.store_release = weakref.finalize(self, image_store.release, store_key)
+        self.image_location = image_location
+        self.downsample = downsample
+
+        self.raw_image_width = stored.raw_width
+        self.raw_image_height = stored.raw_height
+        self.im = stored.pyramid[0]
         self.image_height, self.image_width, _ = self.im.shape
         scale_width = self.screen_width / self.image_width
         scale_height = self.screen_height / self.image_height
@@ -39,12 +124,46 @@ class ImageViewer:
         # resized window width and height
         self.window_width = int(self.image_width * scale * 0.5)
         self.window_height = int(self.image_height * scale * 0.5)
+        self.frame_buffers = {name: np.empty((self.window_height, self.window_width, channels), dtype)
+                              for name, (channels, dtype) in self.FRAME_BUFFERS.items()}
+
+        # mipmaps of the image so zoomed out views can sample a smaller image. Level i is downsampled by 2^i. Levels
+        # another viewer already made are reused
+        self.pyramid = [self.im]
+        while self.pyramid[-1].shape[1] >= 2 * self.window_width and self.pyramid[-1].shape[0] >= 2 * self.window_height:
+            level = len(self.pyramid)
+            if level == len(stored.pyramid):
+                stored.add_level(cv2.pyrDown(np.asarray(self.pyramid[-1])))
+            self.pyramid.append(stored.pyramid[level])
+
+        if not stored.in_image_cache and self.image_cache is not None:
+            self.image_cache.save_image(self.cache_key, self.pyramid, self.raw_image_width, self.raw_image_height)
+            stored.in_image_cache = True
+        if type(self.im) is np.ndarray and self.image_width * self.image_height > self.MAX_IN_MEMORY_PIXELS:
+            # from now on only the parts of the full resolution image that are looked at are kept in memory. Loading
+            # still needed the decoded image and its pyramid in memory at once. A cached image is memory mapped from
+            # its file already
+            stored.pyramid[0] = TiledRaster(self.im, memory_budget=self.TILE_MEMORY_BUDGET)
+            self.im = stored.pyramid[0]
+            self.pyramid[0] = self.im
 
         # for zooming and panning
         self.zoom_center_x = self.image_width / 2
         self.zoom_center_y = self.image_height / 2
         self.current_zoom_level = 0
 
+        self.invalidate(self.LAYER_ALL)
+
+    def read_stored_image(self, image_location, downsample):
+        # the image and its pyramid from the image cache, or decoded from the file
+        if self.image_cache is not None:
+            cached = self.image_cache.load_image(self.cache_key)
+            if cached is not None:
+                pyramid, raw_width, raw_height = cached
+                return StoredImage(pyramid, raw_width, raw_height, True)
+        image, raw_width, raw_height = read_image(image_location, downsample)
+        return StoredImage([image], raw_width, raw_height, False)
+
     def init_window(self):
         # cv2.WINDOW_NORMAL makes the output window resizeable
         cv2.namedWindow(self.WINDOW_NAME, cv2.WINDOW_KEEPRATIO)
@@ -53,21 +172,104 @@ class ImageViewer:
         cv2.resizeWindow(self.WINDOW_NAME, self.window_width, self.window_height)
 
         # set callback
-        cv2.setMouseCallback(self.WINDOW_NAME, self.handle_mouse_event)
+        cv2.setMouseCallback(self.WINDOW_NAME, self.on_mouse_event)
 
     def show(self):
+        if self.EVENT_RECORD_LOCATION is not None:
+            self.event_recorder = EventRecorder(self)
+        self.invalidate(self.LAYER_ALL)
+        self.refresh()
         while True:
-            image_to_show = self.get_processed_image()
-
-            cv2.imshow(self.WINDOW_NAME, image_to_show)
-
-            key = cv2.waitKey(10)
-            if self.handle_key_press(key):
+            # only wake up when there is input to handle
+            key = cv2.waitKey(self.get_wait_time())
+            if key != -1 and self.event_recorder is not None:
+                self.event_recorder.record_key(key)
+            if self.handle_key_press(key) or not self.is_window_open():
                 cv2.destroyAllWindows()
+                self.save_session()
+                if self.FRAME_TRACE_LOCATION is not None:
+                    self.frame_timer.write_trace(self.FRAME_TRACE_LOCATION)
+                if self.DEBUG_ALLOCATIONS:
+                    print("Frame allocations:", self.allocation_counter.get_summary())
+                if self.event_recorder is not None:
+                    self.event_recorder.write(self, self.EVENT_RECORD_LOCATION)
+                    self.event_recorder = None
                 break
+            self.update_background_work()
+            self.refresh()
+
+    def get_session_state(self):
+        # name -> array of the work done in the window (the names are SESSION_ARRAYS)
+        return {}
+
+    def set_session_state(self, arrays):
+        # replace the work done in the window with arrays from get_session_state
+        pass
+
+    def get_settings(self):
+        # everything besides the session state that changes what events do. Event recordings keep these so they
+        # replay the same way
+        return {"zoom_level": self.current_zoom_level, "zoom_center": [self.zoom_center_x, self.zoom_center_y]}
+
+    def set_settings(self, settings):
+        self.current_zoom_level = settings["zoom_level"]
+        self.zoom_center_x, self.zoom_center_y = settings["zoom_center"]
+        self.invalidate(self.LAYER_ALL)
+
+    def save_session(self):
+        # called when the window is closed to keep the work done in it in the image cache
+        if self.image_cache is not None and len(self.SESSION_ARRAYS) > 0:
+            self.image_cache.save_arrays(self.cache_key, self.get_session_state())
+
+    def load_session(self):
+        if self.image_cache is None or len(self.SESSION_ARRAYS) == 0:
+            return
+        # read into memory since the session is overwritten when the window closes
+        arrays = self.image_cache.load_arrays(self.cache_key, self.SESSION_ARRAYS, mmap_mode=None)
+        if arrays is not None:
+            self.set_session_state(arrays)
+
+    def update_background_work(self):
+        # called from the event loop to pick up results of work done on other threads
+        pass
+
+    def get_wait_time(self):
+        # 0 blocks until a key is pressed. Mouse events are still delivered to on_mouse_event while waiting
+        return 0
+
+    def is_window_open(self):
+        return cv2.getWindowProperty(self.WINDOW_NAME, cv2.WND_PROP_VISIBLE) >= 1
+
+    def invalidate(self, layers):
+        self.dirty |= layers
+
+    def refresh(self):
+        # redraw only if something changed since the last frame
+        if self.dirty:
+            frame_start = self.frame_timer.start_frame()
+            allocation_start = self.allocation_counter.start_frame()
+            image_to_show = self.get_processed_image()
+            if self.frame_timer.hud_visible:
+                self.frame_timer.draw_hud(image_to_show)
+            with self.frame_timer.stage("imshow"):
+                self.show_frame(image_to_show)
+            self.allocation_counter.end_frame(allocation_start)
+            self.frame_timer.end_frame(frame_start)
+            self.dirty = 0
+
+    def show_frame(self, image):
+        cv2.imshow(self.WINDOW_NAME, image)
+
+    def on_mouse_event(self, event, x, y, flags, param):
+        if self.event_recorder is not None:
+            self.event_recorder.record_mouse(event, x, y, flags)
+        self.handle_mouse_event(event, x, y, flags, param)
+        self.update_background_work()
+        self.refresh()
 
     def get_processed_image(self):
-        image_to_show = self.handle_zoom_and_pan(self.im.copy())
+        with self.frame_timer.stage("zoom_and_pan"):
+            image_to_show = self.handle_zoom_and_pan()
         return image_to_show
 
     def handle_mouse_event(self, event, x, y, flags, param):
@@ -88,36 +290,78 @@ class ImageViewer:
             self.increment_pan_y(1)
         elif key == ord("s"):  # "s" -> pan down
             self.increment_pan_y(-1)
+        elif key == ord("t"):  # "t" -> show/hide frame timings
+            self.frame_timer.toggle_hud()
+            self.invalidate(self.LAYER_HUD)
         return False
 
-    def convert_local_to_global(self, x, y):
+    def get_thumbnail(self, height):
+        # the whole image resized to height pixels, from the smallest pyramid level that is at least that big
+        level = len(self.pyramid) - 1
+        while level > 0 and self.pyramid[level].shape[0] < height:
+            level -= 1
+        width = int(self.image_width * height / self.image_height)
+        return cv2.resize(np.asarray(self.pyramid[level]), (width, height), interpolation=cv2.INTER_AREA)
+
+    def convert_global_to_thumbnail_points(self, points, height):
+        # (N, 1, 2) image points on a thumbnail of the given height, as fixed point coordinates with VIEW_SHIFT
+        # fractional bits for cv2 drawing
+        scale = height / self.image_height
+        return np.round(((np.asarray(points) + 0.5) * scale - 0.5) * (1 << self.VIEW_SHIFT)).astype(np.int32)
+
+    def get_view_scale_factor(self):
+        # window pixels per image pixel
+        return self.get_zoom_scale_factor() * self.window_width / self.image_width
+
+    def get_view_origin(self):
+        # image coordinates of the top left corner of the window. Snapped to whole window pixels so overlays rendered
+        # for the whole image at the current zoom line up with the view
+        scale = self.get_view_scale_factor()
         zoom = self.get_zoom_scale_factor()
         zoom_width = self.image_width / zoom
         zoom_height = self.image_height / zoom
-        global_x = self.zoom_center_x - zoom_width/2 + x/zoom
-        global_y = self.zoom_center_y - zoom_height/2 + y/zoom
+        origin_x = round((self.zoom_center_x - zoom_width/2) * scale) / scale
+        origin_y = round((self.zoom_center_y - zoom_height/2) * scale) / scale
+        return origin_x, origin_y
+
+    def convert_local_to_global(self, x, y):
+        scale = self.get_view_scale_factor()
+        origin_x, origin_y = self.get_view_origin()
+        global_x = origin_x + x/scale
+        global_y = origin_y + y/scale
         return global_x, global_y
 
     def convert_global_to_local(self, x, y):
-        zoom = self.get_zoom_scale_factor()
-        zoom_width = self.image_width / zoom
-        zoom_height = self.image_height / zoom
-        local_x = (x - (self.zoom_center_x - zoom_width/2)) * zoom
-        local_y = (y - (self.zoom_center_y - zoom_height/2)) * zoom
+        scale = self.get_view_scale_factor()
+        origin_x, origin_y = self.get_view_origin()
+        local_x = (x - origin_x) * scale
+        local_y = (y - origin_y) * scale
 
-        if local_x < 0 or local_x > self.image_width:
+        if local_x < 0 or local_x > self.window_width:
             local_x = -1
-        if local_y < 0 or local_y > self.image_height:
+        if local_y < 0 or local_y > self.window_height:
             local_y = -1
 
         return local_x, local_y
 
+    def convert_global_to_local_points(self, points):
+        # convert_global_to_local for an (N, 1, 2) array of points. Points outside the window are kept as they are (cv2
+        # clips them when drawing). Returns fixed point coordinates with VIEW_SHIFT fractional bits for cv2 drawing
+        scale = self.get_view_scale_factor() * (1 << self.VIEW_SHIFT)
+        origin_x, origin_y = self.get_view_origin()
+        local_points = np.empty(points.shape, np.int32)
+        local_points[..., 0] = np.round((points[..., 0] - origin_x) * scale)
+        local_points[..., 1] = np.round((points[..., 1] - origin_y) * scale)
+        return local_points
+
     def increment_zoom(self, zoom_increment):
         self.current_zoom_level += zoom_increment
         if self.current_zoom_level < 0:
             self.current_zoom_level = 0
         elif self.current_zoom_level > self.MAX_ZOOM_LEVEL:
             self.current_zoom_level = self.MAX_ZOOM_LEVEL
+        # line thicknesses depend on the zoom so everything needs to be redrawn
+        self.invalidate(self.LAYER_ALL)
         # make sure zoom center is still accurate
         self.increment_pan_x(0)
         self.increment_pan_y(0)
@@ -130,6 +374,7 @@ class ImageViewer:
         zoom_width = self.image_width / self.get_zoom_scale_factor()
         pan_increment_size = zoom_width / 10
         self.zoom_center_x += pan_increment * pan_increment_size
+        self.invalidate(self.LAYER_VIEW)
         if self.zoom_center_x - zoom_width / 2 < 0:
             self.zoom_center_x = zoom_width / 2
         elif self.zoom_center_x + zoom_width / 2 > self.image_width:
@@ -140,6 +385,7 @@ class ImageViewer:
         zoom_height = self.image_height / self.get_zoom_scale_factor()
         pan_increment_size = zoom_height / 10
         self.zoom_center_y -= pan_increment * pan_increment_size  # minus because origin is top left
+        self.invalidate(self.LAYER_VIEW)
         if self.zoom_center_y - zoom_height / 2 < 0:
             self.zoom_center_y = zoom_height / 2
         elif self.zoom_center_y + zoom_height / 2 > self.image_height:
@@ -153,20 +399,31 @@ class ImageViewer:
         zoom_y = int(self.zoom_center_y - zoom_height / 2)
         return zoom_x, zoom_y, zoom_width, zoom_height
 
-    def handle_zoom_and_pan(self, image):
-        zoom_x, zoom_y, zoom_width, zoom_height = self.get_zoom_region_position()
-
-        if zoom_x < 0:
-            zoom_x = 0
-        elif zoom_x + zoom_width > self.image_width:
-            zoom_x = self.image_width - zoom_width
-        if zoom_y < 0:
-            zoom_y = 0
-        elif zoom_y + zoom_height > self.image_height:
-            zoom_y = self.image_height - zoom_height
-
-        roi = image[zoom_y:zoom_y+zoom_height, zoom_x:zoom_x+zoom_width]
-        image_to_show = cv2.resize(roi, (self.image_width, self.image_height))
+    def get_view_level(self):
+        # the smallest pyramid level that still has at least one pixel per window pixel
+        return int(np.clip(np.floor(np.log2(1 / self.get_view_scale_factor())), 0, len(self.pyramid) - 1))
+
+    def handle_zoom_and_pan(self):
+        # render the zoomed and panned view at window resolution from the pyramid level that matches the zoom. Drawn
+        # into the view frame buffer, so the image returned is overwritten by the next call
+        scale = self.get_view_scale_factor()
+        origin_x, origin_y = self.get_view_origin()
+        level = self.get_view_level()
+        level_scale = scale * (1 << level)
+        level_image = self.pyramid[level]
+
+        # only the part of the level that is in the window (plus a pixel of margin for interpolation)
+        level_x0 = max(int(np.floor(origin_x / (1 << level))) - 1, 0)
+        level_y0 = max(int(np.floor(origin_y / (1 << level))) - 1, 0)
+        level_x1 = min(int(np.ceil((origin_x + self.window_width / scale) / (1 << level))) + 2, level_image.shape[1])
+        level_y1 = min(int(np.ceil((origin_y + self.window_height / scale) / (1 << level))) + 2, level_image.shape[0])
+        roi = level_image[level_y0:level_y1, level_x0:level_x1]
+
+        transform = np.array([[level_scale, 0, (level_x0 * (1 << level) - origin_x) * scale],
+                              [0, level_scale, (level_y0 * (1 << level) - origin_y) * scale]])
+        image_to_show = cv2.warpAffine(roi, transform, (self.window_width, self.window_height),
+                                       dst=self.frame_buffers["view"], flags=cv2.INTER_LINEAR,
+                                       borderMode=cv2.BORDER_REPLICATE)
         return image_to_show
 
 
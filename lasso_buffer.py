@@ -0,0 +1,52 @@
+import numpy as np
+
+INITIAL_CAPACITY = 4096  # points
+
+
+class LassoBuffer:
+    # All points of a lasso in one preallocated int32 array shaped like an OpenCV contour (N, 1, 2), plus a table of
+    # where each segment ends. The array doubles in size when it runs out of room so appending a segment is amortized
+    # O(segment length), and undoing a segment only moves the end of the lasso back
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.buffer = np.empty((capacity, 1, 2), np.int32)
+        self.segment_ends = []
+
+    def __len__(self):
+        # number of segments
+        return len(self.segment_ends)
+
+    def __getitem__(self, index):
+        # view of one segment
+        index = range(len(self.segment_ends))[index]
+        start = self.segment_ends[index - 1] if index > 0 else 0
+        return self.buffer[start:self.segment_ends[index]]
+
+    def get_size(self):
+        # number of points
+        return self.segment_ends[-1] if len(self.segment_ends) > 0 else 0
+
+    def get_points(self):
+        # view of all points in the lasso (no copy, so it is only valid until the lasso changes)
+        return self.buffer[:self.get_size()]
+
+    def append(self, segment):
+        segment = np.asarray(segment).reshape(-1, 1, 2)
+        size = self.get_size()
+        new_size = size + len(segment)
+        if new_size > len(self.buffer):
+            capacity = max(len(self.buffer), 1)
+            while capacity < new_size:
+                capacity *= 2
+            buffer = np.empty((capacity, 1, 2), np.int32)
+            buffer[:size] = self.buffer[:size]
+            self.buffer = buffer
+        self.buffer[size:new_size] = segment
+        self.segment_ends.append(new_size)
+
+    def pop(self):
+        # remove the last segment
+        del self.segment_ends[-1]
+
+    def clear(self):
+        self.segment_ends = []
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+MAX_CACHED_ZOOM_LEVELS = 3
+
+
+class LassoOverlay:
+    # Alpha masks of the committed lasso rasterized at the window resolution of each zoom level. A mask covers the whole
+    # image (window size * zoom) so panning only moves the window over it. New segments are drawn into the mask
+    # incrementally, so the cost of a frame does not depend on the length of the lasso
+
+    def __init__(self, max_zoom_levels=MAX_CACHED_ZOOM_LEVELS):
+        self.max_zoom_levels = max_zoom_levels
+        # zoom level -> [mask, number of lasso points drawn in the mask]
+        self.masks = OrderedDict()
+
+    def clear(self):
+        # needed whenever points are removed from the lasso
+        self.masks.clear()
+
+    def get_mask(self, zoom_level, width, height, scale, points, thickness, shift):
+        # mask of the lasso points (in image coordinates) drawn at scale window pixels per image pixel
+        if zoom_level in self.masks:
+            self.masks.move_to_end(zoom_level)
+            mask, drawn = self.masks[zoom_level]
+        else:
+            mask, drawn = np.zeros((height, width), np.uint8), 0
+            self.masks[zoom_level] = [mask, drawn]
+            if len(self.masks) > self.max_zoom_levels:
+                self.masks.popitem(last=False)
+
+        if drawn > len(points):
+            # points were removed without clearing the overlay, so start over
+            mask[:] = 0
+            drawn = 0
+
+        if drawn < len(points):
+            # draw only the new points, starting at the last point already drawn so the lasso stays connected
+            new_points = points[max(drawn - 1, 0):]
+            new_points = np.round(new_points * (scale * (1 << shift))).astype(np.int32)
+            cv2.polylines(mask, [new_points], False, 255, thickness=thickness, lineType=cv2.LINE_AA, shift=shift)
+            self.masks[zoom_level][1] = len(points)
+
+        return mask
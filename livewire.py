@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from edge_index import find_canny_thresholds
+from edge_index import get_gradient_sample
+
+# weights of the cost of a pixel: not being an edge, low gradient and a constant cost for the length of the route
+EDGE_WEIGHT = 0.43
+GRADIENT_WEIGHT = 0.43
+LENGTH_WEIGHT = 0.14
+
+LIVEWIRE_MIN_RADIUS = 64  # pixels around the anchor covered by the first shortest path tree
+LIVEWIRE_MAX_RADIUS = 512  # largest tree (in pixels of a pyramid level) before switching to a smaller pyramid level
+
+COST_TILE_SIZE = 256  # pixels of a pyramid level per cost map tile
+COST_TILE_HALO = 16  # pixels around a tile that are included in its edge detection so edges continue across tiles
+COST_TILE_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes of cost map tiles kept in memory
+
+
+def find_gradient(gray):
+    gradient_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0)
+    gradient_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+    return cv2.magnitude(gradient_x, gradient_y)
+
+
+def find_cost_statistics(image):
+    # Canny thresholds and the largest gradient of a BGR image (or tiled raster), from the same sample of it, so the
+    # cost of every tile of it is on the same scale. Small images are sampled whole
+    max_gradient = 0.0
+    for block in get_gradient_sample(image):
+        max_gradient = max(max_gradient, float(find_gradient(cv2.cvtColor(block, cv2.COLOR_BGR2GRAY)).max()))
+    threshold1, threshold2 = find_canny_thresholds(image)
+    return threshold1, threshold2, max_gradient
+
+
+def find_cost_tile(image, region, statistics, halo=COST_TILE_HALO):
+    # cost of passing through each pixel of one tile of an image (or tiled raster). Low on edges and strong gradients
+    # (intelligent scissors)
+    x0, y0, x1, y1 = region
+    threshold1, threshold2, max_gradient = statistics
+    height, width = image.shape[:2]
+    halo_x0, halo_y0 = max(x0 - halo, 0), max(y0 - halo, 0)
+    halo_x1, halo_y1 = min(x1 + halo, width), min(y1 + halo, height)
+    gray = cv2.cvtColor(np.asarray(image[halo_y0:halo_y1, halo_x0:halo_x1]), cv2.COLOR_BGR2GRAY)
+    inside = (slice(y0 - halo_y0, y1 - halo_y0), slice(x0 - halo_x0, x1 - halo_x0))
+
+    gradient = find_gradient(gray)[inside]
+    if max_gradient > 0:
+        # the largest gradient comes from a sample, so gradients outside it can be a little larger
+        gradient = np.minimum(gradient / max_gradient, 1)
+    not_edge = (cv2.Canny(gray, threshold1, threshold2)[inside] == 0).astype(np.float32)
+    return EDGE_WEIGHT * not_edge + GRADIENT_WEIGHT * (1 - gradient) + LENGTH_WEIGHT
+
+
+class LiveWire:
+    # Routes that follow the cheapest path through the cost map from an anchor to the cursor. For each anchor a shortest
+    # path tree is built once (Dijkstra) over a region around it, so every cursor position inside the region only needs
+    # a walk back along the tree. The region grows (and moves to smaller pyramid levels) when the cursor leaves it.
+    # The cost map is only found for the tiles a tree covers, so a level kept in a TiledRaster is never read whole
+
+    def __init__(self, pyramid, tile_size=COST_TILE_SIZE, memory_budget=COST_TILE_MEMORY_BUDGET):
+        self.pyramid = pyramid
+        self.tile_size = tile_size
+        self.memory_budget = memory_budget
+        self.cost_statistics = {}  # pyramid level -> (Canny thresholds, largest gradient), found when first needed
+        # (level, tile_y, tile_x) -> cost map tile, least recently used first
+        self.cost_tiles = OrderedDict()
+        self.cost_tile_bytes = 0
+        self.lock = threading.Lock()
+
+        # shortest path tree of the current anchor
+        self.anchor = None
+        self.level = None
+        self.region = None  # (x0, y0, x1, y1) in pixels of the pyramid level
+        self.radius = None  # in image pixels
+        self.tree = None
+
+    def get_cost_tile(self, level, tile_y, tile_x):
+        key = (level, tile_y, tile_x)
+        if key in self.cost_tiles:
+            self.cost_tiles.move_to_end(key)
+            return self.cost_tiles[key]
+
+        if level not in self.cost_statistics:
+            self.cost_statistics[level] = find_cost_statistics(self.pyramid[level])
+        height, width = self.pyramid[level].shape[:2]
+        region = (tile_x * self.tile_size, tile_y * self.tile_size, min((tile_x + 1) * self.tile_size, width),
+                  min((tile_y + 1) * self.tile_size, height))
+        tile = find_cost_tile(self.pyramid[level], region, self.cost_statistics[level])
+        self.cost_tiles[key] = tile
+        self.cost_tile_bytes += tile.nbytes
+        while len(self.cost_tiles) > 1 and self.cost_tile_bytes > self.memory_budget:
+            self.cost_tile_bytes -= self.cost_tiles.popitem(last=False)[1].nbytes
+        return tile
+
+    def get_cost_map(self, level, region):
+        # cost map of the (x0, y0, x1, y1) region of a pyramid level, put together from its tiles
+        x0, y0, x1, y1 = region
+        cost_map = np.empty((y1 - y0, x1 - x0), np.float32)
+        for tile_y in range(y0 // self.tile_size, (y1 - 1) // self.tile_size + 1):
+            for tile_x in range(x0 // self.tile_size, (x1 - 1) // self.tile_size + 1):
+                tile = self.get_cost_tile(level, tile_y, tile_x)
+                tile_x0, tile_y0 = tile_x * self.tile_size, tile_y * self.tile_size
+                # part of the tile that is inside the region
+                part_x0, part_y0 = max(x0, tile_x0), max(y0, tile_y0)
+                part_x1, part_y1 = min(x1, tile_x0 + tile.shape[1]), min(y1, tile_y0 + tile.shape[0])
+                cost_map[part_y0 - y0:part_y1 - y0, part_x0 - x0:part_x1 - x0] = \
+                    tile[part_y0 - tile_y0:part_y1 - tile_y0, part_x0 - tile_x0:part_x1 - tile_x0]
+        return cost_map
+
+    def build_tree(self, anchor, radius):
+        # radius is in image pixels
+        level = 0
+        while radius / (1 << level) > LIVEWIRE_MAX_RADIUS and level < len(self.pyramid) - 1:
+            level += 1
+        radius = min(radius / (1 << level), LIVEWIRE_MAX_RADIUS)
+
+        height, width = self.pyramid[level].shape[:2]
+        anchor_x = min(int(round(anchor[0] / (1 << level))), width - 1)
+        anchor_y = min(int(round(anchor[1] / (1 << level))), height - 1)
+        x0 = max(int(anchor_x - radius), 0)
+        y0 = max(int(anchor_y - radius), 0)
+        x1 = min(int(anchor_x + radius) + 1, width)
+        y1 = min(int(anchor_y + radius) + 1, height)
+
+        # imported on first use so scikit-image is only loaded once livewire mode is actually used
+        from skimage.graph import MCP_Geometric
+        self.tree = MCP_Geometric(self.get_cost_map(level, (x0, y0, x1, y1)))
+        self.tree.find_costs([(anchor_y - y0, anchor_x - x0)])
+        self.anchor = anchor
+        self.level = level
+        self.region = (x0, y0, x1, y1)
+        self.radius = radius * (1 << level)
+
+    def region_contains(self, point):
+        x0, y0, x1, y1 = self.region
+        point_x = point[0] / (1 << self.level)
+        point_y = point[1] / (1 << self.level)
+        return x0 <= point_x < x1 and y0 <= point_y < y1
+
+    def find_route(self, anchor, point):
+        # route from anchor to point (both in image coordinates) as an (N, 1, 2) contour. If the point is too far away
+        # for the biggest tree the route ends at the edge of the tree
+        with self.lock:
+            distance = np.hypot(point[0] - anchor[0], point[1] - anchor[1])
+            radius = min(max(2 * distance, LIVEWIRE_MIN_RADIUS), LIVEWIRE_MAX_RADIUS * (1 << (len(self.pyramid) - 1)))
+            if anchor != self.anchor or (not self.region_contains(point) and radius > self.radius):
+                self.build_tree(anchor, radius)
+
+            level = self.level
+            x0, y0, x1, y1 = self.region
+            end_x = int(np.clip(round(point[0] / (1 << level)), x0, x1 - 1))
+            end_y = int(np.clip(round(point[1] / (1 << level)), y0, y1 - 1))
+            path = np.array(self.tree.traceback((end_y - y0, end_x - x0)))
+            inside = self.region_contains(point)
+
+        route = np.empty((len(path), 1, 2), np.int32)
+        route[:, 0, 0] = (path[:, 1] + x0) * (1 << level)
+        route[:, 0, 1] = (path[:, 0] + y0) * (1 << level)
+        # start exactly at the anchor, and end exactly at the point if it was inside the tree
+        route[0, 0, :] = anchor
+        if inside:
+            route[-1, 0, :] = point
+        return route
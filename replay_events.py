@@ -0,0 +1,155 @@
+# Replay event recordings without opening any windows. Set the CADLASSO_EVENT_RECORD environment variable to a file name
+# while using the gui to record every contour selection and scale selection window session to it. Each session is fed
+# back into a new ContourTracer or ScaleSelector the way the window's event loop would (frames are rendered but not
+# shown), either as fast as possible or with the recorded timing. Reports how long every event took to handle,
+# including the frame it causes, and checks that the points at the end (what gets exported) are identical to the ones
+# that were recorded.
+#
+# usage: python replay_events.py RECORDING [--realtime] [--image-dir DIR] [--output replay.json]
+#
+# Exits with 1 if any session ends with different points or its image has changed since it was recorded.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from contour_tracer import ContourTracer
+from event_recorder import decode_arrays
+from event_recorder import read_recording
+from image_cache import hash_file
+from scale_selector import ScaleSelector
+
+VIEWERS = {"ContourTracer": ContourTracer, "ScaleSelector": ScaleSelector}
+MOUSE_EVENT_NAMES = {
+    cv2.EVENT_MOUSEMOVE: "mouse_move",
+    cv2.EVENT_LBUTTONDOWN: "left_button_down",
+    cv2.EVENT_LBUTTONUP: "left_button_up",
+    cv2.EVENT_RBUTTONDOWN: "right_button_down",
+    cv2.EVENT_RBUTTONUP: "right_button_up",
+}
+PERCENTILES = (50, 95, 99)
+
+
+def get_event_name(event):
+    if event[1] == "mouse":
+        return MOUSE_EVENT_NAMES.get(event[2], "mouse_%d" % event[2])
+    return "key"
+
+
+def get_latency_summary(seconds):
+    values = np.array(seconds) * 1000
+    summary = {"count": len(values)}
+    summary.update(zip(("p%d_ms" % p for p in PERCENTILES), np.percentile(values, PERCENTILES).tolist()))
+    summary["max_ms"] = float(values.max())
+    return summary
+
+
+def find_differences(expected, actual):
+    # names of the arrays that aren't identical (same shape, dtype and values, where NaNs match each other)
+    differences = []
+    for name, expected_array in expected.items():
+        actual_array = np.asarray(actual.get(name))
+        if actual_array.shape != expected_array.shape or actual_array.dtype != expected_array.dtype or \
+                not np.array_equal(actual_array, expected_array, equal_nan=expected_array.dtype.kind == "f"):
+            differences.append(name)
+    return differences
+
+
+def replay_session(session, realtime=False, image_dir=None):
+    image_location = session["image"]
+    if image_dir is not None:
+        image_location = os.path.join(image_dir, os.path.basename(image_location))
+    result = {"viewer": session["viewer"], "image": image_location, "events": len(session["events"]),
+              "recorded_seconds": session["events"][-1][0] if len(session["events"]) > 0 else 0.0}
+    if not os.path.exists(image_location) or hash_file(image_location) != session["image_hash"]:
+        result["status"] = "image_changed"
+        return result
+
+    viewer = VIEWERS[session["viewer"]](*session["screen"])
+    viewer.load_image(image_location, session["downsample"])
+    if isinstance(viewer, ContourTracer):
+        # the recording waited for every edge too, so the magnet sees the same contours
+        viewer.wait_for_edges()
+    viewer.set_settings(session["settings"])
+    viewer.set_session_state(decode_arrays(session["initial_state"]))
+    # stands in for cv2.imshow: frames are still rendered, just not shown
+    viewer.show_frame = lambda image: None
+    viewer.invalidate(viewer.LAYER_ALL)
+    viewer.refresh()
+
+    # the same calls the window's event loop and mouse callback make. Without a window routes are found right away,
+    # like they are while recording
+    latencies = {}
+    start = time.perf_counter()
+    for event in session["events"]:
+        if realtime:
+            time.sleep(max(start + event[0] - time.perf_counter(), 0))
+        event_start = time.perf_counter()
+        closed = False
+        if event[1] == "mouse":
+            _, _, mouse_event, x, y, flags = event
+            viewer.on_mouse_event(mouse_event, x, y, flags, None)
+        else:
+            closed = viewer.handle_key_press(event[2])
+            if not closed:
+                viewer.update_background_work()
+                viewer.refresh()
+        latencies.setdefault(get_event_name(event), []).append(time.perf_counter() - event_start)
+        if closed:
+            break
+    result["replay_seconds"] = round(time.perf_counter() - start, 4)
+    result["latency"] = {name: get_latency_summary(seconds) for name, seconds in latencies.items()}
+    if len(latencies) > 0:
+        result["latency"]["all"] = get_latency_summary([value for seconds in latencies.values() for value in seconds])
+
+    result["differences"] = find_differences(decode_arrays(session["final_state"]), viewer.get_session_state())
+    result["status"] = "identical" if len(result["differences"]) == 0 else "different"
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded window sessions without a display")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="wait between events as long as the recording did")
+    parser.add_argument("--image-dir", help="look for the images in this directory instead of where they were recorded")
+    parser.add_argument("--output", help="save the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for number, session in enumerate(read_recording(args.recording)):
+        result = replay_session(session, args.realtime, args.image_dir)
+        results.append(result)
+        print("session %d: %s %s, %d events: %s" % (number, result["viewer"], os.path.basename(result["image"]),
+                                                   result["events"], result["status"]))
+        if result["status"] == "different":
+            print("  different:", ", ".join(result["differences"]))
+        for name, summary in sorted(result.get("latency", {}).items()):
+            print("  %-18s %6d events  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  max %7.2f ms" % (
+                name, summary["count"], summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["max_ms"]))
+
+    if args.output is not None:
+        report = {
+            "metadata": {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "recording": args.recording,
+                "realtime": args.realtime,
+            },
+            "sessions": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved", args.output)
+    return 0 if all(result["status"] == "identical" for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
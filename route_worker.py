@@ -0,0 +1,62 @@
+import threading
+import traceback
+
+
+class RouteWorker:
+    # Runs requests one at a time on a background thread. Only the newest request is kept, so requests that are
+    # replaced before the thread gets to them are dropped. Each request gets a sequence number that is returned with its
+    # result so the caller can tell how fresh a result is. A request that raises is logged and its result is None, so
+    # one failed request doesn't stop the caller
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence_number = 0  # of the newest request
+        self.request = None  # (sequence number, function, args) waiting to be run
+        self.result = None  # (sequence number, result) not taken yet
+        self.busy = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args):
+        with self.condition:
+            self.sequence_number += 1
+            self.request = (self.sequence_number, function, args)
+            self.condition.notify_all()
+            return self.sequence_number
+
+    def has_pending(self):
+        # true if there is a request that has not finished or a result that has not been taken
+        with self.condition:
+            return self.request is not None or self.busy or self.result is not None
+
+    def get_result(self):
+        # newest finished (sequence number, result) that has not been taken yet, or None. The result is None if the
+        # request failed
+        with self.condition:
+            result, self.result = self.result, None
+            return result
+
+    def wait(self, timeout=None):
+        # wait until every submitted request has finished. Returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: self.request is None and not self.busy, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.request is not None)
+                sequence_number, function, args = self.request
+                self.request = None
+                self.busy = True
+
+            result = None
+            try:
+                result = function(*args)
+            except Exception:
+                print("Background request failed:")
+                traceback.print_exc()
+
+            with self.condition:
+                self.busy = False
+                self.result = (sequence_number, result)
+                self.condition.notify_all()
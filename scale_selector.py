@@ -3,15 +3,19 @@ import numpy as np
 from image_viewer import ImageViewer
 from image_viewer import DOWNSAMPLE
 
-SCALE_PREVIEW_SAVE_LOCATION = 'previews/scale_preview.jpeg'
+PREVIEW_LINE_THICKNESS = 2  # pixels of the measurement on the gui's thumbnail
 
 
 class ScaleSelector(ImageViewer):
     WINDOW_NAME = "CAD Lasso"
     MAX_ZOOM_LEVEL = 20
 
-    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE):
-        super().__init__(screen_width, screen_height, image_location, downsample)
+    SESSION_ARRAYS = ("scale_points",)
+    # the view with the measurement drawn on it
+    FRAME_BUFFERS = dict(ImageViewer.FRAME_BUFFERS, frame=(3, np.uint8))
+
+    def __init__(self, screen_width, screen_height, image_location=None, downsample=DOWNSAMPLE, image_cache=None):
+        super().__init__(screen_width, screen_height, image_location, downsample, image_cache)
 
         if image_location is None:
             # points in scale measurement
@@ -19,6 +23,9 @@ class ScaleSelector(ImageViewer):
             self.second_point = None
             self.next_point = None
 
+            # thumbnail of the image with the measurement on it for the gui. Updated when it is accepted with enter
+            self.preview = None
+
     def load_image(self, image_location, downsample=DOWNSAMPLE):
         super().load_image(image_location, downsample)
 
@@ -27,11 +34,28 @@ class ScaleSelector(ImageViewer):
         self.second_point = None
         self.next_point = None
 
-        cv2.imwrite(SCALE_PREVIEW_SAVE_LOCATION, self.im)
+        self.load_session()
+        self.preview = self.get_scale_preview(self.THUMBNAIL_HEIGHT)
+
+    def get_session_state(self):
+        # the measurement points, so they are still there the next time this image is loaded. Missing points are NaN
+        scale_points = np.full((2, 2), np.nan)
+        for i, point in enumerate((self.first_point, self.second_point)):
+            if point is not None:
+                scale_points[i] = point
+        return {"scale_points": scale_points}
+
+    def set_session_state(self, arrays):
+        first_point, second_point = [None if np.isnan(x) else (int(x), int(y)) for x, y in arrays["scale_points"]]
+        self.first_point = first_point
+        self.second_point = second_point if first_point is not None else None
+        self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
 
     def get_processed_image(self):
-        image_to_show = self.show_scale_preview(self.im.copy())
-        image_to_show = self.handle_zoom_and_pan(image_to_show)
+        with self.frame_timer.stage("zoom_and_pan"):
+            image_to_show = self.handle_zoom_and_pan()
+        with self.frame_timer.stage("preview"):
+            image_to_show = self.show_scale_preview(image_to_show)
         return image_to_show
 
     def handle_mouse_event(self, event, x, y, flags, param):
@@ -47,39 +71,54 @@ class ScaleSelector(ImageViewer):
                 self.first_point = (x, y)
             elif self.second_point is None:
                 self.second_point = (x, y)
+            self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
         elif event == cv2.EVENT_MOUSEMOVE:
             self.next_point = (x, y)
+            # the preview line only follows the cursor between the first and second click
+            if self.first_point is not None and self.second_point is None:
+                self.invalidate(self.LAYER_PREVIEW)
         elif event == cv2.EVENT_RBUTTONUP:
             # undo previous click if right mouse button clicked
             if self.second_point is not None:
                 self.second_point = None
             elif self.first_point is not None:
                 self.first_point = None
+            self.invalidate(self.LAYER_LASSO | self.LAYER_PREVIEW)
 
     def handle_key_press(self, key):
         if super().handle_key_press(key):
             return True
         elif key == 13:  # enter key
-            if self.second_point is not None:
-                preview = self.show_scale_preview(self.im.copy(), thickness_scale_factor=2)
-            else:
-                preview = self.im.copy()
-            cv2.imwrite(SCALE_PREVIEW_SAVE_LOCATION, preview)
+            self.preview = self.get_scale_preview(self.THUMBNAIL_HEIGHT)
             return True
         return False
 
-    def show_scale_preview(self, image, thickness_scale_factor=1):
-        image_copy = image.copy()
-        thickness = thickness_scale_factor * \
-                    int(np.ceil(3 * (self.image_width / self.window_width) / self.get_zoom_scale_factor()))
+    def show_scale_preview(self, image):
+        image_copy = self.frame_buffers["frame"]
+        np.copyto(image_copy, image)
 
         if self.second_point is not None:
-            cv2.line(image_copy, self.first_point, self.second_point, (255, 0, 0), thickness)
-        elif self.first_point is not None:
-            cv2.line(image_copy, self.first_point, self.next_point, (0, 255, 0), thickness)
+            self.draw_line(image_copy, self.first_point, self.second_point, (255, 0, 0))
+        elif self.first_point is not None and self.next_point is not None:
+            self.draw_line(image_copy, self.first_point, self.next_point, (0, 255, 0))
 
         return image_copy
 
+    def draw_line(self, image, point1, point2, color):
+        # draw a line between two image points on the window sized view
+        line = self.convert_global_to_local_points(np.array([[point1], [point2]]))
+        cv2.line(image, tuple(line[0, 0]), tuple(line[1, 0]), color, self.LINE_THICKNESS, shift=self.VIEW_SHIFT)
+
+    def get_scale_preview(self, height):
+        # thumbnail of the image with the measurement drawn on it
+        preview = self.get_thumbnail(height)
+        if self.second_point is not None:
+            line = self.convert_global_to_thumbnail_points(np.array([[self.first_point], [self.second_point]]), height)
+            cv2.line(preview, tuple(line[0, 0]), tuple(line[1, 0]), (255, 0, 0), PREVIEW_LINE_THICKNESS,
+                     shift=self.VIEW_SHIFT)
+
+        return preview
+
     def get_pixel_distance(self):
         if self.second_point is not None:
             x1, y1 = self.first_point
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+LARGE_SEGMENT_POINTS = 256  # segments with more points than this are measured one at a time with slices
+LARGE_SEGMENT_CHUNK = 8192  # points of a long segment measured at a time, so the temporary arrays stay in the cache
+
+
+def find_distances(x, y, indices, start_x, start_y, end_x, end_y):
+    # distance of points to segments (not the infinite lines, so the deviation is the real distance to the simplified
+    # outline). A segment that starts and ends on the same point (closing a loop) measures the distance to that point
+    direction_x = end_x - start_x
+    direction_y = end_y - start_y
+    length_squared = np.maximum(direction_x * direction_x + direction_y * direction_y, 1e-300)
+    relative_x = x[indices] - start_x
+    relative_y = y[indices] - start_y
+    t = np.clip((relative_x * direction_x + relative_y * direction_y) / length_squared, 0, 1)
+    return np.hypot(relative_x - t * direction_x, relative_y - t * direction_y)
+
+
+def find_farthest_point(x, y, start, end, buffers):
+    # index and distance of the point strictly between start and end that is farthest from the segment between them
+    # (the first one on ties). Squared distances are found chunk by chunk in place in the 4 buffers, and only the
+    # farthest point's distance is taken the same way find_distances does
+    start_x, start_y = x[start], y[start]
+    direction_x = x[end] - start_x
+    direction_y = y[end] - start_y
+    length_squared = max(direction_x * direction_x + direction_y * direction_y, 1e-300)
+    farthest = start + 1
+    farthest_squared = -1.0
+    for chunk_start in range(start + 1, end, LARGE_SEGMENT_CHUNK):
+        chunk_end = min(chunk_start + LARGE_SEGMENT_CHUNK, end)
+        relative_x, relative_y, t, temporary = [buffer[:chunk_end - chunk_start] for buffer in buffers]
+        np.subtract(x[chunk_start:chunk_end], start_x, out=relative_x)
+        np.subtract(y[chunk_start:chunk_end], start_y, out=relative_y)
+        np.multiply(relative_x, direction_x, out=t)
+        np.multiply(relative_y, direction_y, out=temporary)
+        np.add(t, temporary, out=t)
+        np.divide(t, length_squared, out=t)
+        np.clip(t, 0, 1, out=t)
+        # offset from the closest point on the segment, squared and summed into relative_x
+        np.multiply(t, direction_x, out=temporary)
+        np.subtract(relative_x, temporary, out=relative_x)
+        np.multiply(t, direction_y, out=temporary)
+        np.subtract(relative_y, temporary, out=relative_y)
+        np.multiply(relative_x, relative_x, out=relative_x)
+        np.multiply(relative_y, relative_y, out=relative_y)
+        np.add(relative_x, relative_y, out=relative_x)
+        i = int(np.argmax(relative_x))
+        if relative_x[i] > farthest_squared:
+            farthest = chunk_start + i
+            farthest_squared = relative_x[i]
+    return farthest, float(find_distances(x, y, farthest, start_x, start_y, x[end], y[end]))
+
+
+def find_farthest_points(x, y, starts, ends):
+    # index and distance of the point strictly between starts[i] and ends[i] that is farthest from the segment between
+    # them (the first one on ties, like argmax). Every segment needs at least one point in between
+    farthest = np.empty(len(starts), np.int64)
+    maxes = np.empty(len(starts))
+
+    # a few long segments are cheaper with slices than with the gathers needed to do all of them at once
+    counts = ends - starts - 1
+    large = np.flatnonzero(counts > LARGE_SEGMENT_POINTS)
+    if len(large) > 0:
+        buffers = [np.empty(min(counts[large].max(), LARGE_SEGMENT_CHUNK)) for _ in range(4)]
+        for i in large:
+            farthest[i], maxes[i] = find_farthest_point(x, y, starts[i], ends[i], buffers)
+
+    # all the short segments together
+    small = np.flatnonzero(counts <= LARGE_SEGMENT_POINTS)
+    if len(small) > 0:
+        starts, ends, counts = starts[small], ends[small], counts[small]
+        first = np.cumsum(counts) - counts  # position of the first point of each segment
+        # index of each point: start of its segment + 1 + its position within the segment
+        indices = np.arange(counts.sum()) + np.repeat(starts + 1 - first, counts)
+        distances = find_distances(x, y, indices, np.repeat(x[starts], counts), np.repeat(y[starts], counts),
+                                   np.repeat(x[ends], counts), np.repeat(y[ends], counts))
+        maxes[small] = np.maximum.reduceat(distances, first)
+        candidates = np.flatnonzero(distances == np.repeat(maxes[small], counts))
+        candidate_segments = np.repeat(np.arange(len(small)), counts)[candidates]
+        farthest[small] = indices[candidates[np.diff(candidate_segments, prepend=-1) != 0]]
+    return farthest, maxes
+
+
+def simplify_points(points, tolerance, closed=True):
+    # Douglas-Peucker simplification of an (N, 2) polyline. Keeps the fewest points such that every removed point is
+    # within tolerance of the simplified line, so straight runs collapse to their ends while corners keep their points.
+    # All segments that still need splitting are split together in one vectorized pass instead of one recursive call
+    # per segment, which is what makes it fast when many points are kept. When few are, most of the time goes to a
+    # few long segments, which are measured in cache sized chunks. Returns the simplified points and the
+    # largest distance of a removed point to the simplified line (same units as the points)
+    points = np.asarray(points, np.float64)
+    if len(points) < 3 or tolerance <= 0:
+        return points.copy(), 0.0
+
+    # a closed lasso is simplified as a line from point 0 all the way around and back to point 0
+    x = np.append(points[:, 0], points[0, 0]) if closed else points[:, 0].copy()
+    y = np.append(points[:, 1], points[0, 1]) if closed else points[:, 1].copy()
+    keep = np.zeros(len(x), bool)
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([len(x) - 1])
+    max_deviation = 0.0
+
+    while len(starts) > 0:
+        # segments without points in between are done
+        has_points = ends - starts > 1
+        starts, ends = starts[has_points], ends[has_points]
+        if len(starts) == 0:
+            break
+        farthest, maxes = find_farthest_points(x, y, starts, ends)
+
+        split = maxes > tolerance
+        if not np.all(split):
+            max_deviation = max(max_deviation, maxes[~split].max())
+
+        farthest = farthest[split]
+        keep[farthest] = True
+        starts, ends = np.concatenate((starts[split], farthest)), np.concatenate((farthest, ends[split]))
+
+    if closed:
+        keep = keep[:-1]
+    return points[keep], float(max_deviation)
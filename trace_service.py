@@ -0,0 +1,440 @@
+# Local tracing service. Keeps contour tracers, the images they have decoded and their edges warm in one process, so
+# CAD scripts (like FUSION_Import_Points with TRACE_SERVICE set) and operators don't each start cold. Listens for HTTP
+# on localhost or on a Unix socket. Images share the image cache with the gui: the lasso and scale of an image traced in
+# the gui are picked up when it is loaded here, and the ones set here show up in the gui.
+#
+# usage: python trace_service.py [--host 127.0.0.1] [--port 8765 | --socket PATH] [--max-images 4] [--no-cache]
+#
+# Coordinates are in pixels of the original image (like batch_trace.py) and points are returned in cm, like the "Save"
+# button saves them. ID is the id returned when the image was loaded, or "latest" for the image that was used last.
+#
+#   POST   /images                  {"path": ..., "downsample": 1} -> image info (loaded, or reused if it already is)
+#   GET    /images                  -> info of every loaded image
+#   GET    /images/ID               -> image info
+#   DELETE /images/ID
+#   POST   /images/ID/auto_outline  {"seed": [x, y]} or {"box": [x0, y0, x1, y1]}, optional "method"
+#   POST   /images/ID/clicks        {"clicks": [[x, y], ...]}, optional "snap_mode" and "append" (false: start over)
+#   POST   /images/ID/scale         {"points": [[x, y], [x, y]], "mm": ...} or {"mm_per_pixel": ...}, optional
+#                                   "tolerance_mm" and "simplify_mm"
+#   GET    /images/ID/points        ?format=float32 (default), npy or csv. The point count is in X-Point-Count
+
+import argparse
+import io
+import json
+import os
+import socketserver
+import threading
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import numpy as np
+
+from auto_outline import AUTO_OUTLINE_METHODS
+from contour_tracer import ContourTracer
+from contour_tracer import SNAP_MODES
+from exporters import write_csv_lines
+from image_cache import ImageCache
+from image_cache import get_image_key
+from image_viewer import DOWNSAMPLE
+from scale_selector import ScaleSelector
+from simplify import simplify_points
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+MAX_IMAGES = 4  # images kept loaded. The least recently used one is dropped when another one is loaded
+SCREEN_WIDTH = 1920  # the magnet radius and edge level clicks are routed with are the ones of a window on this screen
+SCREEN_HEIGHT = 1080
+POINT_FORMATS = ("float32", "npy", "csv")
+
+
+class ServiceError(Exception):
+    # a request that can't be done, answered with status and the message
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def get_float(value):
+    # settings saved by the gui are the text of its entries
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_points_data(points, point_format):
+    # (N, 2) points in cm as the bytes of an exported file
+    if point_format == "float32":
+        return points.astype("<f4").tobytes()
+    elif point_format == "npy":
+        f = io.BytesIO()
+        np.save(f, points.astype("<f4"))
+        return f.getvalue()
+    elif point_format == "csv":
+        f = io.StringIO()
+        write_csv_lines(f, points)
+        return f.getvalue().encode()
+    raise ServiceError(400, "Unknown point format: %s (choose from %s)" % (point_format, ", ".join(POINT_FORMATS)))
+
+
+class TracedImage:
+    # A loaded image with its contour tracer and scale selector (which share the decoded image through the image
+    # store). Requests for one image are handled one at a time
+
+    def __init__(self, image_id, image_location, downsample, image_cache):
+        self.id = image_id
+        self.image_location = image_location
+        self.downsample = downsample
+        self.image_cache = image_cache
+        self.lock = threading.Lock()
+        self.tracer = ContourTracer(SCREEN_WIDTH, SCREEN_HEIGHT, image_cache=image_cache)
+        self.tracer.load_image(image_location, downsample)
+        self.selector = ScaleSelector(SCREEN_WIDTH, SCREEN_HEIGHT, image_cache=image_cache)
+        self.selector.load_image(image_location, downsample)
+        self.mm_per_pixel = None  # set by a script. Otherwise the scale is the one measured with the scale selector
+        self.settings = {}
+        self.load_settings()
+
+    def load_settings(self):
+        # the scale and tolerances last used with the image in the gui (or here)
+        if self.image_cache is not None:
+            self.settings = self.image_cache.load_settings(self.tracer.cache_key)
+
+    def reload(self):
+        # pick up what was changed in the gui since the image was loaded
+        if self.image_cache is not None:
+            self.tracer.load_session()
+            self.selector.load_session()
+            self.load_settings()
+
+    def close(self):
+        if self.tracer.edge_scheduler is not None:
+            self.tracer.edge_scheduler.stop()
+        self.tracer.store_release()
+        self.selector.store_release()
+
+    def get_scale_factor(self):
+        # cm per (downsampled) pixel, or None without a scale
+        if self.mm_per_pixel is not None:
+            return self.mm_per_pixel / 10.0 * self.downsample
+        scale_mm = get_float(self.settings.get("scale_mm"))
+        pixel_distance = self.selector.get_pixel_distance()
+        if scale_mm is None or scale_mm <= 0 or not pixel_distance:
+            return None
+        return scale_mm / 10.0 / pixel_distance
+
+    def get_info(self):
+        return {
+            "id": self.id,
+            "path": self.image_location,
+            "downsample": self.downsample,
+            "width": self.tracer.image_width,
+            "height": self.tracer.image_height,
+            "raw_width": self.tracer.raw_image_width,
+            "raw_height": self.tracer.raw_image_height,
+            "lasso_points": len(self.tracer.get_lasso_points()),
+            "cm_per_pixel": self.get_scale_factor(),
+            "tolerance_mm": get_float(self.settings.get("tolerance_mm")) or 0.0,
+            "simplify_mm": get_float(self.settings.get("simplify_mm")) or 0.0,
+        }
+
+    def get_image_point(self, point):
+        # pixels of the original image -> pixels of the downsampled image
+        if len(point) != 2:
+            raise ServiceError(400, "Points are [x, y]")
+        return float(point[0]) / self.downsample, float(point[1]) / self.downsample
+
+    def auto_outline(self, seed=None, box=None, method=None):
+        method = method or self.tracer.auto_outline_method
+        if method not in AUTO_OUTLINE_METHODS:
+            raise ServiceError(400, "Unknown auto outline method: %s" % method)
+        if seed is not None:
+            contour = self.tracer.auto_outline.find_outline(seed=self.get_image_point(seed), method=method)
+        elif box is not None and len(box) == 4:
+            (x0, y0), (x1, y1) = self.get_image_point(box[:2]), self.get_image_point(box[2:])
+            contour = self.tracer.auto_outline.find_outline(box=(x0, y0, x1, y1), method=method)
+        else:
+            raise ServiceError(400, "Give a seed [x, y] or a box [x0, y0, x1, y1]")
+        if contour is None:
+            raise ServiceError(422, "No object found")
+        self.tracer.select_contour(contour)
+        self.tracer.save_session()
+
+    def add_clicks(self, clicks, snap_mode=None, append=False):
+        # the same lasso clicking at these points in a window would give, with the window zoomed all the way out
+        snap_mode = snap_mode or self.tracer.snap_mode
+        if snap_mode not in SNAP_MODES:
+            raise ServiceError(400, "Unknown snap mode: %s" % snap_mode)
+        points = [self.get_image_point(click) for click in clicks]
+        tracer = self.tracer
+        if not append:
+            tracer.set_session_state({name: array[:0] for name, array in tracer.get_session_state().items()})
+        tracer.snap_mode = snap_mode
+        tracer.wait_for_edges()
+        for point in points:
+            tracer.click(point)
+        tracer.save_session()
+
+    def set_scale(self, points=None, mm=None, mm_per_pixel=None, tolerance_mm=None, simplify_mm=None):
+        settings = {}
+        if mm_per_pixel is not None:
+            if mm_per_pixel <= 0:
+                raise ServiceError(400, "mm_per_pixel has to be > 0")
+            self.mm_per_pixel = mm_per_pixel
+        elif points is not None and mm is not None:
+            if len(points) != 2 or mm <= 0:
+                raise ServiceError(400, "Give two points and their distance in mm (> 0)")
+            first_point, second_point = [self.get_image_point(point) for point in points]
+            self.selector.first_point = (int(first_point[0]), int(first_point[1]))
+            self.selector.second_point = (int(second_point[0]), int(second_point[1]))
+            self.selector.save_session()
+            self.mm_per_pixel = None
+            settings["scale_mm"] = "%g" % mm
+        if tolerance_mm is not None:
+            settings["tolerance_mm"] = "%g" % tolerance_mm
+        if simplify_mm is not None:
+            settings["simplify_mm"] = "%g" % simplify_mm
+        self.settings.update(settings)
+        if self.image_cache is not None and len(settings) > 0:
+            self.image_cache.save_settings(self.tracer.cache_key, settings)
+
+    def get_points(self):
+        # the lasso in cm with the scale, tolerance and simplification applied, like the "Save" button saves it.
+        # Returns (points, largest distance in cm the simplification moved the outline)
+        scale_factor = self.get_scale_factor()
+        if scale_factor is None:
+            raise ServiceError(409, "No scale set for this image")
+        if len(self.tracer.get_lasso_points()) == 0:
+            raise ServiceError(409, "No lasso traced on this image")
+        tolerance = (get_float(self.settings.get("tolerance_mm")) or 0.0) / 10.0
+        simplify_tolerance = (get_float(self.settings.get("simplify_mm")) or 0.0) / 10.0
+        return simplify_points(self.tracer.get_scaled_points(scale_factor, tolerance), simplify_tolerance)
+
+
+class TraceService:
+    # The loaded images, least recently used first
+
+    def __init__(self, image_cache=None, max_images=MAX_IMAGES):
+        self.image_cache = image_cache
+        self.max_images = max_images
+        self.images = OrderedDict()  # image id -> TracedImage
+        self.loading = {}  # image id -> threading.Event set once the image is loaded (or failed to load)
+        self.file_hashes = {}  # (path, size, modification time) -> content hash, so files are only hashed once
+        self.lock = threading.Lock()
+
+    def get_image_id(self, image_location, downsample):
+        # the image cache's key, so an image has the same id here as in the cache
+        if self.image_cache is not None:
+            return self.image_cache.get_key(image_location, downsample)
+        return get_image_key(image_location, downsample, self.file_hashes)
+
+    def load(self, image_location, downsample=DOWNSAMPLE):
+        if not os.path.isfile(image_location):
+            raise ServiceError(404, "No such image: %s" % image_location)
+        if downsample < 1:
+            raise ServiceError(400, "Not a valid downsample. Choose a number >= 1")
+        image_id = self.get_image_id(image_location, downsample)
+        # an image is loaded without the lock held, so other requests go on in the meantime. Requests for an image that
+        # is being loaded wait for it instead of loading it again
+        while True:
+            with self.lock:
+                image = self.images.get(image_id)
+                if image is not None:
+                    self.images.move_to_end(image_id)
+                    break
+                loaded = self.loading.get(image_id)
+                if loaded is None:
+                    loaded = self.loading[image_id] = threading.Event()
+                    break
+            loaded.wait()  # and then look again, or load it here if that load failed
+
+        if image is not None:
+            with image.lock:
+                image.reload()
+            return image
+
+        dropped = []
+        try:
+            image = TracedImage(image_id, os.path.abspath(image_location), downsample, self.image_cache)
+            with self.lock:
+                self.images[image_id] = image
+                while len(self.images) > self.max_images:
+                    dropped.append(self.images.popitem(last=False)[1])
+        except Exception as e:
+            raise ServiceError(422, "Could not load %s: %s" % (image_location, e))
+        finally:
+            with self.lock:
+                del self.loading[image_id]
+            loaded.set()
+        for image_to_drop in dropped:
+            image_to_drop.close()
+        return image
+
+    def get(self, image_id):
+        with self.lock:
+            if image_id == "latest" and len(self.images) > 0:
+                image_id = next(reversed(self.images))
+            if image_id not in self.images:
+                raise ServiceError(404, "No loaded image with id %s" % image_id)
+            self.images.move_to_end(image_id)
+            return self.images[image_id]
+
+    def remove(self, image_id):
+        image = self.get(image_id)
+        with self.lock:
+            self.images.pop(image.id, None)
+        image.close()
+
+    def get_infos(self):
+        with self.lock:
+            images = list(self.images.values())
+        return [image.get_info() for image in images]
+
+
+class TraceRequestHandler(BaseHTTPRequestHandler):
+    # self.server.service is the TraceService
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        try:
+            values = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ServiceError(400, "The body is not valid JSON")
+        if not isinstance(values, dict):
+            raise ServiceError(400, "The body has to be a JSON object")
+        return values
+
+    def send_data(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, values):
+        self.send_data(status, json.dumps(values).encode(), "application/json")
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            body = self.read_json() if method == "POST" else {}
+            self.route(method, parts, body, parse_qs(url.query))
+        except ServiceError as e:
+            self.send_json(e.status, {"error": str(e)})
+        except (TypeError, ValueError, KeyError) as e:
+            self.send_json(400, {"error": "Bad request: %s" % e})
+        except Exception as e:
+            # anything else (like an OpenCV error) is a bug, but the client still gets an answer
+            self.log_error("Error handling %s %s", method, self.path)
+            traceback.print_exc()
+            self.send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+
+    def route(self, method, parts, body, query):
+        service = self.server.service
+        if parts == ["health"] and method == "GET":
+            self.send_json(200, {"images": len(service.images)})
+        elif parts == ["images"] and method == "GET":
+            self.send_json(200, {"images": service.get_infos()})
+        elif parts == ["images"] and method == "POST":
+            image = service.load(body["path"], float(body.get("downsample", DOWNSAMPLE)))
+            self.send_json(200, image.get_info())
+        elif len(parts) == 2 and parts[0] == "images" and method == "DELETE":
+            service.remove(parts[1])
+            self.send_json(200, {"removed": parts[1]})
+        elif len(parts) in (2, 3) and parts[0] == "images":
+            image = service.get(parts[1])
+            action = parts[2] if len(parts) == 3 else None
+            with image.lock:
+                self.route_image(method, image, action, body, query)
+        else:
+            raise ServiceError(404, "Unknown request: %s /%s" % (method, "/".join(parts)))
+
+    def route_image(self, method, image, action, body, query):
+        if action is None and method == "GET":
+            self.send_json(200, image.get_info())
+        elif action == "auto_outline" and method == "POST":
+            image.auto_outline(body.get("seed"), body.get("box"), body.get("method"))
+            self.send_json(200, image.get_info())
+        elif action == "clicks" and method == "POST":
+            image.add_clicks(body["clicks"], body.get("snap_mode"), bool(body.get("append", False)))
+            self.send_json(200, image.get_info())
+        elif action == "scale" and method == "POST":
+            values = {name: float(body[name]) if body.get(name) is not None else None
+                      for name in ("mm", "mm_per_pixel", "tolerance_mm", "simplify_mm")}
+            image.set_scale(body.get("points"), **values)
+            self.send_json(200, image.get_info())
+        elif action == "points" and method == "GET":
+            point_format = query.get("format", ["float32"])[0]
+            points, max_deviation = image.get_points()
+            data = get_points_data(points, point_format)
+            content_type = "text/csv" if point_format == "csv" else "application/octet-stream"
+            self.send_data(200, data, content_type, {"X-Point-Count": str(len(points)),
+                                                     "X-Max-Deviation-Cm": repr(float(max_deviation))})
+        else:
+            raise ServiceError(404, "Unknown request: %s /images/%s/%s" % (method, image.id, action or ""))
+
+
+class UnixTraceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host=SERVICE_HOST, port=SERVICE_PORT, socket_location=None):
+    # an HTTP server for the service on host:port (port 0 picks a free one), or on a Unix socket. Call serve_forever()
+    if socket_location is not None:
+        if os.path.exists(socket_location):
+            os.remove(socket_location)
+        server = UnixTraceServer(socket_location, TraceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), TraceRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep contour tracers warm for CAD scripts and operators")
+    parser.add_argument("--host", default=SERVICE_HOST, help="only use localhost unless the network is trusted")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of a port")
+    parser.add_argument("--max-images", type=int, default=MAX_IMAGES)
+    parser.add_argument("--no-cache", action="store_true", help="don't use (or share) the image cache on disk")
+    args = parser.parse_args(argv)
+
+    service = TraceService(None if args.no_cache else ImageCache(), args.max_images)
+    server = make_server(service, args.host, args.port, args.socket)
+    print("Tracing service on", args.socket or "http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()